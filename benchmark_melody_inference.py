@@ -0,0 +1,78 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import time
+import numpy as np
+from tensorflow import keras
+from full_instrumental_melody import generate_melody
+
+def build_standin_model():
+    """
+    Build an untrained model with the same input/output shape as melody_generator.h5
+
+    Used when the trained model isn't available so the benchmark can still run.
+    """
+    return keras.Sequential([
+        keras.Input(shape=(50, 1)),
+        keras.layers.LSTM(128, return_sequences=True),
+        keras.layers.Dropout(0.2),
+        keras.layers.LSTM(128),
+        keras.layers.Dense(128, activation="softmax")
+    ])
+
+def time_mode(model, start_sequence, num_notes, mode, runs):
+    """
+    Time generate_melody() in one mode
+
+    Returns:
+    - (best notes/sec over all runs, generated notes of the last run)
+    """
+    best = 0.0
+    generated = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        generated = generate_melody(model, start_sequence, num_notes=num_notes, mode=mode)
+        elapsed = time.perf_counter() - start
+        best = max(best, num_notes / elapsed)
+    return best, generated[len(start_sequence):]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark melody model inference modes")
+    parser.add_argument("--model", default="models/melody_generator.h5", help="Path to the melody model")
+    parser.add_argument("--notes", type=int, default=128, help="Notes generated per run (one 8-measure section)")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per mode, best is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.model):
+        model = keras.models.load_model(args.model)
+        print(f"✅ Loaded {args.model}")
+    else:
+        model = build_standin_model()
+        print(f"ℹ️ {args.model} not found, using an untrained stand-in model")
+
+    start_sequence = np.random.RandomState(args.seed).randint(60, 72, size=50).tolist()
+
+    # Warm up every path so graph building isn't timed
+    generate_melody(model, start_sequence, num_notes=2, mode="window")
+    generate_melody(model, start_sequence, num_notes=2, mode="stateful")
+    generate_melody(model, start_sequence, num_notes=2, mode="compiled")
+
+    window_rate, window_notes = time_mode(model, start_sequence, args.notes, "window", args.runs)
+    stateful_rate, stateful_notes = time_mode(model, start_sequence, args.notes, "stateful", args.runs)
+    compiled_rate, compiled_notes = time_mode(model, start_sequence, args.notes, "compiled", args.runs)
+
+    compiled_matches = sum(a == b for a, b in zip(window_notes, compiled_notes))
+    matches = sum(a == b for a, b in zip(window_notes, stateful_notes))
+
+    print(f"window:   {window_rate:10.1f} notes/sec")
+    print(f"compiled: {compiled_rate:10.1f} notes/sec  ({compiled_rate / window_rate:.1f}x)")
+    print(f"stateful: {stateful_rate:10.1f} notes/sec  ({stateful_rate / window_rate:.1f}x, a different melody)")
+    print(f"compiled notes matching window mode: {compiled_matches}/{args.notes}")
+    # Stateful mode carries its hidden state past the window, so only its first note has to match
+    print(f"stateful notes matching window mode: {matches}/{args.notes} (only the first is expected to)")
+
+if __name__ == "__main__":
+    main()
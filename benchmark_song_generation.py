@@ -0,0 +1,241 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# Song lengths (in measures) measured by default
+DEFAULT_SIZES = [16, 64, 256, 1024, 4096]
+
+class StubMelodyModel:
+    """
+    Stand-in for melody_generator.h5 with a fixed, known cost per prediction
+
+    predict() busy-waits for cost_ms and then returns a one-hot next note, so
+    timings measure the pipeline around the model rather than TensorFlow.
+    """
+
+    def __init__(self, cost_ms=0.1, vocab_size=128):
+        self.cost = cost_ms / 1000.0
+        self.vocab_size = vocab_size
+        self.calls = 0
+
+    def predict(self, x, verbose=0):
+        end = time.perf_counter() + self.cost
+        while time.perf_counter() < end:
+            pass
+        self.calls += 1
+
+        probabilities = np.zeros((x.shape[0], self.vocab_size), dtype=np.float32)
+        # Walk up a C major-ish scale from the last note
+        next_notes = 60 + (x[:, -1, 0].astype(np.int64) + 2) % 12
+        probabilities[np.arange(x.shape[0]), next_notes] = 1.0
+        return probabilities
+
+def structure_for_measures(measures, section_lengths):
+    """
+    Repeat the default song structure until it covers the requested measures
+    """
+    from full_instrumental_melody import DEFAULT_SONG_STRUCTURE
+
+    structure = []
+    total = 0
+    while total < measures:
+        section = DEFAULT_SONG_STRUCTURE[len(structure) % len(DEFAULT_SONG_STRUCTURE)]
+        structure.append(section)
+        total += section_lengths[section]
+    return structure, total
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_size(measures, seed, model_kind, stub_cost_ms, music21_max_measures):
+    """
+    Measure one song length; runs in its own process so peak RSS is per size
+
+    Returns:
+    - Result dict
+    """
+    import full_instrumental_melody as fim
+    from note_events import concat_events, events_to_score
+    from midi_writer import encode_smf
+    # music21 loads lazily on export; import it here so the import isn't timed
+    import music21
+
+    model = StubMelodyModel(stub_cost_ms) if model_kind == "stub" else None
+    fim.melody_model = model
+
+    section_lengths = fim.DEFAULT_SECTION_LENGTHS
+    structure, total_measures = structure_for_measures(measures, section_lengths)
+    stages = defaultdict(float)
+
+    @contextmanager
+    def stage(name):
+        start = time.perf_counter()
+        yield
+        stages[name] += time.perf_counter() - start
+
+    # Each generator on its own, over the same sections the song uses
+    random.seed(seed)
+    np.random.seed(seed)
+    for section in structure:
+        length = section_lengths[section]
+        complexity = fim.section_complexity(section)
+
+        with stage("create_chord_progression"):
+            progression = fim.create_chord_progression(length=length,
+                                                       pattern=fim.section_progression(section, length))
+        with stage("create_bassline"):
+            fim.create_bassline(progression, complexity=complexity)
+        with stage("create_drum_pattern"):
+            fim.create_drum_grid(length=length, style=fim.section_drum_style(section), intensity=complexity)
+
+        if model is not None and section in ["verse", "chorus"]:
+            start_sequence = np.random.randint(60, 72, size=50).tolist()
+            with stage("generate_melody"):
+                fim.generate_melody(model, start_sequence, num_notes=length * 16)
+        else:
+            with stage("create_musical_melody"):
+                fim.create_musical_melody(length=length * 16, start_note=72, complexity=complexity)
+
+    # Counted apart from the end-to-end run's calls
+    stage_model_calls = 0
+    if model is not None:
+        stage_model_calls, model.calls = model.calls, 0
+
+    # Whole pipeline: every section rendered to events, then encoded
+    random.seed(seed)
+    np.random.seed(seed)
+    with stage("render_sections"):
+        blocks = []
+        current_measure = 0
+        for section in structure:
+            events = fim.render_section(section, section_lengths[section])
+            events["onset"] += current_measure * 4
+            blocks.append(events)
+            current_measure += section_lengths[section]
+        events = concat_events(blocks)
+    with stage("smf_encode"):
+        encode_smf(events, fim.SONG_TRACKS, bpm=100)
+
+    # music21 stream assembly and song.write, skipped for long songs
+    if total_measures <= music21_max_measures:
+        with stage("stream_assembly"):
+            song = events_to_score(events, fim.SONG_TRACKS, bpm=100)
+        with tempfile.TemporaryDirectory() as tmp:
+            with stage("song_write"):
+                song.write("midi", fp=os.path.join(tmp, "song.mid"))
+
+    # End to end, as callers run it
+    random.seed(seed)
+    np.random.seed(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        fim.generate_multi_instrument_song(os.path.join(tmp, "song.mid"), melody_mode="window",
+                                           song_structure=structure)
+        total = time.perf_counter() - start
+
+    return {
+        "measures": total_measures,
+        "sections": len(structure),
+        "notes": int(len(events)),
+        "stages": {name: round(seconds, 6) for name, seconds in stages.items()},
+        "total_seconds": round(total, 6),
+        "notes_per_sec": round(len(events) / total, 1),
+        "model_calls": model.calls if model is not None else 0,
+        "stage_model_calls": stage_model_calls,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+def compare(results, baseline_path):
+    """
+    Print how each size and stage changed against a previous results file
+    """
+    with open(baseline_path) as f:
+        baseline = {r["measures"]: r for r in json.load(f)["results"]}
+
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get(result["measures"])
+        if old is None:
+            continue
+        print(f"  {result['measures']} measures: total {old['total_seconds'] / result['total_seconds']:.2f}x")
+        for name, seconds in result["stages"].items():
+            if name in old["stages"] and seconds > 0:
+                print(f"    {name:26s} {old['stages'][name] / seconds:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generate_multi_instrument_song() stage by stage")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Song lengths in measures")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--model", choices=["stub", "none"], default="stub",
+                        help="Melody model: stub of known cost, or none (scale-based only)")
+    parser.add_argument("--stub-cost-ms", type=float, default=0.1, help="Cost of one stub prediction")
+    parser.add_argument("--music21-max-measures", type=int, default=256,
+                        help="Skip music21 assembly/write for longer songs")
+    parser.add_argument("--output", help="Results JSON (default: output/benchmarks/song_generation_<commit>.json)")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        # Child process: measure one size, result on the last stdout line
+        result = run_size(args.run_one, args.seed, args.model, args.stub_cost_ms, args.music21_max_measures)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for measures in args.sizes:
+        command = [sys.executable, os.path.abspath(__file__), "--run-one", str(measures),
+                   "--seed", str(args.seed), "--model", args.model,
+                   "--stub-cost-ms", str(args.stub_cost_ms),
+                   "--music21-max-measures", str(args.music21_max_measures)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+
+        print(f"📊 {result['measures']:5d} measures: {result['notes']:8d} notes, "
+              f"{result['total_seconds']:8.3f}s, {result['notes_per_sec']:10.1f} notes/sec, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB, {result['model_calls']} model calls "
+              f"({result.get('stage_model_calls', 0)} in the stages)")
+        for name, seconds in sorted(result["stages"].items(), key=lambda item: -item[1]):
+            print(f"      {name:26s} {seconds:9.4f}s")
+
+    commit = git_commit()
+    output_path = args.output or os.path.join("output", "benchmarks", f"song_generation_{commit}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "seed": args.seed,
+            "model": args.model,
+            "stub_cost_ms": args.stub_cost_ms,
+            "results": results
+        }, f, indent=2)
+    print(f"✅ Results saved to {output_path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Code run in a fresh interpreter for every case. Each prints a JSON line with
+# the seconds spent importing and generating, and which heavy libraries ended
+# up loaded.
+CASES = {
+    "import full_instrumental_melody": """
+import full_instrumental_melody
+""",
+    "import generate_melody": """
+import generate_melody
+""",
+    "scale-only section": """
+import full_instrumental_melody as fim
+mark("import")
+fim.melody_model = None
+fim.create_drum_pattern(length=4, style="rock")
+fim.render_section("verse", 8)
+""",
+    "scale-only song": """
+import tempfile
+import full_instrumental_melody as fim
+mark("import")
+fim.melody_model = None
+with tempfile.TemporaryDirectory() as tmp:
+    fim.generate_multi_instrument_song(os.path.join(tmp, "song.mid"))
+""",
+    "first model use": """
+import full_instrumental_melody as fim
+mark("import")
+fim.song_melody_model()
+""",
+}
+
+# Cases that must fit in the startup budget (the model case loads TensorFlow
+# whenever the model file exists, so it is only reported)
+BUDGETED_CASES = ["import full_instrumental_melody", "import generate_melody",
+                  "scale-only section", "scale-only song"]
+
+CHILD_TEMPLATE = """
+import time
+start = time.perf_counter()
+import contextlib, io, json, os, sys
+marks = {{}}
+def mark(name):
+    marks[name] = time.perf_counter() - start
+with contextlib.redirect_stdout(io.StringIO()):
+{body}
+mark("total")
+marks.setdefault("import", marks["total"])
+print(json.dumps({{"seconds": marks,
+                  "tensorflow": "tensorflow" in sys.modules,
+                  "music21": "music21" in sys.modules}}))
+"""
+
+def run_case(body, env):
+    """
+    Run one case in a new interpreter
+
+    Returns:
+    - (wall seconds including interpreter startup, result dict from the child)
+    """
+    code = CHILD_TEMPLATE.format(body="\n".join("    " + line for line in body.strip().splitlines()))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    wall = time.perf_counter() - start
+    return wall, json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the song builders take to start")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per case, best is reported")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="Seconds scale-only cases may take, interpreter startup included")
+    parser.add_argument("--skip-model", action="store_true", help="Don't measure the first model use")
+    args = parser.parse_args()
+
+    # Run from the current directory (models/ is looked up there), importing
+    # the song builders from next to this script
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get("PYTHONPATH")]))
+
+    # Bare interpreter startup, for reference
+    baseline = min(run_case("pass", env)[0] for _ in range(args.runs))
+    print(f"python startup:                  {baseline:7.3f}s")
+
+    over_budget = []
+    for name, body in CASES.items():
+        if args.skip_model and name == "first model use":
+            continue
+
+        runs = [run_case(body, env) for _ in range(args.runs)]
+        wall, result = min(runs, key=lambda run: run[0])
+        seconds = result["seconds"]
+
+        loaded = [library for library in ("tensorflow", "music21") if result[library]]
+        print(f"{name + ':':32s} {wall:7.3f}s  (import {seconds['import']:.3f}s, "
+              f"total {seconds['total']:.3f}s in process)  "
+              f"loaded: {', '.join(loaded) or 'no tensorflow/music21'}")
+
+        if name in BUDGETED_CASES and wall > args.budget:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"❌ Over the {args.budget:.1f}s budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"✅ Scale-only generation starts within {args.budget:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,104 @@ import os
 # Disable GPU to avoid CUDA errors
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 
-from tensorflow.keras.models import load_model
 import numpy as np
-from music21 import stream, note, midi, instrument, tempo as music21_tempo, chord, duration, metadata
+import contextlib
 import os
 import random
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from melody_inference import (get_melody_model, generate_melody_stateful, generate_melody_compiled,
+                              generate_melody_batch, generate_melody_sampled, generate_melody_tflite,
+                              get_tflite_model)
+from markov_melody import MarkovMelodyModel
+from melody_tflite import TFLiteMelodyModel
+from note_events import (MELODY_DTYPE, melody_array, melody_events, chord_events, grid_events, concat_events,
+                         events_to_score)
+from midi_writer import write_smf, SMFStreamWriter
+from section_cache import SectionCache
+from music_theory import (PROGRESSIONS, MELODY_INTERVALS, BASS_PATTERNS, melody_scale, chord_voicings,
+                          rhythm_pattern_for, complexity_tier, score_melody_candidates)
 
-# Load the trained melody generator model
-try:
-    melody_model = load_model("models/melody_generator.h5")
-    print("✅ Melody Model Loaded Successfully!")
-except:
-    print("ℹ️ Model not found, will use scale-based generation only")
-    melody_model = None
+def __getattr__(name):
+    # The trained melody generator model is loaded (with TensorFlow) on first
+    # access of melody_model rather than at import; assigning melody_model
+    # replaces it
+    if name == "melody_model":
+        return song_melody_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def generate_melody(model, start_sequence, num_notes=100):
+def song_melody_model():
+    """
+    Return the melody model songs are built with, loading it on first use
+    
+    Returns:
+    - Keras, Markov or TFLite model, or None for scale-based generation only
+    """
+    if "melody_model" not in globals():
+        globals()["melody_model"] = get_melody_model()
+    return globals()["melody_model"]
+
+SONG_TITLE = "Generated Multi-Instrument Song"
+SONG_COMPOSER = "AI Composer"
+
+# Output tracks of a generated song, in track order. Programs and instruments
+# match the music21 parts the song was originally built from.
+SONG_TRACKS = [
+    {"name": "lead", "instrument": "Piano", "program": 0, "channel": 0, "velocity": (90, 110)},
+    {"name": "pad", "instrument": "ElectricGuitar", "program": 26, "channel": 1, "velocity": (60, 75),
+     "chords": True},
+    {"name": "bass", "instrument": "ElectricBass", "program": 33, "channel": 2, "velocity": (90, 110)},
+    {"name": "rhythm", "instrument": "ElectricGuitar", "program": 26, "channel": 3, "velocity": (70, 85),
+     "chords": True},
+    {"name": "drums", "instrument": "Dulcimer", "program": 15, "channel": 4, "velocity": (80, 100)}
+]
+TRACK_INDEX = {track["name"]: i for i, track in enumerate(SONG_TRACKS)}
+
+def part_events(part_name, notes, onset, rests=None):
+    """
+    Convert one part's (note or chord, duration) list into events on its track
+    
+    Args:
+    - part_name: Name of a track in SONG_TRACKS
+    - notes: List of (note or chord notes or None, duration) pairs (or a
+      MELODY_DTYPE array for single-note parts)
+    - onset: Start time in quarter notes
+    - rests: Optional boolean mask of pairs to silence
+    
+    Returns:
+    - Event array
+    """
+    track_index = TRACK_INDEX[part_name]
+    track = SONG_TRACKS[track_index]
+    if track.get("chords"):
+        return chord_events(notes, onset, track_index, track["channel"], track["velocity"], rests=rests)
+    if rests is not None:
+        notes = melody_array(notes).copy()
+        notes["pitch"][rests] = -1
+    return melody_events(notes, onset, track_index, track["channel"], track["velocity"])
+
+def drum_events(drum_grid, onset):
+    """
+    Convert a drum step grid into sixteenth-note events on the drum track
+    
+    Args:
+    - drum_grid: Boolean grid from create_drum_grid()
+    - onset: Start time in quarter notes
+    
+    Returns:
+    - Event array
+    """
+    track_index = TRACK_INDEX["drums"]
+    track = SONG_TRACKS[track_index]
+    return grid_events(drum_grid, DRUM_PITCHES, onset, 0.25, track_index, track["channel"], track["velocity"])
+
+# "sample" mode: continuations sampled per melody (the best scoring one is
+# kept), their temperature, and how many of the likeliest notes a draw may pick
+MELODY_CANDIDATES = 8
+SAMPLE_TEMPERATURE = 1.0
+SAMPLE_TOP_K = 12
+
+def generate_melody(model, start_sequence, num_notes=100, mode="window"):
     """
     Generate a melody using the trained model.
     
@@ -24,18 +107,243 @@ def generate_melody(model, start_sequence, num_notes=100):
     - model: Trained melody generator model.
     - start_sequence: Initial sequence to start generation.
     - num_notes: Number of notes to generate.
+    - mode: "window" reruns the model over the last 50 notes for every note,
+      "stateful" feeds one note per step and carries the hidden state forward
+      (a different melody from "window" after the first note),
+      "compiled" runs the window loop in a traced graph (same notes as "window",
+      the fast mode to use for window mode's melodies),
+      "tflite" runs the converted (quantized) model from melody_tflite.py;
+      a TFLiteMelodyModel always runs as "tflite" (and samples in "sample" mode),
+      a MarkovMelodyModel samples from its tables in every mode but "sample",
+      "sample" draws MELODY_CANDIDATES continuations in one batch and keeps
+      the best (see generate_best_melodies())
     
     Returns:
     - Generated melody sequence.
     """
-    generated_notes = start_sequence[:]
+    profiling.count("melody_generations")
+    with profiling.span("generate_melody", mode=mode, notes=num_notes):
+        if mode != "window" or isinstance(model, (MarkovMelodyModel, TFLiteMelodyModel)):
+            # One forward pass (of every candidate at once in "sample" mode) per note
+            profiling.count("model_predictions", num_notes)
+        if mode == "sample":
+            uniforms = np.random.random_sample((MELODY_CANDIDATES, num_notes))
+            return generate_best_melodies(model, [start_sequence], [num_notes], [uniforms])[0]
+        if isinstance(model, MarkovMelodyModel):
+            # Has no predict(): one uniform draw per new note instead
+            return model.generate_batch([start_sequence], [num_notes], [np.random.random_sample(num_notes)])[0]
+        if mode == "tflite" or isinstance(model, TFLiteMelodyModel):
+            return generate_melody_tflite(model, start_sequence, num_notes)
+        if mode == "stateful":
+            return generate_melody_stateful(model, start_sequence, num_notes)
+        if mode == "compiled":
+            return generate_melody_compiled(model, start_sequence, num_notes)
+    
+        generated_notes = start_sequence[:]
+    
+        for _ in range(num_notes):
+            input_seq = np.array(generated_notes[-50:]).reshape(1, 50, 1)  # Use last 50 notes as input
+            profiling.count("model_predictions")
+            predicted_note = np.argmax(model.predict(input_seq, verbose=0))  # Predict next note
+            generated_notes.append(predicted_note)
+    
+        return generated_notes
+
+def model_notes_to_pitches(generated_notes):
+    """
+    Map raw model output to the G3-C6 pitches model_notes_to_melody() plays
+    
+    The sequence is stretched over the range from its own lowest to its
+    highest note, so the mapped pitches (and pitch classes) depend on the
+    whole sequence.
+    
+    Returns:
+    - int16 array of MIDI notes
+    """
+    notes = np.asarray(generated_notes, dtype=np.float64)
+    if not len(notes):
+        return np.zeros(0, dtype=np.int16)
+    
+    # Map to a proper musical range (G3 to C6)
+    min_note, max_note = 55, 84  # G3 to C6
+    
+    # Normalize to the 0-1 range of the original sequence, then map to the target range
+    orig_min = notes.min()
+    orig_range = max(1.0, notes.max() - orig_min)  # Avoid division by zero
+    return (min_note + np.round((notes - orig_min) / orig_range * (max_note - min_note))).astype(np.int16)
+
+def model_notes_to_melody(generated_notes, complexity=1.0, rng=np.random):
+    """
+    Turn raw model output into a melody
+    
+    Args:
+    - generated_notes: Note sequence returned by generate_melody()
+    - complexity: Controls the note durations
+    - rng: np.random.RandomState (or the np.random module) used for mixed durations
+    
+    Returns:
+    - MELODY_DTYPE array of notes mapped to G3-C6
+    """
+    notes = model_notes_to_pitches(generated_notes)
+    melody = np.zeros(len(notes), dtype=MELODY_DTYPE)
+    if not len(notes):
+        return melody
+    melody["pitch"] = notes
+    
+    # Every 4 notes share a duration, decided by complexity
+    if complexity < 0.7:
+        melody["duration"] = 1.0  # Quarter notes
+    elif complexity < 1.3:
+        melody["duration"] = 0.5  # Eighth notes
+    else:
+        groups = rng.choice([0.25, 0.5, 0.75, 1.0], size=(len(notes) + 3) // 4)  # Mixed durations
+        melody["duration"] = np.repeat(groups, 4)[:len(notes)]
+    
+    return melody
+
+def sample_melody_candidates(model, start_sequences, num_notes, uniforms, temperature=SAMPLE_TEMPERATURE,
+                             top_k=SAMPLE_TOP_K):
+    """
+    Sample continuations of several sequences together with any melody model
+    
+    Args:
+    - model: Keras model, MarkovMelodyModel or TFLiteMelodyModel
+    - start_sequences: List of K initial sequences
+    - num_notes: List of K note counts
+    - uniforms: List of K arrays of uniform draws, one per new note
+    - temperature, top_k: Sampling settings (see MelodyInferenceEngine.sample());
+      a MarkovMelodyModel samples its own table probabilities and ignores them
+    
+    Returns:
+    - List of K generated sequences (each start sequence followed by its new notes)
+    """
+    if isinstance(model, MarkovMelodyModel):
+        return model.generate_batch(start_sequences, num_notes, uniforms)
+    if isinstance(model, TFLiteMelodyModel):
+        return model.generate_batch(start_sequences, num_notes, uniforms=uniforms, temperature=temperature,
+                                    top_k=top_k)
+    return generate_melody_sampled(model, start_sequences, num_notes, uniforms, temperature=temperature,
+                                   top_k=top_k)
+
+def generate_best_melodies(model, start_sequences, num_notes, uniforms, song_key=60, song_scale="major",
+                           temperature=SAMPLE_TEMPERATURE, top_k=SAMPLE_TOP_K):
+    """
+    Sample several continuations of every sequence and keep the best scoring one
+    
+    All candidates of all K sequences are sampled in one batch, so every step
+    is still one forward pass; the candidates' new notes are scored with
+    music_theory.score_melody_candidates() (range fit, scale, repetition) as
+    they will be played, after model_notes_to_pitches() maps them.
+    
+    Args:
+    - model: Keras model, MarkovMelodyModel or TFLiteMelodyModel
+    - start_sequences: List of K initial sequences
+    - num_notes: List of K note counts
+    - uniforms: List of K arrays of shape (candidates, num_notes) of uniform draws
+    - song_key, song_scale: Key and scale candidates are scored against
+    - temperature, top_k: Sampling settings (see sample_melody_candidates())
+    
+    Returns:
+    - List of K generated sequences (each start sequence followed by its new notes)
+    """
+    counts = [len(draws) for draws in uniforms]
+    generated = sample_melody_candidates(
+        model,
+        [start for start, count in zip(start_sequences, counts) for _ in range(count)],
+        [n for n, count in zip(num_notes, counts) for _ in range(count)],
+        [row for draws in uniforms for row in draws],
+        temperature=temperature, top_k=top_k)
+    
+    best = []
+    position = 0
+    for start, count in zip(start_sequences, counts):
+        options = generated[position:position + count]
+        position += count
+        scores = score_melody_candidates([model_notes_to_pitches(notes)[len(start):] for notes in options],
+                                         song_key, song_scale)
+        best.append(options[int(np.argmax(scores))])
+    return best
+
+def generate_model_melodies(model, num_notes, complexities, start_sequences=None, seeds=None,
+                            mode="compiled", generate_batch=None, song_key=60, song_scale="major"):
+    """
+    Generate model-based melodies for several sections (or songs) at once
+    
+    In "compiled" mode all K sequences advance together in one batched forward
+    pass per step. Other modes fall back to one generate_melody() call each.
+    A MarkovMelodyModel samples all K sequences together whatever the mode, and
+    so does the TFLite model in "tflite" mode or given as a TFLiteMelodyModel.
+    In "sample" mode every sequence gets MELODY_CANDIDATES sampled
+    continuations, all K * MELODY_CANDIDATES in one batch, and keeps the best
+    (see generate_best_melodies()).
+    
+    Args:
+    - model: Trained melody generator model (Keras, MarkovMelodyModel or TFLiteMelodyModel)
+    - num_notes: List of K note counts, one per sequence
+    - complexities: List of K complexities, used for the note durations
+    - start_sequences: Optional list of K start sequences; random C4-C5 notes if omitted
+    - seeds: Optional list of K seeds, each driving its sequence's start notes
+      and durations; the global random state is used if omitted
+    - mode: Inference mode (see generate_melody())
+    - generate_batch: Optional callable(start_sequences, num_notes) used instead
+      of generate_melody_batch() in "compiled" mode, e.g. a shared batcher
+    - song_key, song_scale: Key and scale "sample" mode scores candidates against
+    
+    Returns:
+    - List of K melodies (MELODY_DTYPE arrays, see model_notes_to_melody())
+    """
+    count = len(num_notes)
+    if seeds is None:
+        np_rngs = [np.random] * count
+    else:
+        np_rngs = [np.random.RandomState(seed) for seed in seeds]
     
-    for _ in range(num_notes):
-        input_seq = np.array(generated_notes[-50:]).reshape(1, 50, 1)  # Use last 50 notes as input
-        predicted_note = np.argmax(model.predict(input_seq, verbose=0))  # Predict next note
-        generated_notes.append(predicted_note)
+    # Generate starting sequences in our desired range (C4 to C5)
+    if start_sequences is None:
+        start_sequences = [np_rng.randint(60, 72, size=50).tolist() for np_rng in np_rngs]
     
-    return generated_notes
+    # Batched modes are one generation for all K sequences, advancing them
+    # together one forward pass per note of the longest
+    batched = mode in ["sample", "tflite", "compiled"] or isinstance(model, (MarkovMelodyModel, TFLiteMelodyModel))
+    if batched and count:
+        profiling.count("melody_generations")
+        profiling.count("model_predictions", max(num_notes))
+    
+    with profiling.span("generate_model_melodies", mode=mode, sequences=count, notes=sum(num_notes)):
+        if mode == "sample":
+            # Draws for every candidate from each sequence's own random state
+            uniforms = [np_rng.random_sample((MELODY_CANDIDATES, n)) for np_rng, n in zip(np_rngs, num_notes)]
+            generated = generate_best_melodies(model, start_sequences, num_notes, uniforms, song_key, song_scale)
+        elif isinstance(model, MarkovMelodyModel):
+            # One uniform draw per new note, from each sequence's own random state
+            uniforms = [np_rng.random_sample(n) for np_rng, n in zip(np_rngs, num_notes)]
+            generated = model.generate_batch(start_sequences, num_notes, uniforms)
+        elif mode == "tflite" or isinstance(model, TFLiteMelodyModel):
+            generated = get_tflite_model(model).generate_batch(start_sequences, num_notes)
+        elif mode == "compiled" and generate_batch is not None:
+            generated = generate_batch(start_sequences, num_notes)
+        elif mode == "compiled":
+            generated = generate_melody_batch(model, start_sequences, num_notes)
+        else:
+            # One generate_melody() call per sequence
+            generated = [generate_melody(model, start, num_notes=n, mode=mode)
+                         for start, n in zip(start_sequences, num_notes)]
+    
+    return [model_notes_to_melody(notes, complexity, np_rng)
+            for notes, complexity, np_rng in zip(generated, complexities, np_rngs)]
+
+def section_complexity(section):
+    """
+    Return the melody/bass/drum complexity used for a song section
+    """
+    if section in ["intro", "outro"]:
+        return 0.7
+    elif section == "verse":
+        return 1.0
+    elif section == "chorus":
+        return 1.3
+    elif section == "bridge":
+        return 1.5
 
 def create_musical_melody(length=32, scale_type="major", start_note=60, 
                           complexity=1.0, rhythm_pattern=None):
@@ -52,58 +360,18 @@ def create_musical_melody(length=32, scale_type="major", start_note=60,
     Returns:
     - List of (MIDI note numbers, duration) pairs in a proper musical scale
     """
-    # Define different scales (MIDI offsets from root)
-    scales = {
-        "major": [0, 2, 4, 5, 7, 9, 11, 12],  # Major scale
-        "minor": [0, 2, 3, 5, 7, 8, 10, 12],  # Natural minor scale
-        "pentatonic": [0, 2, 4, 7, 9, 12],    # Major pentatonic
-        "blues": [0, 3, 5, 6, 7, 10, 12],     # Blues scale
-        "dorian": [0, 2, 3, 5, 7, 9, 10, 12]  # Dorian mode
-    }
-    
-    # Default to major if scale type not found
-    current_scale = scales.get(scale_type, scales["major"])
+    # Scale notes in a good range (G3 to C6) and the scale position of every pitch
+    full_scale, position_lookup, _ = melody_scale(start_note, scale_type)
     
-    # Calculate the root note (C = 60, etc.)
-    root_note = start_note % 12
-    octave = start_note // 12 - 1
-    
-    # Build full scale across multiple octaves
-    full_scale = []
-    for octave_offset in range(-1, 3):  # -1 octave to +2 octaves
-        for note_offset in current_scale:
-            full_scale.append(root_note + note_offset + ((octave + octave_offset) * 12))
-    
-    # Filter to keep only notes in a good range (G3 to C6)
-    full_scale = [note for note in full_scale if 55 <= note <= 84]
-    
-    # Define rhythm patterns (quarter note = 1.0)
+    # Select a rhythm pattern based on complexity
     if not rhythm_pattern:
-        rhythm_patterns = [
-            [1.0, 1.0, 1.0, 1.0],  # Simple quarter notes
-            [0.5, 0.5, 1.0, 0.5, 0.5, 1.0],  # Eighth-quarter mix
-            [0.25, 0.25, 0.25, 0.25, 0.5, 0.5, 1.0],  # More complex
-            [0.5, 0.25, 0.25, 1.0, 0.5, 0.5],  # Syncopated
-            [1.5, 0.5, 1.0, 1.0]  # Dotted quarter + eighth
-        ]
-        # Select a rhythm pattern based on complexity
-        pattern_index = min(int(complexity * len(rhythm_patterns)), len(rhythm_patterns) - 1)
-        rhythm_pattern = rhythm_patterns[pattern_index]
-    
-    # Generate melody using the scale
-    melody = []
-    current_note = start_note
+        rhythm_pattern = rhythm_pattern_for(complexity)
     
     # Interval probabilities based on complexity
-    if complexity < 0.7:
-        intervals = [-1, 0, 0, 1, 1]  # Simple - small steps
-    elif complexity < 1.3:
-        intervals = [-2, -1, -1, 0, 0, 1, 1, 2]  # Medium - larger steps
-    else:
-        intervals = [-3, -2, -1, 0, 1, 2, 3, 4]  # Complex - larger jumps
+    intervals = MELODY_INTERVALS[complexity_tier(complexity)]
     
-    # Start with the provided note
-    melody.append((current_note, rhythm_pattern[0]))
+    # Generate melody using the scale, starting with the provided note
+    melody = [(start_note, rhythm_pattern[0])]
     
     rhythm_idx = 1
     for i in range(1, length):
@@ -113,16 +381,9 @@ def create_musical_melody(length=32, scale_type="major", start_note=60,
         # Decide the interval to the next note
         interval = random.choice(intervals)
         
-        # Find the current position in the scale
-        try:
-            current_pos = full_scale.index(last_note)
-        except ValueError:
-            # If last_note is None, choose a default position (e.g., 0)
-            if last_note is None:
-                current_pos = 0
-            else:
-                current_pos = min(range(len(full_scale)), key=lambda i: abs(full_scale[i] - last_note))
-
+        # Find the current position in the scale (closest scale note if the
+        # note isn't in it, bottom of the scale after a rest)
+        current_pos = 0 if last_note is None else int(position_lookup[last_note])
         
         # Calculate new position with boundary checks
         new_pos = max(0, min(len(full_scale) - 1, current_pos + interval))
@@ -142,89 +403,119 @@ def create_musical_melody(length=32, scale_type="major", start_note=60,
     
     return melody
 
+def create_musical_melodies(count, length=32, scale_type="major", start_note=60,
+                            complexity=1.0, rhythm_pattern=None, rng=None):
+    """
+    Create many scale-based melodies at once with NumPy
+    
+    Follows the same rules as create_musical_melody(), but every interval,
+    rest decision and duration for all melodies is drawn up front and the
+    scale walk is computed with array operations. After a rest the walk
+    restarts from the bottom of the scale, like create_musical_melody().
+    
+    Args:
+    - count: Number of melodies to generate
+    - length: Number of notes per melody
+    - scale_type: Type of scale to use (major, minor, pentatonic, blues, dorian)
+    - start_note: MIDI note every melody starts with
+    - complexity: Controls how complex the melodies should be (0.0-2.0)
+    - rhythm_pattern: Optional predefined rhythm pattern
+    - rng: np.random.RandomState to draw from (defaults to the global np.random state)
+    
+    Returns:
+    - (pitches, durations): int16 array of shape (count, length) with -1 for
+      rests, and float array of shape (length,) shared by all melodies
+    """
+    if rng is None:
+        rng = np.random
+    if length <= 0:
+        return np.zeros((count, 0), dtype=np.int16), np.zeros(0, dtype=np.float64)
+    
+    # Same scale tables as create_musical_melody(), G3 to C6
+    full_scale, position_lookup, snap = melody_scale(start_note, scale_type)
+    full_scale = np.array(full_scale)
+    top = len(full_scale) - 1
+    
+    if not rhythm_pattern:
+        rhythm_pattern = rhythm_pattern_for(complexity)
+    durations = np.resize(np.array(rhythm_pattern, dtype=np.float64), length)
+    
+    intervals = MELODY_INTERVALS[complexity_tier(complexity)]
+    
+    # Draw everything up front; column 0 is the start note
+    steps = np.zeros((count, length), dtype=np.int64)
+    steps[:, 0] = position_lookup[start_note]
+    steps[:, 1:] = rng.choice(intervals, size=(count, length - 1))
+    rests = np.zeros((count, length), dtype=bool)
+    rests[:, 1:] = rng.random_sample((count, length - 1)) < 0.05 * complexity
+    
+    # A note after a rest walks from position 0 instead of the previous note
+    restarts = np.zeros((count, length), dtype=bool)
+    restarts[:, 1:] = rests[:, :-1]
+    
+    # Free walk: cumulative sum of the steps, restarted after every rest
+    totals = np.cumsum(steps, axis=1)
+    columns = np.arange(length)
+    last_restart = np.maximum.accumulate(np.where(restarts, columns, 0), axis=1)
+    before_restart = np.take_along_axis(totals, np.maximum(last_restart - 1, 0), axis=1)
+    positions = totals - np.where(last_restart > 0, before_restart, 0)
+    
+    # Walks that leave the scale, or land on the second copy of the octave note
+    # (create_musical_melody() continues from the first copy, see snap), depend
+    # on the path taken, so those rows are advanced step by step (all at once)
+    outside = (positions < 0) | (positions > top)
+    redirected = snap[np.clip(positions, 0, top)] != np.clip(positions, 0, top)
+    stepped = np.flatnonzero((outside | redirected).any(axis=1))
+    if len(stepped):
+        walk = positions[stepped]
+        walk_steps = steps[stepped]
+        walk_restarts = restarts[stepped]
+        for i in range(1, length):
+            base = np.where(walk_restarts[:, i], 0, snap[walk[:, i - 1]])
+            walk[:, i] = np.clip(base + walk_steps[:, i], 0, top)
+        positions[stepped] = walk
+    
+    pitches = full_scale[positions].astype(np.int16)
+    pitches[:, 0] = start_note
+    pitches[rests] = -1
+    return pitches, durations
+
 def create_chord_progression(key=60, scale_type="major", length=4, pattern=None):
     """
     Create a chord progression based on a key and scale
     
     Args:
     - key: Root note of the key (60 = C)
-    - scale_type: Type of scale
+    - scale_type: Type of scale ("major" or "minor", anything else uses major)
     - length: Number of chords
     - pattern: Optional predefined chord pattern (list of scale degrees)
     
     Returns:
     - List of chord notes and durations
     """
-    # Common chord progressions by scale degrees (1-based)
-    progressions = {
-        "basic": [1, 4, 5, 1],         # I-IV-V-I
-        "pop": [1, 5, 6, 4],           # I-V-vi-IV
-        "blues": [1, 4, 1, 5, 4, 1],   # I-IV-I-V-IV-I
-        "jazz": [2, 5, 1, 6],          # ii-V-I-vi
-        "epic": [1, 5, 6, 3, 4, 1, 4, 5]  # I-V-vi-iii-IV-I-IV-V
-    }
-    
-    # Scale degrees to build chords (0-based)
-    scale_degrees = {
-        "major": [0, 2, 4, 5, 7, 9, 11],   # Major scale
-        "minor": [0, 2, 3, 5, 7, 8, 10]    # Natural minor
-    }
-    
-    # Chord types by scale degree (major or minor triads)
-    chord_types = {
-        "major": ["M", "m", "m", "M", "M", "m", "dim"],  # Major scale chord types
-        "minor": ["m", "dim", "M", "m", "m", "M", "M"]   # Minor scale chord types
-    }
-    
-    # Get the scale
-    scale = scale_degrees.get(scale_type, scale_degrees["major"])
-    
     # Select a progression or use the provided pattern
     if not pattern:
-        progression_type = random.choice(list(progressions.keys()))
-        pattern = progressions[progression_type]
+        progression_type = random.choice(list(PROGRESSIONS.keys()))
+        pattern = PROGRESSIONS[progression_type]
     
-    # Adjust pattern to be 0-based
-    pattern = [degree - 1 for degree in pattern]
+    # Triad and seventh voicing of every scale degree in this key
+    voicings = chord_voicings(key, scale_type)
     
     # Create the chord progression
     progression = []
-    root_note = key % 12
-    octave = key // 12 - 1
     
     # Duration for each chord (in quarter notes)
     chord_duration = 4.0  # Default to one measure per chord (4 beats)
     
     for degree in pattern[:length]:  # Limit to requested length
-        # Get the root note of this chord
-        chord_root = root_note + scale[degree % len(scale)] + (octave * 12)
+        # Pattern degrees are 1-based
+        triad, seventh = voicings[(degree - 1) % len(voicings)]
         
-        # Determine chord type (major, minor, diminished)
-        chord_type = chord_types[scale_type][degree % len(scale)]
-        
-        # Build the chord
-        chord_notes = [chord_root]  # Root note
-        
-        # Add third
-        if chord_type == "M":
-            chord_notes.append(chord_root + 4)  # Major third
-        elif chord_type in ["m", "dim"]:
-            chord_notes.append(chord_root + 3)  # Minor third
-            
-        # Add fifth
-        if chord_type in ["M", "m"]:
-            chord_notes.append(chord_root + 7)  # Perfect fifth
-        elif chord_type == "dim":
-            chord_notes.append(chord_root + 6)  # Diminished fifth
-            
         # Add seventh for more complex chords (optional)
         if random.random() > 0.6:
-            if chord_type == "M":
-                chord_notes.append(chord_root + 11)  # Major seventh
-            elif chord_type == "m":
-                chord_notes.append(chord_root + 10)  # Minor seventh
-            elif chord_type == "dim":
-                chord_notes.append(chord_root + 9)   # Diminished seventh
+            chord_notes = list(seventh)
+        else:
+            chord_notes = list(triad)
                 
         progression.append((chord_notes, chord_duration))
     
@@ -241,31 +532,136 @@ def create_bassline(chord_progression, complexity=1.0):
     Returns:
     - List of (note, duration) pairs
     """
-    bassline = []
+    # Different bassline patterns based on complexity (root, root and fifth, walking)
+    pattern = BASS_PATTERNS[complexity_tier(complexity)]
     
+    bassline = []
     for chord, total_duration in chord_progression:
         root_note = chord[0]
-        
-        # Different bassline patterns based on complexity
-        if complexity < 0.7:
-            # Simple - just the root note
-            bassline.append((root_note - 12, total_duration))
-            
-        elif complexity < 1.3:
-            # Medium - root and fifth pattern
-            bassline.append((root_note - 12, total_duration / 2))
-            bassline.append((root_note - 5, total_duration / 2))
-            
-        else:
-            # Complex - walking bass pattern
-            fifth = root_note - 5
-            bassline.append((root_note - 12, total_duration / 4))
-            bassline.append((root_note - 5, total_duration / 4))
-            bassline.append((root_note - 7, total_duration / 4))
-            bassline.append((root_note - 10, total_duration / 4))
+        for offset, share in pattern:
+            bassline.append((root_note + offset, total_duration * share))
     
     return bassline
 
+# MIDI notes for different drum sounds, in drum grid row order
+DRUM_NOTES = {
+    "kick": 36,     # Bass drum
+    "snare": 38,    # Snare drum
+    "hihat": 42,    # Closed hi-hat
+    "openhat": 46,  # Open hi-hat
+    "tom1": 47,     # Low-mid tom
+    "tom2": 45,     # Low tom
+    "crash": 49,    # Crash cymbal
+    "ride": 51      # Ride cymbal
+}
+DRUM_TYPES = list(DRUM_NOTES.keys())
+DRUM_PITCHES = np.array(list(DRUM_NOTES.values()), dtype=np.int16)
+
+# Basic patterns (16 steps per measure = 16th notes)
+DRUM_PATTERNS = {
+    "basic": {
+        "kick":   [1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0],
+        "snare":  [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0],
+        "hihat":  [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0]
+    },
+    "rock": {
+        "kick":   [1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0],
+        "snare":  [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0],
+        "hihat":  [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0]
+    },
+    "funk": {
+        "kick":   [1, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0],
+        "snare":  [0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0],
+        "hihat":  [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+    },
+    "jazz": {
+        "kick":   [1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0],
+        "ride":   [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0],
+        "hihat":  [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0]
+    }
+}
+
+def steps_to_mask(steps):
+    """
+    Pack a list of 16 on/off steps into a 16-bit mask (bit i = step i)
+    """
+    return sum(1 << i for i, hit in enumerate(steps) if hit)
+
+def masks_to_grid(masks):
+    """
+    Unpack 16-bit measure masks into a boolean step grid
+    
+    Args:
+    - masks: Integer array of shape (drum types, measures)
+    
+    Returns:
+    - Boolean array of shape (drum types, measures * 16)
+    """
+    masks = np.asarray(masks, dtype=np.uint16)
+    bits = (masks[..., None] >> np.arange(16, dtype=np.uint16)) & 1
+    return bits.reshape(masks.shape[0], -1).astype(bool)
+
+# One row of measure masks per style, in DRUM_TYPES order
+DRUM_PATTERN_MASKS = {
+    style: np.array([steps_to_mask(pattern.get(drum_type, [])) for drum_type in DRUM_TYPES], dtype=np.uint16)
+    for style, pattern in DRUM_PATTERNS.items()
+}
+
+def create_drum_fill(intensity=1.0):
+    """
+    Create a one-measure drum fill
+    
+    Args:
+    - intensity: More intense fills have more notes
+    
+    Returns:
+    - uint16 array of measure masks in DRUM_TYPES order
+    """
+    fill = np.zeros(len(DRUM_TYPES), dtype=np.uint16)
+    
+    # More intense fills have more notes
+    note_count = int(5 + intensity * 6)
+    
+    for _ in range(note_count):
+        drum_type = random.choice(["kick", "snare", "tom1", "tom2"])
+        position = random.randint(0, 15)
+        fill[DRUM_TYPES.index(drum_type)] |= 1 << position
+    
+    # Add crash at the end
+    fill[DRUM_TYPES.index("crash")] |= 1 << 15
+    
+    return fill
+
+def create_drum_grid(length=4, style="basic", intensity=1.0):
+    """
+    Create a drum pattern as a boolean step grid
+    
+    Args:
+    - length: Number of measures
+    - style: Drum style (basic, rock, funk, jazz)
+    - intensity: Controls fill frequency and complexity
+    
+    Returns:
+    - Boolean array of shape (len(DRUM_TYPES), length * 16), True where a drum hits
+    """
+    # Choose a pattern
+    if style not in DRUM_PATTERN_MASKS:
+        style = "basic"
+    
+    # Repeat the pattern's measure masks for every measure
+    masks = np.repeat(DRUM_PATTERN_MASKS[style][:, None], length, axis=1)
+    
+    if length > 0:
+        # A fill is rolled for every earlier measure but, as before, only the
+        # last measure plays one; the rolls keep seeded songs unchanged
+        for measure in range(length - 1):
+            random.random()
+        
+        # Final measure fill
+        masks[:, -1] = create_drum_fill(intensity)
+    
+    return masks_to_grid(masks)
+
 def create_drum_pattern(length=4, style="basic", intensity=1.0):
     """
     Create a drum pattern
@@ -276,112 +672,285 @@ def create_drum_pattern(length=4, style="basic", intensity=1.0):
     - intensity: Controls fill frequency and complexity
     
     Returns:
-    - Dictionary of drum notes by type
-    """
-    # MIDI notes for different drum sounds
-    drums = {
-        "kick": 36,     # Bass drum
-        "snare": 38,    # Snare drum
-        "hihat": 42,    # Closed hi-hat
-        "openhat": 46,  # Open hi-hat
-        "tom1": 47,     # Low-mid tom
-        "tom2": 45,     # Low tom
-        "crash": 49,    # Crash cymbal
-        "ride": 51      # Ride cymbal
+    - Dictionary of drum notes by type, each a list of (MIDI note or None, 0.25)
+      sixteenth steps (see create_drum_grid() for the compact form)
+    """
+    grid = create_drum_grid(length=length, style=style, intensity=intensity)
+    return {
+        drum_type: [(DRUM_NOTES[drum_type] if hit else None, 0.25) for hit in grid[row]]
+        for row, drum_type in enumerate(DRUM_TYPES)
     }
+
+# Chord progression (scale degrees) of every section type
+SECTION_PROGRESSIONS = {
+    "intro": [1, 5, 6, 4],
+    "verse": [1, 5, 6, 4, 1, 5, 4, 5],
+    "chorus": [1, 4, 6, 5, 1, 4, 6, 5],
+    "bridge": [6, 5, 4, 5],
+    "outro": [1, 5, 6, 1]
+}
+
+DEFAULT_SONG_STRUCTURE = ["intro", "verse", "chorus", "verse", "chorus", "bridge", "chorus", "outro"]
+DEFAULT_SECTION_LENGTHS = {
+    "intro": 4,
+    "verse": 8,
+    "chorus": 8,
+    "bridge": 4,
+    "outro": 4
+}
+
+# Sections whose model melodies are generated together in one batch. Keeps
+# memory bounded for very long song structures.
+MODEL_BATCH_SECTIONS = 32
+
+# Marker written after the last section, so every section's end is in the file
+SONG_END_MARKER = "end"
+
+def song_markers(song_structure, section_lengths):
+    """
+    Marker events naming every section at its start, plus SONG_END_MARKER
     
-    # Basic patterns (16 steps per measure = 16th notes)
-    patterns = {
-        "basic": {
-            "kick":   [1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0],
-            "snare":  [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0],
-            "hihat":  [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0]
-        },
-        "rock": {
-            "kick":   [1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0],
-            "snare":  [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0],
-            "hihat":  [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0]
-        },
-        "funk": {
-            "kick":   [1, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 0],
-            "snare":  [0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0],
-            "hihat":  [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
-        },
-        "jazz": {
-            "kick":   [1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0],
-            "ride":   [1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0, 1, 0],
-            "hihat":  [0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0]
-        }
-    }
+    Returns:
+    - List of (time in quarter notes, text) pairs
+    """
+    lengths = [section_lengths[section] * 4 for section in song_structure]  # 4 beats per measure
+    starts = np.concatenate(([0], np.cumsum(lengths))).tolist()
+    return list(zip(starts, list(song_structure) + [SONG_END_MARKER]))
+
+def section_progression(section, section_length):
+    """
+    Chord pattern of a section, repeated until it covers every measure
+    """
+    pattern = SECTION_PROGRESSIONS[section]
+    return (pattern * (section_length // len(pattern) + 1))[:section_length]
+
+def section_drum_style(section):
+    """
+    Return the drum style used for a song section
+    """
+    if section in ["intro", "outro"]:
+        return "basic"
+    elif section == "verse":
+        return "rock"
+    elif section == "chorus":
+        return "funk"
+    elif section == "bridge":
+        return "jazz"
+
+def render_section(section, section_length, song_key=60, song_scale="major", model_melody=None):
+    """
+    Build every part of one song section as note events
     
-    # Create fills based on intensity
-    def create_fill(intensity):
-        fill = {
-            "kick": [0] * 16,
-            "snare": [0] * 16,
-            "tom1": [0] * 16,
-            "tom2": [0] * 16,
-            "crash": [0] * 16
-        }
-        
-        # More intense fills have more notes
-        note_count = int(5 + intensity * 6)
+    Args:
+    - section: Section type (intro, verse, chorus, bridge, outro)
+    - section_length: Length in measures
+    - song_key: Root note of the key (60 = C)
+    - song_scale: Scale type
+    - model_melody: Optional (note, duration) melody from the trained model;
+      a scale-based melody is generated if omitted
+    
+    Returns:
+    - Event array with onsets relative to the start of the section
+    """
+    # Adjust complexity based on section
+    complexity = section_complexity(section)
+    
+    # Create chord progression for this section
+    with profiling.span("create_chord_progression"):
+        progression = create_chord_progression(key=song_key, scale_type=song_scale, length=section_length,
+                                               pattern=section_progression(section, section_length))
+    
+    # Create bassline from chord progression
+    with profiling.span("create_bassline"):
+        bassline = create_bassline(progression, complexity=complexity)
+    
+    # Create drum pattern
+    with profiling.span("create_drum_grid"):
+        drum_grid = create_drum_grid(length=section_length, style=section_drum_style(section),
+                                     intensity=complexity)
+    
+    # Create lead melody - use either the model or musical approach
+    if model_melody is not None:
+        # Use the melody the trained model generated for this section
+        melody = model_melody
+    else:
+        # Scale-based melody generation, 16 sixteenth notes per measure
+        melody_length = section_length * 16
+        with profiling.span("create_musical_melody"):
+            melody = create_musical_melody(length=melody_length, scale_type=song_scale, 
+                                         start_note=song_key + 12, complexity=complexity)
+    
+    # Create rhythm guitar/keyboard part based on chord progression
+    rhythm_part = []
+    for chord_notes, chord_duration in progression:
+        # Break chord into shorter rhythmic patterns based on section
+        if section == "verse":
+            # Quarter note strums
+            for _ in range(int(chord_duration)):
+                rhythm_part.append((chord_notes, 1.0))
+        elif section == "chorus":
+            # Eighth note strums
+            for _ in range(int(chord_duration * 2)):
+                rhythm_part.append((chord_notes, 0.5))
+        else:
+            # Whole note for intro, bridge, outro
+            rhythm_part.append((chord_notes, chord_duration))
+    
+    # Create pad/synthesizer part (long sustained chords)
+    pad_part = []
+    for chord_notes, chord_duration in progression:
+        # Always hold full duration
+        pad_part.append((chord_notes, chord_duration))
+    
+    # Add instrument silence during breaks
+    # Let's create dynamic arrangement by temporarily silencing some instruments,
+    # masking index ranges of the parts rather than rewriting their notes
+    melody_rests = np.zeros(len(melody), dtype=bool)
+    rhythm_rests = np.zeros(len(rhythm_part), dtype=bool)
+    
+    # INTRO: Start with just piano
+    if section == "intro":
+        # Silence all but piano for first half of intro
+        if section_length > 2:
+            melody_rests[:2 * 16] = True  # 2 measures * 16 16th notes
+    
+    # VERSE: Sometimes drop drums for a measure
+    elif section == "verse":
+        if random.random() > 0.7:
+            # Choose a measure to break
+            break_measure = random.randint(0, section_length - 1)
+            drum_grid[:, break_measure * 16:(break_measure + 1) * 16] = False
+    
+    # BRIDGE: Drop everything except piano and bass for first measures
+    elif section == "bridge":
+        # Silence rhythm and drums for first measure
+        rhythm_rests[:16] = True
         
-        for _ in range(note_count):
-            drum_type = random.choice(["kick", "snare", "tom1", "tom2"])
-            position = random.randint(0, 15)
-            fill[drum_type][position] = 1
+        drum_grid[:, :16] = False  # First measure
+    
+    # OUTRO: Gradually remove instruments
+    elif section == "outro":
+        # Keep only piano and bass in last measure
+        last_measure_start = (section_length - 1) * 16
         
-        # Add crash at the end
-        fill["crash"][-1] = 1
+        keep_crash = np.array([drum_type == "crash" for drum_type in DRUM_TYPES])  # Keep final crash
+        drum_grid[:, last_measure_start:last_measure_start + 16] &= keep_crash[:, None]
         
-        return fill
+        rhythm_rests[section_length - 1:] = True
     
-    # Choose a pattern
-    if style not in patterns:
-        style = "basic"
-    pattern = patterns[style]
+    # Collect the notes of every part as events
+    with profiling.span("part_events"):
+        return concat_events([
+            part_events("lead", melody, 0.0, rests=melody_rests),
+            part_events("rhythm", rhythm_part, 0.0, rests=rhythm_rests),
+            part_events("pad", pad_part, 0.0),
+            part_events("bass", bassline, 0.0),
+            drum_events(drum_grid, 0.0)
+        ])
+
+def vary_section(events, song_key=60, song_scale="major", amount=0.125):
+    """
+    Make a varied copy of a rendered section, for reused sections
     
-    # Expand pattern for desired length
-    drum_notes = {drum_type: [] for drum_type in drums.keys()}
+    Lead and drum velocities are drawn again, and some lead notes move one
+    step up or down the song's scale. Chords, bass and timing are kept.
     
-    for measure in range(length):
-        # Determine if this measure should have a fill
-        has_fill = (measure == length - 1) or (random.random() < 0.2 * intensity and measure > 0)
-        
-        if has_fill and measure == length - 1:
-            # Final measure fill
-            fill = create_fill(intensity)
-            for drum_type, positions in fill.items():
-                if drum_type in drum_notes:
-                    for pos, hit in enumerate(positions):
-                        if hit:
-                            # Duration: 16th note (0.25 quarter notes)
-                            drum_notes[drum_type].append((drums[drum_type], 0.25))
-                        else:
-                            # Rest
-                            drum_notes[drum_type].append((None, 0.25))
-        else:
-            # Regular pattern
-            for drum_type in pattern.keys():
-                positions = pattern[drum_type]
-                for pos, hit in enumerate(positions):
-                    if hit:
-                        # Duration: 16th note (0.25 quarter notes)
-                        drum_notes[drum_type].append((drums[drum_type], 0.25))
-                    else:
-                        # Rest
-                        drum_notes[drum_type].append((None, 0.25))
+    Args:
+    - events: Event array of the section (not modified)
+    - song_key: Root note of the key (60 = C)
+    - song_scale: Scale type
+    - amount: Share of lead notes that move
+    
+    Returns:
+    - New event array
+    """
+    events = events.copy()
     
-    return drum_notes
+    for part_name in ["lead", "drums"]:
+        rows = np.flatnonzero(events["track"] == TRACK_INDEX[part_name])
+        low, high = SONG_TRACKS[TRACK_INDEX[part_name]]["velocity"]
+        events["velocity"][rows] = np.random.randint(low, high + 1, size=len(rows))
+    
+    # Same scale the scale-based melodies use
+    full_scale, position_lookup, _ = melody_scale(song_key + 12, song_scale)
+    full_scale = np.array(full_scale, dtype=np.int16)
+    
+    lead = np.flatnonzero(events["track"] == TRACK_INDEX["lead"])
+    moved = lead[np.random.random_sample(len(lead)) < amount]
+    steps = np.random.choice([-1, 1], size=len(moved))
+    positions = position_lookup[np.clip(events["pitch"][moved], 0, 127)] + steps
+    events["pitch"][moved] = full_scale[np.clip(positions, 0, len(full_scale) - 1)]
+    
+    return events
 
-def generate_multi_instrument_song(filename="output/full_song.mid", bpm=100):
+def seed_random_state(seed_sequence):
+    """
+    Seed the global random and np.random states the song builders draw from
+    
+    Args:
+    - seed_sequence: np.random.SeedSequence of one song or section
+    """
+    python_seed, numpy_seed = seed_sequence.generate_state(2)
+    random.seed(int(python_seed))
+    np.random.seed(int(numpy_seed))
+
+def section_melody_seed(seed_sequence):
+    """
+    Seed of a section's model melody, independent of its rendering seeds
+    """
+    return int(seed_sequence.generate_state(3)[2])
+
+def render_section_task(task):
+    """
+    Render one section from a (section, length, key, scale, model melody,
+    seed sequence or None) tuple; runs in a pool process when sections are
+    rendered in parallel
+    
+    Returns:
+    - Event array with onsets relative to the start of the section
+    """
+    section, section_length, song_key, song_scale, model_melody, seed_sequence = task
+    with profiling.span("render_section", section=section, measures=section_length):
+        if seed_sequence is not None:
+            seed_random_state(seed_sequence)
+        return render_section(section, section_length, song_key, song_scale, model_melody=model_melody)
+
+def generate_multi_instrument_song(filename="output/full_song.mid", bpm=100, melody_mode="compiled",
+                                   export="smf", song_structure=None, section_lengths=None,
+                                   streaming=False, song_key=60, song_scale="major", generate_batch=None,
+                                   seed=None, section_workers=None, section_cache=None, render_lock=None):
     """
     Generate a complete song with multiple instruments
     
     Args:
     - filename: Output MIDI file name
     - bpm: Song tempo in BPM
+    - melody_mode: Inference mode passed to generate_model_melodies()
+    - export: "smf" encodes the note events straight to MIDI, with a marker
+      at every section and the notes tagged with their section (see
+      song_editor.py), "music21" builds a music21 Score and writes it with
+      song.write()
+    - song_structure: List of section types (DEFAULT_SONG_STRUCTURE if omitted)
+    - section_lengths: Measures per section type (DEFAULT_SECTION_LENGTHS if omitted)
+    - streaming: Encode and flush every section to the file as soon as it is
+      built, so memory depends on section size rather than song length
+      (SMF export only)
+    - song_key: Root note of the key (60 = C)
+    - song_scale: Scale type
+    - generate_batch: Optional batch melody generator passed to generate_model_melodies()
+    - seed: Optional int or np.random.SeedSequence. Every section then draws
+      from its own substream of it, so the song is the same however its
+      sections are spread over workers. Without it the global random state
+      is used (and seeds the substreams when section_workers is set).
+    - section_workers: Render sections in this many processes at once; the
+      model melodies are still generated here, batched per chunk
+    - section_cache: Optional SectionCache, or a policy name ("exact", "vary",
+      "regenerate") for a cache used by this song only. Repeated sections
+      with the same parameters then reuse the first one's events (and skip
+      its model melody)
+    - render_lock: Optional lock held while sections are rendered from the
+      process-wide random states, for callers building songs in threads; the
+      model melodies are generated outside it
     
     Returns:
     - Path to the generated MIDI file
@@ -389,290 +958,149 @@ def generate_multi_instrument_song(filename="output/full_song.mid", bpm=100):
     # Ensure output folder exists
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     
-    # Create a music21 stream
-    song = stream.Score()
+    # Song structure parameters
+    if song_structure is None:
+        song_structure = DEFAULT_SONG_STRUCTURE
+    if section_lengths is None:
+        section_lengths = DEFAULT_SECTION_LENGTHS
     
-    # Set metadata
-    song.insert(0, metadata.Metadata())
-    song.metadata.title = "Generated Multi-Instrument Song"
-    song.metadata.composer = "AI Composer"
+    if streaming and export != "smf":
+        raise ValueError("Streaming is only supported for SMF export")
     
-    # Set the tempo - FIXED: Use music21_tempo instead
-    song.insert(0, music21_tempo.MetronomeMark(number=bpm))
+    # One RNG substream per section
+    if seed is None and section_workers:
+        seed = int(np.random.randint(2 ** 32, dtype=np.int64))
+    section_seeds = None
+    if seed is not None:
+        if isinstance(seed, np.random.SeedSequence):
+            # A fresh copy, so the same SeedSequence always spawns the same substreams
+            seed_sequence = np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key)
+        else:
+            seed_sequence = np.random.SeedSequence(seed)
+        section_seeds = seed_sequence.spawn(len(song_structure))
     
-    # Song structure parameters
-    song_key = 60  # C
-    song_scale = "major"
-    song_structure = ["intro", "verse", "chorus", "verse", "chorus", "bridge", "chorus", "outro"]
-    section_lengths = {
-        "intro": 4,
-        "verse": 8,
-        "chorus": 8,
-        "bridge": 4,
-        "outro": 4
-    }
+    if isinstance(section_cache, str):
+        section_cache = SectionCache(section_cache)
+    if render_lock is None:
+        render_lock = contextlib.nullcontext()
+    with profiling.span("load_melody_model"):
+        melody_model = song_melody_model()
     
-    # Create instrumental parts
-    parts = {
-        "lead": {
-            "instrument": instrument.Piano(),
-            "part": stream.Part()
-        },
-        "pad": {
-            "instrument": instrument.ElectricGuitar(),
-
-            "part": stream.Part()
-        },
-        "bass": {
-            "instrument": instrument.ElectricBass(),
-            "part": stream.Part()
-        },
-        "rhythm": {
-            "instrument": instrument.ElectricGuitar(),
-            "part": stream.Part()
-        },
-        "drums": {
-            "instrument": instrument.Dulcimer(),
-            "part": stream.Part()
-        }
-    }
+    # Workers are shut down and a streamed song's files closed (or removed on an error) however this ends
+    with contextlib.ExitStack() as song_resources:
+        pool = None
+        if section_workers:
+            pool = song_resources.enter_context(ProcessPoolExecutor(max_workers=section_workers))
     
-    # Add instruments to parts
-    for part_info in parts.values():
-        part_info["part"].append(part_info["instrument"])
+        if streaming:
+            writer = song_resources.enter_context(
+                SMFStreamWriter(filename, SONG_TRACKS, bpm=bpm, title=SONG_TITLE, text=SONG_COMPOSER,
+                                markers=song_markers(song_structure, section_lengths), sections=True))
+        else:
+            # Note events of every section and their start times, joined when the song is written
+            event_blocks = []
+            block_offsets = []
     
-    # Process each section of the song
-    current_measure = 0
+        # Process the song in chunks of sections
+        current_measure = 0
+        model_sections_done = 0
     
-    for section in song_structure:
-        section_length = section_lengths[section]
-        # Adjust complexity based on section
-        if section in ["intro", "outro"]:
-            complexity = 0.7
-        elif section == "verse":
-            complexity = 1.0
-        elif section == "chorus":
-            complexity = 1.3
-        elif section == "bridge":
-            complexity = 1.5
-        
-        # Create chord progression for this section
-        if section == "intro":
-            progression = create_chord_progression(key=song_key, scale_type=song_scale, 
-                                                  length=section_length, pattern=[1, 5, 6, 4])
-        elif section == "verse":
-            progression = create_chord_progression(key=song_key, scale_type=song_scale, 
-                                                  length=section_length, pattern=[1, 5, 6, 4, 1, 5, 4, 5])
-        elif section == "chorus":
-            progression = create_chord_progression(key=song_key, scale_type=song_scale, 
-                                                  length=section_length, pattern=[1, 4, 6, 5, 1, 4, 6, 5])
-        elif section == "bridge":
-            progression = create_chord_progression(key=song_key, scale_type=song_scale, 
-                                                  length=section_length, pattern=[6, 5, 4, 5])
-        elif section == "outro":
-            progression = create_chord_progression(key=song_key, scale_type=song_scale, 
-                                                  length=section_length, pattern=[1, 5, 6, 1])
-        
-        # Create bassline from chord progression
-        bassline = create_bassline(progression, complexity=complexity)
-        
-        # Create drum pattern
-        if section in ["intro", "outro"]:
-            drum_style = "basic"
-        elif section == "verse":
-            drum_style = "rock"
-        elif section == "chorus":
-            drum_style = "funk"
-        elif section == "bridge":
-            drum_style = "jazz"
-            
-        drum_notes = create_drum_pattern(length=section_length, style=drum_style, intensity=complexity)
-        
-        # Create lead melody - use either the model or musical approach
-        if melody_model is not None and section in ["verse", "chorus"]:
-            # Use the trained model for melody generation
-            # Generate a starting sequence in our desired range (C4 to C5)
-            random_start = np.random.randint(60, 72, size=50).tolist()
-            
-            # Generate a melody
-            generated_melody = generate_melody(melody_model, random_start, num_notes=section_length * 16)
-            print(f"✅ Model-based melody generated for {section}")
-            
-            # Map to a proper musical range (G3 to C6)
-            min_note, max_note = 55, 84  # G3 to C6
-            
-            # Find the min and max of the original sequence
-            orig_min = min(generated_melody)
-            orig_max = max(generated_melody)
-            orig_range = max(1, orig_max - orig_min)  # Avoid division by zero
-            
-            # Map each note to the new range and convert to melody format
-            melody = []
-            for i, note_val in enumerate(generated_melody):
-                # Normalize to 0-1 range
-                normalized = (note_val - orig_min) / orig_range
-                # Map to target range
-                mapped_note = min_note + round(normalized * (max_note - min_note))
-                
-                # Every 4 notes, decide duration based on complexity
-                if i % 4 == 0:
-                    if complexity < 0.7:
-                        duration = 1.0  # Quarter note
-                    elif complexity < 1.3:
-                        duration = 0.5  # Eighth note
-                    else:
-                        duration = random.choice([0.25, 0.5, 0.75, 1.0])  # Mixed durations
-                
-                melody.append((mapped_note, duration))
-                
-        else:
-            # Scale-based melody generation
-            if section == "intro" or section == "outro":
-                # Simple melody for intro/outro
-                melody_length = section_length * 16  # 16 sixteenth notes per measure
-                melody = create_musical_melody(length=melody_length, scale_type=song_scale, 
-                                             start_note=song_key + 12, complexity=complexity)
-            else:
-                # More notes for other sections
-                melody_length = section_length * 16
-                melody = create_musical_melody(length=melody_length, scale_type=song_scale, 
-                                             start_note=song_key + 12, complexity=complexity)
+        for chunk_start in range(0, len(song_structure), MODEL_BATCH_SECTIONS):
+            chunk = song_structure[chunk_start:chunk_start + MODEL_BATCH_SECTIONS]
         
-        # Create rhythm guitar/keyboard part based on chord progression
-        rhythm_part = []
-        for chord_notes, chord_duration in progression:
-            # Break chord into shorter rhythmic patterns based on section
-            if section == "verse":
-                # Quarter note strums
-                for _ in range(int(chord_duration)):
-                    rhythm_part.append((chord_notes, 1.0))
-            elif section == "chorus":
-                # Eighth note strums
-                for _ in range(int(chord_duration * 2)):
-                    rhythm_part.append((chord_notes, 0.5))
-            else:
-                # Whole note for intro, bridge, outro
-                rhythm_part.append((chord_notes, chord_duration))
-        
-        # Create pad/synthesizer part (long sustained chords)
-        pad_part = []
-        for chord_notes, chord_duration in progression:
-            # Always hold full duration
-            pad_part.append((chord_notes, chord_duration))
+            # Sections to render: all of them without a cache, otherwise the first
+            # occurrence of every section the cache doesn't hold yet
+            keys = [(section, section_lengths[section], song_key, song_scale, melody_model is not None)
+                    for section in chunk]
+            fresh = []
+            planned = set()
+            for i, key in enumerate(keys):
+                if section_cache is None or section_cache.policy == "regenerate" or \
+                        (key not in section_cache and key not in planned):
+                    fresh.append(i)
+                    planned.add(key)
         
-        # Add instrument silence during breaks
-        # Let's create dynamic arrangement by temporarily silencing some instruments
+            # Generate the model-based melodies of the chunk's new verses and choruses in one batch
+            model_melodies = {}
+            if melody_model is not None:
+                model_sections = [i for i in fresh if chunk[i] in ["verse", "chorus"]]
+                melodies = generate_model_melodies(
+                    melody_model,
+                    [section_lengths[chunk[i]] * 16 for i in model_sections],
+                    [section_complexity(chunk[i]) for i in model_sections],
+                    seeds=None if section_seeds is None else
+                    [section_melody_seed(section_seeds[chunk_start + i]) for i in model_sections],
+                    mode=melody_mode, generate_batch=generate_batch, song_key=song_key, song_scale=song_scale)
+                model_melodies = dict(zip(model_sections, melodies))
+                model_sections_done += len(model_sections)
         
-        # INTRO: Start with just piano
-        if section == "intro":
-            # Silence all but piano for first half of intro
-            if section_length > 2:
-                for i in range(2 * 16):  # 2 measures * 16 16th notes
-                    if i < len(melody):
-                        melody[i] = (None, melody[i][1])  # Replace with rest
+            tasks = [(chunk[i], section_lengths[chunk[i]], song_key, song_scale, model_melodies.pop(i, None),
+                      None if section_seeds is None else section_seeds[chunk_start + i])
+                     for i in fresh]
+            with profiling.span("render_chunk", start=chunk_start, sections=len(tasks), workers=section_workers or 0), \
+                    render_lock:
+                if pool is not None:
+                    # Results come back in section order; worker processes aren't traced
+                    rendered = pool.map(render_section_task, tasks,
+                                        chunksize=max(1, len(tasks) // (4 * section_workers)))
+                else:
+                    rendered = map(render_section_task, tasks)
+                rendered = dict(zip(fresh, rendered))
         
-        # VERSE: Sometimes drop drums for a measure
-        elif section == "verse":
-            if random.random() > 0.7:
-                # Choose a measure to break
-                break_measure = random.randint(0, section_length - 1)
-                for drum_type in drum_notes:
-                    for i in range(break_measure * 16, (break_measure + 1) * 16):
-                        if i < len(drum_notes[drum_type]):
-                            drum_notes[drum_type][i] = (None, drum_notes[drum_type][i][1])
-        
-        # BRIDGE: Drop everything except piano and bass for first measures
-        elif section == "bridge":
-            # Silence rhythm and drums for first measure
-            for i in range(min(16, len(rhythm_part))):
-                rhythm_part[i] = (None, rhythm_part[i][1])  # Replace with rest
+            for i, section in enumerate(chunk):
+                section_length = section_lengths[section]
             
-            for drum_type in drum_notes:
-                for i in range(16):  # First measure
-                    if i < len(drum_notes[drum_type]):
-                        drum_notes[drum_type][i] = (None, drum_notes[drum_type][i][1])
-        
-        # OUTRO: Gradually remove instruments
-        elif section == "outro":
-            # Keep only piano and bass in last measure
-            last_measure_start = (section_length - 1) * 16
+                if i in rendered:
+                    section_events = rendered.pop(i)
+                    if section_cache is not None:
+                        section_events = section_cache.put(keys[i], section_events)
+                else:
+                    section_events = section_cache.get(keys[i])
+                    if section_cache.policy == "vary":
+                        with render_lock:
+                            if section_seeds is not None:
+                                seed_random_state(section_seeds[chunk_start + i])
+                            section_events = vary_section(section_events, song_key, song_scale)
             
-            for i in range(last_measure_start, last_measure_start + 16):
-                if i < len(melody):
-                    # Keep melody but make it softer
-                    pass
-                    
-            for drum_type in drum_notes:
-                for i in range(last_measure_start, last_measure_start + 16):
-                    if i < len(drum_notes[drum_type]):
-                        if drum_type != "crash":  # Keep final crash
-                            drum_notes[drum_type][i] = (None, drum_notes[drum_type][i][1])
+                profiling.count("notes_emitted", len(section_events))
+                section_start = current_measure * 4  # 4 beats per measure
+                section_end = (current_measure + section_length) * 4
+                if streaming:
+                    with profiling.span("write_section", index=chunk_start + i):
+                        writer.write_section(section_events, offset=section_start, end=section_end)
+                else:
+                    # Shifted when the blocks are joined, cached events stay as they are
+                    event_blocks.append(section_events)
+                    block_offsets.append(section_start)
             
-            for i in range(section_length - 1, len(rhythm_part)):
-                rhythm_part[i] = (None, rhythm_part[i][1])
-        
-        # Add melody notes to lead part
-        current_time = current_measure * 4  # 4 beats per measure
-        for note_value, note_duration in melody:
-            if note_value is not None:
-                new_note = note.Note(note_value)
-                new_note.duration.quarterLength = note_duration
-                new_note.volume.velocity = random.randint(90, 110)
-                parts["lead"]["part"].insert(current_time, new_note)
-            current_time += note_duration
-        
-        # Add rhythm notes
-        current_time = current_measure * 4
-        for chord_notes, chord_duration in rhythm_part:
-            if chord_notes is not None:
-                # Create a chord object
-                new_chord = chord.Chord(chord_notes)
-                new_chord.duration.quarterLength = chord_duration
-                new_chord.volume.velocity = random.randint(70, 85)
-                parts["rhythm"]["part"].insert(current_time, new_chord)
-            current_time += chord_duration
-        
-        # Add pad/synth notes
-        current_time = current_measure * 4
-        for chord_notes, chord_duration in pad_part:
-            if chord_notes is not None:
-                # Create a chord object
-                new_chord = chord.Chord(chord_notes)
-                new_chord.duration.quarterLength = chord_duration
-                new_chord.volume.velocity = random.randint(60, 75)
-                parts["pad"]["part"].insert(current_time, new_chord)
-            current_time += chord_duration
-        
-        # Add bass notes
-        current_time = current_measure * 4
-        for note_value, note_duration in bassline:
-            if note_value is not None:
-                new_note = note.Note(note_value)
-                new_note.duration.quarterLength = note_duration
-                new_note.volume.velocity = random.randint(90, 110)
-                parts["bass"]["part"].insert(current_time, new_note)
-            current_time += note_duration
-        
-        # Add drum notes
-        for drum_type, drum_sequence in drum_notes.items():
-            current_time = current_measure * 4
-            for note_value, note_duration in drum_sequence:
-                if note_value is not None:
-                    new_note = note.Note(note_value)
-                    new_note.duration.quarterLength = note_duration
-                    new_note.volume.velocity = random.randint(80, 100)
-                    parts["drums"]["part"].insert(current_time, new_note)
-                current_time += note_duration
-        
-        # Update current measure
-        current_measure += section_length
+                # Update current measure
+                current_measure += section_length
     
-    # Add all parts to the score
-    for part_info in parts.values():
-        song.insert(0, part_info["part"])
+        if pool is not None:
+            pool.shutdown()
     
-    # Save as MIDI file
-    song.write("midi", fp=filename)
+        if melody_model is not None:
+            print(f"✅ Model-based melodies generated for {model_sections_done} sections")
+        if section_cache is not None:
+            print(f"✅ {section_cache.report()}")
+    
+        # Save as MIDI file
+        with profiling.span("write_song", export=export, streaming=streaming):
+            if streaming:
+                writer.close()
+            elif export == "music21":
+                with profiling.span("events_to_score"):
+                    song = events_to_score(concat_events(event_blocks, block_offsets), SONG_TRACKS, bpm=bpm,
+                                           title=SONG_TITLE, composer=SONG_COMPOSER)
+                song.write("midi", fp=filename)
+            else:
+                # In section order, sectioned like a streamed song for song_editor.py
+                events = np.concatenate(event_blocks)
+                sizes = [len(block) for block in event_blocks]
+                events["onset"] += np.repeat(np.asarray(block_offsets, dtype=np.float64), sizes)
+                write_smf(filename, events, SONG_TRACKS, bpm=bpm, title=SONG_TITLE, text=SONG_COMPOSER,
+                          markers=song_markers(song_structure, section_lengths),
+                          sections=(np.repeat(np.arange(len(event_blocks)), sizes), block_offsets))
     print(f"✅ Multi-instrument song saved as {filename}")
     
     return filename
@@ -0,0 +1,234 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from melody_inference import MELODY_MODEL_PATH
+from section_cache import CACHE_POLICIES
+
+# Scale names accepted by --scale
+SCALE_NAMES = ["major", "minor"]
+
+# Note names used in output file names
+NOTE_NAMES = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+
+def song_seeds(master_seed, count):
+    """
+    Derive an independent seed for every song from one master seed
+
+    Song i always gets the same seed, however many songs are generated and
+    however they are spread over workers.
+
+    Args:
+    - master_seed: Seed of the whole batch
+    - count: Number of songs
+
+    Returns:
+    - List of count np.random.SeedSequence objects
+    """
+    return np.random.SeedSequence(master_seed).spawn(count)
+
+def parse_structure(value):
+    """
+    Turn "default" or a comma-separated list of sections into a song structure
+    """
+    from full_instrumental_melody import DEFAULT_SONG_STRUCTURE, SECTION_PROGRESSIONS
+
+    if value == "default":
+        return list(DEFAULT_SONG_STRUCTURE)
+    structure = [section.strip() for section in value.split(",") if section.strip()]
+    for section in structure:
+        if section not in SECTION_PROGRESSIONS:
+            raise argparse.ArgumentTypeError(f"Unknown section '{section}'")
+    return structure
+
+def song_jobs(args):
+    """
+    Expand the parameter grid into one job per song
+
+    Every combination of tempo, key, scale and structure is generated
+    args.count times.
+
+    Returns:
+    - List of job dicts (index, parameters, seed, output filename and song id)
+    """
+    grid = list(itertools.product(args.tempo, args.key, args.scale, args.structure))
+    seeds = song_seeds(args.seed, len(grid) * args.count)
+
+    jobs = []
+    for index, ((bpm, key, scale, structure), _) in enumerate(itertools.product(grid, range(args.count))):
+        name = f"song_{index:05d}_{bpm}bpm_{NOTE_NAMES[key % 12]}_{scale}.mid"
+        jobs.append({
+            "index": index,
+            "bpm": bpm,
+            "key": key,
+            "scale": scale,
+            "structure": structure,
+            "seed": seeds[index],
+            "section_cache": args.section_cache,
+            "cache_dir": args.cache_dir,
+            "model_path": args.model,
+            "cache_max_bytes": args.cache_max_mb * 1024 * 1024,
+            "pack_dir": args.pack,
+            "song_id": name[:-len(".mid")],
+            "filename": os.path.join(args.output_dir, name)
+        })
+    return jobs
+
+def init_worker(model_path, threads):
+    """
+    Set up a pool process: TensorFlow thread count and the model songs use
+    (None for scale-based melodies only)
+    """
+    import full_instrumental_melody as fim
+    from melody_inference import MELODY_MODEL_PATH, configure_threads, get_melody_model
+
+    if model_path is None:
+        fim.melody_model = None
+        return
+
+    if os.path.exists(model_path) and not model_path.endswith((".npz", ".tflite")):
+        # One pool process per core, so each keeps its TensorFlow to a few threads
+        configure_threads(threads, threads)
+    if model_path != MELODY_MODEL_PATH:
+        # The default model is loaded on first use, other ones are set here
+        with contextlib.redirect_stdout(io.StringIO()):
+            fim.melody_model = get_melody_model(model_path)
+
+# Song cache and pack writer of this pool process, opened on first use
+_song_cache = None
+_pack_writer = None
+
+def generate_song(job):
+    """
+    Generate one song of the batch (runs in a pool process)
+
+    The song's seed gives every section its own RNG substream (see
+    generate_multi_instrument_song()), so the output doesn't depend on which
+    worker runs it or what it ran before.
+
+    Returns:
+    - (job index, seconds taken, file size in bytes, True if it came from the song cache)
+    """
+    global _song_cache, _pack_writer
+    from full_instrumental_melody import generate_multi_instrument_song
+    from song_cache import SongCache, generate_song_cached
+    from song_pack import PackWriter
+
+    start = time.perf_counter()
+    params = dict(bpm=job["bpm"], song_structure=job["structure"], song_key=job["key"],
+                  song_scale=job["scale"], section_cache=job["section_cache"])
+    filename = job["filename"]
+    if job["pack_dir"]:
+        # Scratch file of this process, appended to its pack shard and removed
+        filename = os.path.join(job["pack_dir"], f".{os.getpid()}.mid")
+    cached = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        if job["cache_dir"]:
+            if _song_cache is None:
+                _song_cache = SongCache(job["cache_dir"], max_bytes=job["cache_max_bytes"])
+            _, cached = generate_song_cached(filename, _song_cache, job["seed"],
+                                             model_path=job["model_path"], **params)
+        else:
+            generate_multi_instrument_song(filename, seed=job["seed"], **params)
+    size = os.path.getsize(filename)
+
+    if job["pack_dir"]:
+        if _pack_writer is None:
+            _pack_writer = PackWriter(job["pack_dir"])
+        with open(filename, "rb") as f:
+            _pack_writer.add(job["song_id"], f.read(), seed=job["seed"],
+                             params={"index": job["index"], "bpm": job["bpm"], "key": job["key"],
+                                     "scale": job["scale"], "structure": job["structure"],
+                                     "section_cache": job["section_cache"]})
+        os.remove(filename)
+    return job["index"], time.perf_counter() - start, size, cached
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate many songs in parallel with reproducible seeds")
+    parser.add_argument("--count", type=int, default=1, help="Songs per parameter combination")
+    parser.add_argument("--tempo", type=int, nargs="+", default=[110], help="Tempos in BPM")
+    parser.add_argument("--key", type=int, nargs="+", default=[60], help="Key root notes (60 = C)")
+    parser.add_argument("--scale", nargs="+", choices=SCALE_NAMES, default=["major"])
+    parser.add_argument("--structure", type=parse_structure, nargs="+", default=["default"],
+                        help='"default" or comma-separated sections, e.g. intro,verse,chorus,outro')
+    parser.add_argument("--seed", type=int, default=0, help="Master seed of the batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Pool processes")
+    parser.add_argument("--threads", type=int, default=1, help="TensorFlow threads per pool process")
+    parser.add_argument("--model", default=MELODY_MODEL_PATH,
+                        help="Melody model (.h5 Keras model, .npz Markov tables or .tflite)")
+    parser.add_argument("--no-model", action="store_true", help="Scale-based melodies only")
+    parser.add_argument("--section-cache", choices=CACHE_POLICIES,
+                        help="Reuse repeated sections within each song (default: render every section)")
+    parser.add_argument("--cache-dir", help="Reuse songs generated before from this song cache directory")
+    parser.add_argument("--cache-max-mb", type=int, default=512, help="Size cap of the song cache")
+    parser.add_argument("--output-dir", default="output/batch")
+    parser.add_argument("--pack", metavar="DIR",
+                        help="Append songs to shard files in this directory (read them with song_pack.py) "
+                             "instead of writing one file per song")
+    args = parser.parse_args()
+
+    # argparse only runs type= on given values, not on the default
+    args.structure = [parse_structure(s) if isinstance(s, str) else s for s in args.structure]
+
+    output_dir = args.pack or args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = song_jobs(args)
+    print(f"🎵 Generating {len(jobs)} songs on {args.workers} workers (master seed {args.seed})")
+
+    start = time.perf_counter()
+    total_bytes = 0
+    song_seconds = 0.0
+    cache_hits = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(None if args.no_model else args.model, args.threads)) as pool:
+        futures = [pool.submit(generate_song, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), 1):
+            _, seconds, size, cached = future.result()
+            total_bytes += size
+            song_seconds += seconds
+            cache_hits += cached
+
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed
+            sys.stdout.write(f"\r[{done}/{len(jobs)}] {rate:.1f} songs/sec, "
+                             f"ETA {(len(jobs) - done) / rate:.0f}s   ")
+            sys.stdout.flush()
+    elapsed = time.perf_counter() - start
+    print()
+
+    # Everything needed to regenerate any single song
+    manifest = {
+        "master_seed": args.seed,
+        "songs": [{
+            "index": job["index"],
+            **({"id": job["song_id"]} if args.pack else {"file": os.path.basename(job["filename"])}),
+            "bpm": job["bpm"],
+            "key": job["key"],
+            "scale": job["scale"],
+            "structure": job["structure"],
+            "section_cache": job["section_cache"],
+            "seed_spawn_key": list(job["seed"].spawn_key)
+        } for job in jobs]
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"✅ {len(jobs)} songs ({total_bytes / 1e6:.1f} MB) in {elapsed:.2f}s: "
+          f"{len(jobs) / elapsed:.1f} songs/sec, {song_seconds / elapsed:.1f}x parallel speedup "
+          f"over the summed per-song time")
+    if args.pack:
+        print(f"✅ Songs packed into {args.pack}")
+    if args.cache_dir:
+        print(f"✅ Song cache: {cache_hits}/{len(jobs)} songs reused from {args.cache_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,21 @@ import os
 # Disable GPU to avoid CUDA errors
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 
-from tensorflow.keras.models import load_model
 import numpy as np
-from music21 import stream, note, midi, instrument, tempo, chord, duration, metadata
 import os
 import random
+from melody_inference import get_melody_model
+from music_theory import (PROGRESSIONS, MELODY_INTERVALS, BASS_PATTERNS, melody_scale, chord_voicings,
+                          rhythm_pattern_for, complexity_tier)
 
-# Load the trained melody generator model
-try:
-    melody_model = load_model("models/melody_generator.h5")
-    print("✅ Melody Model Loaded Successfully!")
-except:
-    print("ℹ️ Model not found, will use scale-based generation only")
-    melody_model = None
+def __getattr__(name):
+    # The trained melody generator model is loaded (with TensorFlow) on first
+    # access of melody_model rather than at import
+    if name == "melody_model":
+        model = get_melody_model()
+        globals()["melody_model"] = model
+        return model
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def create_musical_melody(length=32, scale_type="major", start_note=60, 
                           complexity=1.0, rhythm_pattern=None):
@@ -31,58 +33,18 @@ def create_musical_melody(length=32, scale_type="major", start_note=60,
     Returns:
     - List of (MIDI note numbers, duration) pairs in a proper musical scale
     """
-    # Define different scales (MIDI offsets from root)
-    scales = {
-        "major": [0, 2, 4, 5, 7, 9, 11, 12],  # Major scale
-        "minor": [0, 2, 3, 5, 7, 8, 10, 12],  # Natural minor scale
-        "pentatonic": [0, 2, 4, 7, 9, 12],    # Major pentatonic
-        "blues": [0, 3, 5, 6, 7, 10, 12],     # Blues scale
-        "dorian": [0, 2, 3, 5, 7, 9, 10, 12]  # Dorian mode
-    }
-    
-    # Default to major if scale type not found
-    current_scale = scales.get(scale_type, scales["major"])
-    
-    # Calculate the root note (C = 60, etc.)
-    root_note = start_note % 12
-    octave = start_note // 12 - 1
+    # Scale notes in a good range (G3 to C6) and the scale position of every pitch
+    full_scale, position_lookup, _ = melody_scale(start_note, scale_type)
     
-    # Build full scale across multiple octaves
-    full_scale = []
-    for octave_offset in range(-1, 3):  # -1 octave to +2 octaves
-        for note_offset in current_scale:
-            full_scale.append(root_note + note_offset + ((octave + octave_offset) * 12))
-    
-    # Filter to keep only notes in a good range (G3 to C6)
-    full_scale = [note for note in full_scale if 55 <= note <= 84]
-    
-    # Define rhythm patterns (quarter note = 1.0)
+    # Select a rhythm pattern based on complexity
     if not rhythm_pattern:
-        rhythm_patterns = [
-            [1.0, 1.0, 1.0, 1.0],  # Simple quarter notes
-            [0.5, 0.5, 1.0, 0.5, 0.5, 1.0],  # Eighth-quarter mix
-            [0.25, 0.25, 0.25, 0.25, 0.5, 0.5, 1.0],  # More complex
-            [0.5, 0.25, 0.25, 1.0, 0.5, 0.5],  # Syncopated
-            [1.5, 0.5, 1.0, 1.0]  # Dotted quarter + eighth
-        ]
-        # Select a rhythm pattern based on complexity
-        pattern_index = min(int(complexity * len(rhythm_patterns)), len(rhythm_patterns) - 1)
-        rhythm_pattern = rhythm_patterns[pattern_index]
-    
-    # Generate melody using the scale
-    melody = []
-    current_note = start_note
+        rhythm_pattern = rhythm_pattern_for(complexity)
     
     # Interval probabilities based on complexity
-    if complexity < 0.7:
-        intervals = [-1, 0, 0, 1, 1]  # Simple - small steps
-    elif complexity < 1.3:
-        intervals = [-2, -1, -1, 0, 0, 1, 1, 2]  # Medium - larger steps
-    else:
-        intervals = [-3, -2, -1, 0, 1, 2, 3, 4]  # Complex - larger jumps
+    intervals = MELODY_INTERVALS[complexity_tier(complexity)]
     
-    # Start with the provided note
-    melody.append((current_note, rhythm_pattern[0]))
+    # Generate melody using the scale, starting with the provided note
+    melody = [(start_note, rhythm_pattern[0])]
     
     rhythm_idx = 1
     for i in range(1, length):
@@ -92,13 +54,9 @@ def create_musical_melody(length=32, scale_type="major", start_note=60,
         # Decide the interval to the next note
         interval = random.choice(intervals)
         
-        # Find the current position in the scale
-        try:
-            current_pos = full_scale.index(last_note)
-        except ValueError:
-            # If the note isn't in our scale, find the closest one
-            current_pos = min(range(len(full_scale)), 
-                             key=lambda i: abs(full_scale[i] - last_note))
+        # Find the current position in the scale (closest scale note if the
+        # note isn't in it, bottom of the scale after a rest)
+        current_pos = 0 if last_note is None else int(position_lookup[last_note])
         
         # Calculate new position with boundary checks
         new_pos = max(0, min(len(full_scale) - 1, current_pos + interval))
@@ -124,83 +82,36 @@ def create_chord_progression(key=60, scale_type="major", length=4, pattern=None)
     
     Args:
     - key: Root note of the key (60 = C)
-    - scale_type: Type of scale
+    - scale_type: Type of scale ("major" or "minor", anything else uses major)
     - length: Number of chords
     - pattern: Optional predefined chord pattern (list of scale degrees)
     
     Returns:
     - List of chord notes and durations
     """
-    # Common chord progressions by scale degrees (1-based)
-    progressions = {
-        "basic": [1, 4, 5, 1],         # I-IV-V-I
-        "pop": [1, 5, 6, 4],           # I-V-vi-IV
-        "blues": [1, 4, 1, 5, 4, 1],   # I-IV-I-V-IV-I
-        "jazz": [2, 5, 1, 6],          # ii-V-I-vi
-        "epic": [1, 5, 6, 3, 4, 1, 4, 5]  # I-V-vi-iii-IV-I-IV-V
-    }
-    
-    # Scale degrees to build chords (0-based)
-    scale_degrees = {
-        "major": [0, 2, 4, 5, 7, 9, 11],   # Major scale
-        "minor": [0, 2, 3, 5, 7, 8, 10]    # Natural minor
-    }
-    
-    # Chord types by scale degree (major or minor triads)
-    chord_types = {
-        "major": ["M", "m", "m", "M", "M", "m", "dim"],  # Major scale chord types
-        "minor": ["m", "dim", "M", "m", "m", "M", "M"]   # Minor scale chord types
-    }
-    
-    # Get the scale
-    scale = scale_degrees.get(scale_type, scale_degrees["major"])
-    
     # Select a progression or use the provided pattern
     if not pattern:
-        progression_type = random.choice(list(progressions.keys()))
-        pattern = progressions[progression_type]
+        progression_type = random.choice(list(PROGRESSIONS.keys()))
+        pattern = PROGRESSIONS[progression_type]
     
-    # Adjust pattern to be 0-based
-    pattern = [degree - 1 for degree in pattern]
+    # Triad and seventh voicing of every scale degree in this key
+    voicings = chord_voicings(key, scale_type)
     
     # Create the chord progression
     progression = []
-    root_note = key % 12
-    octave = key // 12 - 1
     
     # Duration for each chord (in quarter notes)
     chord_duration = 4.0  # Default to one measure per chord (4 beats)
     
     for degree in pattern[:length]:  # Limit to requested length
-        # Get the root note of this chord
-        chord_root = root_note + scale[degree % len(scale)] + (octave * 12)
+        # Pattern degrees are 1-based
+        triad, seventh = voicings[(degree - 1) % len(voicings)]
         
-        # Determine chord type (major, minor, diminished)
-        chord_type = chord_types[scale_type][degree % len(scale)]
-        
-        # Build the chord
-        chord_notes = [chord_root]  # Root note
-        
-        # Add third
-        if chord_type == "M":
-            chord_notes.append(chord_root + 4)  # Major third
-        elif chord_type in ["m", "dim"]:
-            chord_notes.append(chord_root + 3)  # Minor third
-            
-        # Add fifth
-        if chord_type in ["M", "m"]:
-            chord_notes.append(chord_root + 7)  # Perfect fifth
-        elif chord_type == "dim":
-            chord_notes.append(chord_root + 6)  # Diminished fifth
-            
         # Add seventh for more complex chords (optional)
         if random.random() > 0.6:
-            if chord_type == "M":
-                chord_notes.append(chord_root + 11)  # Major seventh
-            elif chord_type == "m":
-                chord_notes.append(chord_root + 10)  # Minor seventh
-            elif chord_type == "dim":
-                chord_notes.append(chord_root + 9)   # Diminished seventh
+            chord_notes = list(seventh)
+        else:
+            chord_notes = list(triad)
                 
         progression.append((chord_notes, chord_duration))
     
@@ -217,28 +128,14 @@ def create_bassline(chord_progression, complexity=1.0):
     Returns:
     - List of (note, duration) pairs
     """
-    bassline = []
+    # Different bassline patterns based on complexity (root, root and fifth, walking)
+    pattern = BASS_PATTERNS[complexity_tier(complexity)]
     
+    bassline = []
     for chord, total_duration in chord_progression:
         root_note = chord[0]
-        
-        # Different bassline patterns based on complexity
-        if complexity < 0.7:
-            # Simple - just the root note
-            bassline.append((root_note - 12, total_duration))
-            
-        elif complexity < 1.3:
-            # Medium - root and fifth pattern
-            bassline.append((root_note - 12, total_duration / 2))
-            bassline.append((root_note - 5, total_duration / 2))
-            
-        else:
-            # Complex - walking bass pattern
-            fifth = root_note - 5
-            bassline.append((root_note - 12, total_duration / 4))
-            bassline.append((root_note - 5, total_duration / 4))
-            bassline.append((root_note - 7, total_duration / 4))
-            bassline.append((root_note - 10, total_duration / 4))
+        for offset, share in pattern:
+            bassline.append((root_note + offset, total_duration * share))
     
     return bassline
 
@@ -362,6 +259,9 @@ def generate_multi_instrument_song(filename="output/full_song.mid", tempo=100):
     Returns:
     - Path to the generated MIDI file
     """
+    # music21 is only needed once a song is built
+    from music21 import stream, note, instrument, chord, metadata, tempo as music21_tempo
+    
     # Ensure output folder exists
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     
@@ -374,7 +274,7 @@ def generate_multi_instrument_song(filename="output/full_song.mid", tempo=100):
     song.metadata.composer = "AI Composer"
     
     # Set the tempo
-    song.insert(0, tempo.MetronomeMark(number=tempo))
+    song.insert(0, music21_tempo.MetronomeMark(number=tempo))
     
     # Song structure parameters
     song_key = 60  # C
@@ -0,0 +1,269 @@
+import argparse
+import os
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Pitches are MIDI notes, contexts are written in base 128
+PITCHES = 128
+
+# Default file the trained tables are saved to
+MARKOV_MODEL_PATH = "models/melody_markov.npz"
+
+class MarkovMelodyModel:
+    """
+    Order-k n-gram model of melody pitches, a fast alternative to the Keras model
+
+    For every context length n from k down to 0 the model keeps the
+    contexts seen in training (the last n pitches written as one base-128
+    number, sorted) and, CSR style, the pitches that followed each context
+    with their cumulative probabilities. A context that wasn't seen backs off
+    to the next shorter one; n = 0 is the overall pitch distribution.
+
+    Sampling works on a whole batch of sequences per step: every table
+    lookup is one np.searchsorted() over the batch, and so is drawing the
+    next pitch, because each row's cumulative probabilities are stored with
+    the row number added (row r covers (r, r + 1]).
+
+    Can be used as melody_model: generate_model_melodies() calls
+    generate_batch() instead of running a neural net.
+    """
+
+    def __init__(self, order, contexts, indptr, next_notes, cumulative):
+        self.order = order
+        # Per context length n = 0..order
+        self.contexts = contexts
+        self.indptr = indptr
+        self.next_notes = next_notes
+        self.cumulative = cumulative
+
+        # Search keys: row index plus cumulative probability
+        self._keys = [np.repeat(np.arange(len(ptr) - 1, dtype=np.float64), np.diff(ptr)) + cum
+                      for ptr, cum in zip(indptr, cumulative)]
+
+    @classmethod
+    def train(cls, lines, order=3):
+        """
+        Count pitch transitions in melody lines
+
+        Args:
+        - lines: Iterable of pitch sequences (e.g. from midi_reader.melody_lines())
+        - order: Longest context, in notes
+
+        Returns:
+        - MarkovMelodyModel
+        """
+        if not 0 <= order <= 7:
+            # Contexts plus the next note must fit in an int64
+            raise ValueError("Order must be between 0 and 7")
+
+        lines = [np.asarray(line, dtype=np.int64) for line in lines]
+        contexts, indptr, next_notes, cumulative = [], [], [], []
+
+        for n in range(order + 1):
+            pairs = []
+            for line in lines:
+                if len(line) <= n:
+                    continue
+                if n:
+                    windows = sliding_window_view(line[:-1], n)
+                    codes = windows @ (PITCHES ** np.arange(n - 1, -1, -1, dtype=np.int64))
+                else:
+                    codes = np.zeros(len(line), dtype=np.int64)
+                pairs.append(codes * PITCHES + line[n:])
+
+            if pairs:
+                pair_codes, counts = np.unique(np.concatenate(pairs), return_counts=True)
+            else:
+                pair_codes, counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+            codes = pair_codes // PITCHES
+            context_codes, starts = np.unique(codes, return_index=True)
+            row_pointer = np.append(starts, len(codes)).astype(np.int32)
+
+            # Cumulative counts within each row, scaled to end at exactly 1
+            running = np.cumsum(counts)
+            before_row = np.concatenate(([0], running))[row_pointer[:-1]]
+            totals = running[row_pointer[1:] - 1] - before_row
+            lengths = np.diff(row_pointer)
+            row_cumulative = (running - np.repeat(before_row, lengths)) / np.repeat(totals, lengths)
+            row_cumulative[row_pointer[1:] - 1] = 1.0
+
+            contexts.append(context_codes.astype(np.int64))
+            indptr.append(row_pointer)
+            next_notes.append((pair_codes % PITCHES).astype(np.uint8))
+            cumulative.append(row_cumulative.astype(np.float32))
+
+        return cls(order, contexts, indptr, next_notes, cumulative)
+
+    def save(self, path):
+        """
+        Save the tables as a compressed .npz file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {"order": np.array(self.order)}
+        for n in range(self.order + 1):
+            arrays[f"contexts_{n}"] = self.contexts[n]
+            arrays[f"indptr_{n}"] = self.indptr[n]
+            arrays[f"next_notes_{n}"] = self.next_notes[n]
+            arrays[f"cumulative_{n}"] = self.cumulative[n]
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load tables saved with save()
+        """
+        with np.load(path) as data:
+            order = int(data["order"])
+            return cls(order, *([data[f"{name}_{n}"] for n in range(order + 1)]
+                                for name in ("contexts", "indptr", "next_notes", "cumulative")))
+
+    def generate(self, start_sequences, uniforms):
+        """
+        Sample continuations for a batch of sequences
+
+        Args:
+        - start_sequences: B sequences of at least order notes
+        - uniforms: Array of shape (B, steps) of uniform [0, 1) draws, one per new note
+
+        Returns:
+        - int16 array of shape (B, steps) with the new notes
+        """
+        uniforms = np.asarray(uniforms, dtype=np.float64)
+        batch, steps = uniforms.shape
+        generated = np.zeros((batch, steps), dtype=np.int16)
+        if batch == 0 or steps == 0:
+            return generated
+
+        # Last `order` notes of every sequence as one base-128 number
+        code = np.zeros(batch, dtype=np.int64)
+        if self.order:
+            history = np.array([sequence[-self.order:] for sequence in start_sequences], dtype=np.int64)
+            code = history @ (PITCHES ** np.arange(self.order - 1, -1, -1, dtype=np.int64))
+        modulus = PITCHES ** self.order
+
+        for step in range(steps):
+            # Longest context first, backing off for sequences it hasn't seen
+            pending = np.arange(batch)
+            for n in range(self.order, -1, -1):
+                contexts = self.contexts[n]
+                if not len(contexts):
+                    continue
+                # Shorter contexts are the low digits of the full one
+                context = code[pending] % (PITCHES ** n)
+                rows = np.searchsorted(contexts, context)
+                found = rows < len(contexts)
+                found[found] = contexts[rows[found]] == context[found]
+
+                hits = pending[found]
+                picks = np.searchsorted(self._keys[n], rows[found] + uniforms[hits, step], side="right")
+                generated[hits, step] = self.next_notes[n][picks]
+
+                pending = pending[~found]
+                if not len(pending):
+                    break
+
+            code = (code * PITCHES + generated[:, step]) % modulus
+
+        return generated
+
+    def generate_batch(self, start_sequences, num_notes, uniforms):
+        """
+        Generate several melodies together, like melody_inference.generate_melody_batch()
+
+        Args:
+        - start_sequences: List of K initial sequences
+        - num_notes: List of K note counts
+        - uniforms: List of K arrays of uniform draws, at least num_notes each
+
+        Returns:
+        - List of K generated sequences (each start sequence followed by its new notes)
+        """
+        if not start_sequences:
+            return []
+        steps = max(num_notes)
+        draws = np.zeros((len(start_sequences), steps), dtype=np.float64)
+        for i, (count, values) in enumerate(zip(num_notes, uniforms)):
+            draws[i, :count] = values[:count]
+
+        new_notes = self.generate(start_sequences, draws)
+        return [list(start) + new_notes[i, :count].tolist()
+                for i, (start, count) in enumerate(zip(start_sequences, num_notes))]
+
+    def size_bytes(self):
+        """
+        Memory used by the tables
+        """
+        return sum(array.nbytes for arrays in (self.contexts, self.indptr, self.next_notes, self.cumulative)
+                   for array in arrays)
+
+def corpus_lines(directory, transpose=False):
+    """
+    Read the melody lines of every MIDI file under a directory
+
+    Args:
+    - directory: Folder searched recursively for .mid/.midi files
+    - transpose: Also add every line transposed by -5 to +6 semitones
+
+    Returns:
+    - (list of pitch arrays, number of files read)
+    """
+    from midi_reader import read_smf, melody_lines
+
+    lines = []
+    files = 0
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if not name.lower().endswith((".mid", ".midi")):
+                continue
+            path = os.path.join(root, name)
+            try:
+                events, _ = read_smf(path)
+            except (ValueError, IndexError, OSError) as e:
+                print(f"⚠️ Skipping {path}: {e}")
+                continue
+            files += 1
+            lines.extend(melody_lines(events))
+
+    if transpose:
+        lines = [np.clip(line + shift, 0, PITCHES - 1) for line in lines for shift in range(-5, 7)]
+    return lines, files
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the n-gram Markov melody model from a folder of MIDI files")
+    parser.add_argument("corpus", help="Folder of MIDI files")
+    parser.add_argument("--order", type=int, default=3, help="Longest context in notes")
+    parser.add_argument("--transpose", action="store_true", help="Train on every line in 12 transpositions")
+    parser.add_argument("--output", default=MARKOV_MODEL_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    lines, files = corpus_lines(args.corpus, transpose=args.transpose)
+    if not lines:
+        parser.error(f"No melody lines found in {args.corpus}")
+    model = MarkovMelodyModel.train(lines, order=args.order)
+    model.save(args.output)
+
+    notes = sum(len(line) for line in lines)
+    print(f"✅ Trained order-{args.order} model on {files} files ({len(lines)} lines, {notes} notes) "
+          f"in {time.perf_counter() - start:.2f}s")
+    for n in range(args.order + 1):
+        print(f"   order {n}: {len(model.contexts[n])} contexts, {len(model.next_notes[n])} transitions")
+    print(f"   {model.size_bytes() / 1024:.0f} KB in memory, saved to {args.output} "
+          f"({os.path.getsize(args.output) / 1024:.0f} KB)")
+
+    # Sampling speed, one sequence and a batch of 64
+    rng = np.random.RandomState(0)
+    for batch in (1, 64):
+        starts = [rng.randint(60, 72, size=50).tolist() for _ in range(batch)]
+        uniforms = rng.random_sample((batch, 1024))
+        begin = time.perf_counter()
+        model.generate(starts, uniforms)
+        elapsed = time.perf_counter() - begin
+        print(f"   batch {batch:2d}: {elapsed / uniforms.size * 1e6:.2f} µs per note")
+
+if __name__ == "__main__":
+    main()
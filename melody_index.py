@@ -0,0 +1,336 @@
+import argparse
+import os
+import time
+import numpy as np
+from note_events import melody_array
+
+# Intervals beyond two octaves are clipped, rests and the note after them get their own codes
+MAX_INTERVAL = 24
+REST_CODE = 2 * MAX_INTERVAL + 1
+AFTER_REST_CODE = 2 * MAX_INTERVAL + 2
+INTERVAL_CODES = 2 * MAX_INTERVAL + 3
+
+# Durations are counted in sixteenth notes, up to a whole note
+DURATION_CODES = 17
+
+# Index defaults: 64 MinHash values in 16 bands of 4 find pairs above ~0.5
+# Jaccard similarity as candidates; DEFAULT_THRESHOLD is what counts as a
+# near-duplicate
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_NGRAM = 4
+DEFAULT_THRESHOLD = 0.7
+
+# Default file a melody index is saved to
+MELODY_INDEX_PATH = "output/melody_index.npz"
+
+def melody_tokens(pitches, durations):
+    """
+    Transposition-invariant tokens of melodies: the interval from the
+    previous note combined with the note's duration
+
+    Args:
+    - pitches: Pitch array of shape (..., length), -1 for rests
+    - durations: Durations in quarter notes, broadcastable to pitches
+
+    Returns:
+    - int64 array of shape (..., length - 1)
+    """
+    pitches = np.asarray(pitches, dtype=np.int64)
+    intervals = np.clip(np.diff(pitches, axis=-1), -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+    intervals = np.where(pitches[..., 1:] < 0, REST_CODE, intervals)
+    intervals = np.where((pitches[..., :-1] < 0) & (pitches[..., 1:] >= 0), AFTER_REST_CODE, intervals)
+
+    durations = np.broadcast_to(np.asarray(durations, dtype=np.float64), pitches.shape)[..., 1:]
+    duration_codes = np.clip(np.rint(durations * 4), 0, DURATION_CODES - 1).astype(np.int64)
+    return intervals * DURATION_CODES + duration_codes
+
+def melody_shingles(pitches, durations, ngram=DEFAULT_NGRAM):
+    """
+    Hashed token n-grams of melodies (see melody_tokens())
+
+    Returns:
+    - uint64 array of shape (..., length - ngram)
+    """
+    tokens = melody_tokens(pitches, durations)
+    count = tokens.shape[-1] - ngram + 1
+    if count < 1:
+        raise ValueError(f"Melodies need more than {ngram} notes to fingerprint")
+    codes = np.zeros(tokens.shape[:-1] + (count,), dtype=np.int64)
+    for i in range(ngram):
+        codes = codes * (INTERVAL_CODES * DURATION_CODES) + tokens[..., i:i + count]
+    return _mix(codes.astype(np.uint64))
+
+def _mix(values):
+    # splitmix64 finalizer: spreads n-gram codes over all 64 bits
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+class MelodyIndex:
+    """
+    MinHash signatures of melodies in an LSH index, for near-duplicate detection
+
+    A melody's fingerprint is its set of n-grams of (interval, duration)
+    tokens, so transposed copies match exactly. Each of num_perm hash
+    functions (multiply-shift over the mixed n-gram codes) keeps its minimum
+    over the set; two signatures agree in about the Jaccard similarity of
+    the sets. Signatures are split into bands, and melodies sharing any
+    band's values land in the same bucket: a query only compares against
+    those candidates, whatever the size of the catalog.
+    """
+
+    def __init__(self, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, ngram=DEFAULT_NGRAM, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.ngram = ngram
+        self.seed = seed
+
+        rng = np.random.RandomState(seed)
+        self._multipliers = rng.randint(1, 2 ** 63, size=num_perm, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+        self._increments = rng.randint(0, 2 ** 63, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+        self.ids = []
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self._size = 0
+        self._buckets = [{} for _ in range(bands)]
+
+    def signature(self, melody=None, pitches=None, durations=None):
+        """
+        MinHash signature of one melody
+
+        Args:
+        - melody: (note or None, duration) list or MELODY_DTYPE array, or
+        - pitches, durations: Arrays (-1 pitches for rests)
+
+        Returns:
+        - uint32 array of num_perm values
+        """
+        if melody is not None:
+            melody = melody_array(melody)
+            pitches, durations = melody["pitch"], melody["duration"]
+        return self.signatures_of(np.asarray(pitches)[np.newaxis], np.asarray(durations)[np.newaxis])[0]
+
+    def signatures_of(self, pitches, durations, chunk=256):
+        """
+        MinHash signatures of a batch of melodies of the same length, e.g.
+        from create_musical_melodies()
+
+        Args:
+        - pitches: Array of shape (K, length), -1 for rests
+        - durations: Durations broadcastable to pitches
+
+        Returns:
+        - uint32 array of shape (K, num_perm)
+        """
+        pitches = np.asarray(pitches)
+        durations = np.broadcast_to(np.asarray(durations), pitches.shape)
+        signatures = np.empty((len(pitches), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(pitches), chunk):
+            shingles = melody_shingles(pitches[start:start + chunk], durations[start:start + chunk], self.ngram)
+            hashes = shingles[:, :, np.newaxis] * self._multipliers + self._increments
+            signatures[start:start + chunk] = (hashes.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+        return signatures
+
+    def _band_keys(self, signature):
+        return [band.tobytes() for band in signature.reshape(self.bands, -1)]
+
+    def add(self, melody_id, signature):
+        """
+        Add a melody to the catalog by its signature()
+
+        Returns:
+        - Row of the melody in signatures
+        """
+        if self._size == len(self.signatures):
+            grown = np.zeros((max(1024, 2 * self._size), self.num_perm), dtype=np.uint32)
+            grown[:self._size] = self.signatures[:self._size]
+            self.signatures = grown
+        row = self._size
+        self.signatures[row] = signature
+        self.ids.append(melody_id)
+        self._size += 1
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(key, []).append(row)
+        return row
+
+    def query(self, signature, threshold=DEFAULT_THRESHOLD, limit=None):
+        """
+        Find catalog melodies similar to a signature
+
+        Args:
+        - signature: signature() of the query melody
+        - threshold: Lowest estimated Jaccard similarity returned
+        - limit: Most matches returned (all if omitted)
+
+        Returns:
+        - List of (melody id, estimated similarity), most similar first
+        """
+        rows = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            rows.update(buckets.get(key, ()))
+        if not rows:
+            return []
+        rows = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        similarity = (self.signatures[rows] == signature).mean(axis=1)
+        keep = np.flatnonzero(similarity >= threshold)
+        keep = keep[np.argsort(-similarity[keep], kind="stable")][:limit]
+        return [(self.ids[rows[i]], float(similarity[i])) for i in keep]
+
+    def add_if_new(self, melody_id, signature, threshold=DEFAULT_THRESHOLD):
+        """
+        Add a melody unless the catalog already holds a near-duplicate
+
+        Returns:
+        - (True if added, matches from query())
+        """
+        matches = self.query(signature, threshold=threshold)
+        if matches:
+            return False, matches
+        self.add(melody_id, signature)
+        return True, matches
+
+    def near_duplicates(self, threshold=DEFAULT_THRESHOLD):
+        """
+        Every pair of catalog melodies at or above threshold
+
+        Returns:
+        - List of (id, id, estimated similarity)
+        """
+        pairs = {}
+        for buckets in self._buckets:
+            for rows in buckets.values():
+                if len(rows) < 2:
+                    continue
+                rows = np.array(rows)
+                similarity = (self.signatures[rows][:, np.newaxis] == self.signatures[rows][np.newaxis]).mean(axis=2)
+                for i, j in zip(*np.nonzero(np.triu(similarity >= threshold, k=1))):
+                    pairs[(int(rows[i]), int(rows[j]))] = float(similarity[i, j])
+        return [(self.ids[a], self.ids[b], similarity) for (a, b), similarity in sorted(pairs.items())]
+
+    def __len__(self):
+        return self._size
+
+    def save(self, path):
+        """
+        Save the signatures and ids (as strings) to an .npz file; buckets are rebuilt on load
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(path, signatures=self.signatures[:self._size], ids=np.array(self.ids, dtype=str),
+                 params=np.array([self.num_perm, self.bands, self.ngram, self.seed]))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index saved with save()
+        """
+        with np.load(path) as data:
+            num_perm, bands, ngram, seed = (int(value) for value in data["params"])
+            index = cls(num_perm=num_perm, bands=bands, ngram=ngram, seed=seed)
+            for melody_id, signature in zip(data["ids"].tolist(), data["signatures"]):
+                index.add(melody_id, signature)
+        return index
+
+def generate_distinct_melodies(index, count, length=32, scale_type="major", start_note=60, complexity=1.0,
+                               threshold=DEFAULT_THRESHOLD, max_attempts=None, rng=None, id_prefix="melody"):
+    """
+    Generate scale-based melodies, rejecting near-duplicates of the catalog
+    and of each other, and add the accepted ones to the index
+
+    Candidates come from create_musical_melodies() a batch at a time and are
+    fingerprinted together.
+
+    Args:
+    - index: MelodyIndex of the catalog
+    - count: Melodies wanted
+    - length, scale_type, start_note, complexity: See create_musical_melodies()
+    - threshold: Similarity that counts as a near-duplicate
+    - max_attempts: Candidates tried at most (10 * count by default)
+    - rng: np.random.RandomState to draw from (defaults to the global np.random state)
+    - id_prefix: Accepted melodies are added as "<id_prefix>_<catalog size>"
+
+    Returns:
+    - (list of (pitches, durations), number of rejected candidates)
+    """
+    from full_instrumental_melody import create_musical_melodies
+
+    if max_attempts is None:
+        max_attempts = 10 * count
+    accepted = []
+    rejected = 0
+    while len(accepted) < count and len(accepted) + rejected < max_attempts:
+        batch = min(2 * (count - len(accepted)), max_attempts - len(accepted) - rejected)
+        pitches, durations = create_musical_melodies(batch, length=length, scale_type=scale_type,
+                                                     start_note=start_note, complexity=complexity, rng=rng)
+        for melody_pitches, signature in zip(pitches, index.signatures_of(pitches, durations)):
+            added, _ = index.add_if_new(f"{id_prefix}_{len(index)}", signature, threshold=threshold)
+            if not added:
+                rejected += 1
+                continue
+            accepted.append((melody_pitches, durations))
+            if len(accepted) == count:
+                break
+    return accepted, rejected
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint generated melodies and find near-duplicates")
+    parser.add_argument("--count", type=int, default=10000, help="Scale-based melodies generated into the index")
+    parser.add_argument("--length", type=int, default=32, help="Notes per melody")
+    parser.add_argument("--complexity", type=float, default=1.0)
+    parser.add_argument("--scale", default="major")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index", default=MELODY_INDEX_PATH, help="Index file to extend and save")
+    parser.add_argument("--query", nargs="*", default=[], help="MIDI files whose top lines are looked up")
+    args = parser.parse_args()
+
+    from full_instrumental_melody import create_musical_melodies
+
+    index = MelodyIndex.load(args.index) if os.path.exists(args.index) else MelodyIndex()
+    catalog = len(index)
+
+    if args.count > 0:
+        rng = np.random.RandomState(args.seed)
+        pitches, durations = create_musical_melodies(args.count, length=args.length, scale_type=args.scale,
+                                                     complexity=args.complexity, rng=rng)
+        start = time.perf_counter()
+        signatures = index.signatures_of(pitches, durations)
+        fingerprinted = time.perf_counter() - start
+
+        start = time.perf_counter()
+        flagged = 0
+        for signature in signatures:
+            added, _ = index.add_if_new(f"melody_{len(index)}", signature, threshold=args.threshold)
+            flagged += not added
+        checked = time.perf_counter() - start
+        print(f"✅ {args.count} melodies: {flagged} near-duplicates rejected ({flagged / args.count:.1%}), "
+              f"catalog {catalog} -> {len(index)}")
+        print(f"   per melody: fingerprint {fingerprinted / args.count * 1e6:.1f} µs (batched), "
+              f"check and add {checked / args.count * 1e6:.1f} µs")
+        index.save(args.index)
+        print(f"   index saved to {args.index}")
+
+    from midi_reader import read_smf, top_line
+
+    for filename in args.query:
+        events, _ = read_smf(filename)
+        pitches, durations = top_line(events)
+        start = time.perf_counter()
+        try:
+            signature = index.signature(pitches=pitches, durations=durations)
+        except ValueError:
+            print(f"⚠️ {filename}: top line has {len(pitches)} notes, too short to fingerprint")
+            continue
+        matches = index.query(signature, threshold=args.threshold, limit=5)
+        elapsed = time.perf_counter() - start
+        found = ", ".join(f"{melody_id} ({similarity:.2f})" for melody_id, similarity in matches) or "none"
+        print(f"🔎 {filename}: {found} in {elapsed * 1e6:.0f} µs")
+
+if __name__ == "__main__":
+    main()
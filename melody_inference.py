@@ -0,0 +1,517 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import numpy as np
+
+# TensorFlow is imported inside the functions that need it, so importing this
+# module (and the song builders that use it) stays cheap until a model is used
+
+# Trained melody generator used by the song builders
+MELODY_MODEL_PATH = "models/melody_generator.h5"
+
+# Number of notes the melody model looks at for every prediction
+WINDOW_SIZE = 50
+
+# Layers that work on each timestep on their own and can be reused as-is
+# in a one-note-at-a-time model (class names, so keras needn't be imported)
+STEPWISE_LAYERS = (
+    "Dense",
+    "Dropout",
+    "Activation",
+    "Embedding",
+    "BatchNormalization",
+    "LayerNormalization",
+)
+
+# Loaded melody models (None if loading failed), keyed by path
+_melody_models = {}
+
+# Stateful copies of models, keyed by id() of the source model
+_step_models = {}
+
+# Compiled inference engines, keyed by (id() of the source model, batch size)
+_engines = {}
+
+def load_melody_model(path=MELODY_MODEL_PATH):
+    """
+    Import TensorFlow and load a trained melody model
+
+    Args:
+    - path: Path to the saved Keras model, to Markov tables (.npz, see
+      markov_melody.py), which load without TensorFlow, or to a converted
+      TFLite model (.tflite, see melody_tflite.py)
+
+    Returns:
+    - Keras model, MarkovMelodyModel or TFLiteMelodyModel, or None if it
+      can't be loaded
+    """
+    if not os.path.exists(path):
+        # Nothing to load, so don't pay for importing TensorFlow
+        print("ℹ️ Model not found, will use scale-based generation only")
+        return None
+
+    if path.endswith(".npz"):
+        from markov_melody import MarkovMelodyModel
+        model = MarkovMelodyModel.load(path)
+        print(f"✅ Markov Melody Model Loaded Successfully! (order {model.order})")
+        return model
+
+    if path.endswith(".tflite"):
+        from melody_tflite import TFLiteMelodyModel
+        model = TFLiteMelodyModel(path)
+        print(f"✅ TFLite Melody Model Loaded Successfully! (batch size {model.batch_size})")
+        return model
+
+    try:
+        from tensorflow.keras.models import load_model
+        model = load_model(path)
+        print("✅ Melody Model Loaded Successfully!")
+        return model
+    except Exception:
+        print("ℹ️ Model not found, will use scale-based generation only")
+        return None
+
+def configure_threads(intra_op=None, inter_op=None):
+    """
+    Set how many threads TensorFlow uses, so several processes can share a host
+
+    Must be called before the first model is loaded or run.
+
+    Args:
+    - intra_op: Threads used inside one operation (None keeps TensorFlow's default)
+    - inter_op: Operations run in parallel (None keeps TensorFlow's default)
+    """
+    import tensorflow as tf
+
+    if intra_op:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+def get_melody_model(path=MELODY_MODEL_PATH):
+    """
+    Return the melody model of this process, loading it on first use
+
+    Args:
+    - path: Path to the saved model (see load_melody_model())
+
+    Returns:
+    - Keras model, MarkovMelodyModel or TFLiteMelodyModel, or None if it
+      can't be loaded
+    """
+    if path not in _melody_models:
+        _melody_models[path] = load_melody_model(path)
+    return _melody_models[path]
+
+def build_step_model(model, batch_size=1):
+    """
+    Build a stateful copy of a window melody model that reads one note per call
+
+    The recurrent layers are rebuilt with stateful=True so their hidden state
+    is carried from one call to the next, and the weights are copied from the
+    original model. Only Sequential stacks of recurrent and per-timestep
+    layers can be converted.
+
+    Args:
+    - model: Trained melody generator model (input shape (batch, 50, 1))
+    - batch_size: Number of sequences advanced together
+
+    Returns:
+    - Stateful Keras model taking (batch_size, timesteps, 1) inputs
+    """
+    from tensorflow import keras
+
+    layers = [layer for layer in model.layers if not isinstance(layer, keras.layers.InputLayer)]
+
+    step_model = keras.Sequential()
+    step_model.add(keras.Input(batch_shape=(batch_size, None, model.input_shape[-1])))
+
+    for layer in layers:
+        config = layer.get_config()
+        # Input shapes stored on the first layer would pin the window length
+        for key in ("batch_input_shape", "batch_shape", "input_shape"):
+            config.pop(key, None)
+
+        if isinstance(layer, keras.layers.RNN):
+            config["stateful"] = True
+        elif layer.__class__.__name__ not in STEPWISE_LAYERS:
+            raise ValueError(f"Layer '{layer.name}' ({layer.__class__.__name__}) "
+                             f"can't be run one note at a time")
+
+        step_model.add(layer.__class__.from_config(config))
+
+    step_model.set_weights(model.get_weights())
+    return step_model
+
+def get_step_model(model):
+    """
+    Return the cached stateful copy of a melody model, building it on first use
+
+    Args:
+    - model: Trained melody generator model
+
+    Returns:
+    - Stateful single-sequence Keras model
+    """
+    key = id(model)
+    if key not in _step_models:
+        _step_models[key] = (model, build_step_model(model))
+    return _step_models[key][1]
+
+def reset_step_model(step_model):
+    """
+    Clear the hidden state of every recurrent layer in a stateful model
+
+    Args:
+    - step_model: Model returned by build_step_model()
+    """
+    for layer in step_model.layers:
+        if hasattr(layer, "reset_state"):
+            layer.reset_state()  # Keras 3
+        elif hasattr(layer, "reset_states"):
+            layer.reset_states()  # tf.keras 2.x
+
+def generate_melody_stateful(model, start_sequence, num_notes=100):
+    """
+    Generate a melody feeding the model one new note per step
+
+    The last 50 notes of start_sequence are run through the stateful model
+    once to warm up its hidden state. After that every predicted note is fed
+    back alone, so each step costs one timestep instead of a full 50-step
+    window.
+
+    This is not window mode: only the first predicted note is the one
+    generate_melody() gives in "window" mode. After it the carried hidden
+    state holds notes the 50-note window has dropped, and the model was
+    trained on fresh windows, so the melody drifts off window mode's. Use
+    generate_melody_compiled() for window mode's notes, faster.
+
+    Args:
+    - model: Trained melody generator model
+    - start_sequence: Initial sequence to start generation (at least 50 notes)
+    - num_notes: Number of notes to generate
+
+    Returns:
+    - Generated melody sequence (start_sequence followed by the new notes)
+    """
+    step_model = get_step_model(model)
+    reset_step_model(step_model)
+
+    generated_notes = start_sequence[:]
+    if num_notes <= 0:
+        return generated_notes
+
+    # Warm up the hidden state on the starting window
+    window = np.array(generated_notes[-WINDOW_SIZE:], dtype=np.float32).reshape(1, -1, 1)
+    probabilities = step_model(window, training=False)
+
+    step_input = np.zeros((1, 1, 1), dtype=np.float32)
+    for i in range(num_notes):
+        predicted_note = int(np.argmax(probabilities))
+        generated_notes.append(predicted_note)
+
+        # The last note doesn't need a prediction after it
+        if i < num_notes - 1:
+            step_input[0, 0, 0] = predicted_note
+            probabilities = step_model(step_input, training=False)
+
+    return generated_notes
+
+class MelodyInferenceEngine:
+    """
+    Compiled next-note predictor for a window melody model
+
+    The last 50 notes of every sequence live in a preallocated ring buffer
+    on the TensorFlow side. Each step gathers the window in time order, runs
+    the model, takes the argmax and writes the new note over the oldest one,
+    all inside one traced graph. generate() runs the whole loop in the graph
+    too, so nothing is allocated per note on the Python side.
+
+    Produces the same notes as generate_melody() in window mode. sample()
+    draws every note from the predicted distribution instead of taking the
+    argmax, using uniform draws passed in so the notes only depend on the
+    caller's random state.
+    """
+
+    def __init__(self, model, batch_size=1, window_size=WINDOW_SIZE):
+        import tensorflow as tf
+
+        self.model = model
+        self.batch_size = batch_size
+        self.window_size = window_size
+
+        # Ring buffer laid out as (window, batch) so a step writes one row
+        self._buffer = tf.Variable(tf.zeros((window_size, batch_size), dtype=tf.float32), trainable=False)
+        # Row holding the oldest note
+        self._head = tf.Variable(0, dtype=tf.int32, trainable=False)
+        # Window positions in time order, relative to the head
+        self._offsets = tf.range(window_size, dtype=tf.int32)
+
+        self._step = tf.function(self._step_graph)
+        self._generate = tf.function(self._generate_graph,
+                                     input_signature=[tf.TensorSpec([], tf.int32)])
+        self._sample = tf.function(self._sample_graph,
+                                   input_signature=[tf.TensorSpec([batch_size, None], tf.float32),
+                                                    tf.TensorSpec([], tf.float32),
+                                                    tf.TensorSpec([], tf.int32)])
+
+    def load(self, start_sequences):
+        """
+        Fill the ring buffer with the last notes of each start sequence
+
+        Args:
+        - start_sequences: batch_size lists of at least window_size notes
+        """
+        if len(start_sequences) != self.batch_size:
+            raise ValueError(f"Expected {self.batch_size} start sequences, got {len(start_sequences)}")
+
+        window = np.empty((self.window_size, self.batch_size), dtype=np.float32)
+        for i, sequence in enumerate(start_sequences):
+            window[:, i] = sequence[-self.window_size:]
+
+        self._buffer.assign(window)
+        self._head.assign(0)
+
+    def _predict_graph(self):
+        import tensorflow as tf
+
+        order = (self._head + self._offsets) % self.window_size
+        window = tf.transpose(tf.gather(self._buffer, order))[:, :, tf.newaxis]
+
+        probabilities = self.model(window, training=False)
+        return tf.reshape(probabilities, (self.batch_size, -1))
+
+    def _push_graph(self, next_notes):
+        import tensorflow as tf
+
+        # Overwrite the oldest note with the new one
+        self._buffer[self._head].assign(tf.cast(next_notes, tf.float32))
+        self._head.assign((self._head + 1) % self.window_size)
+
+    def _step_graph(self):
+        import tensorflow as tf
+
+        next_notes = tf.argmax(self._predict_graph(), axis=-1, output_type=tf.int32)
+        self._push_graph(next_notes)
+        return next_notes
+
+    def _generate_graph(self, num_notes):
+        import tensorflow as tf
+
+        notes = tf.TensorArray(tf.int32, size=num_notes)
+        for i in tf.range(num_notes):
+            notes = notes.write(i, self._step_graph())
+        return tf.transpose(notes.stack())
+
+    def _sample_graph(self, uniforms, temperature, top_k):
+        import tensorflow as tf
+
+        classes = self.model.output_shape[-1]
+        k = tf.where(top_k > 0, tf.minimum(top_k, classes), classes)
+
+        num_notes = tf.shape(uniforms)[1]
+        notes = tf.TensorArray(tf.int32, size=num_notes)
+        for i in tf.range(num_notes):
+            # Most likely notes first, reweighted by temperature, then the
+            # first one whose cumulative weight passes the uniform draw
+            probabilities, candidates = tf.math.top_k(self._predict_graph(), k=k)
+            weights = tf.nn.softmax(tf.math.log(probabilities + 1e-12) / temperature)
+            choice = tf.searchsorted(tf.math.cumsum(weights, axis=-1), uniforms[:, i:i + 1], side="right")
+            choice = tf.minimum(choice, k - 1)
+            next_notes = tf.gather(candidates, choice, batch_dims=1)[:, 0]
+
+            self._push_graph(next_notes)
+            notes = notes.write(i, next_notes)
+        return tf.transpose(notes.stack())
+
+    def step(self):
+        """
+        Predict one note for every sequence and push it into the buffer
+
+        Returns:
+        - Tensor of shape (batch_size,) with the predicted notes
+        """
+        return self._step()
+
+    def generate(self, num_notes):
+        """
+        Predict num_notes notes for every sequence in one compiled call
+
+        Returns:
+        - int32 array of shape (batch_size, num_notes)
+        """
+        if num_notes <= 0:
+            return np.zeros((self.batch_size, 0), dtype=np.int32)
+        return self._generate(np.int32(num_notes)).numpy()
+
+    def sample(self, uniforms, temperature=1.0, top_k=0):
+        """
+        Sample one note per uniform draw for every sequence in one compiled call
+
+        Args:
+        - uniforms: Array of shape (batch_size, num_notes) of uniform [0, 1) draws
+        - temperature: Below 1 favours the likeliest notes, above 1 flattens the distribution
+        - top_k: Only sample from the k likeliest notes (0 for all of them)
+
+        Returns:
+        - int32 array of shape (batch_size, num_notes)
+        """
+        uniforms = np.asarray(uniforms, dtype=np.float32)
+        if uniforms.shape[1] == 0:
+            return np.zeros((self.batch_size, 0), dtype=np.int32)
+        return self._sample(uniforms, np.float32(temperature), np.int32(top_k)).numpy()
+
+def get_inference_engine(model, batch_size=1):
+    """
+    Return the cached compiled engine for a melody model, building it on first use
+
+    Args:
+    - model: Trained melody generator model
+    - batch_size: Number of sequences advanced together
+
+    Returns:
+    - MelodyInferenceEngine
+    """
+    key = (id(model), batch_size)
+    if key not in _engines:
+        _engines[key] = (model, MelodyInferenceEngine(model, batch_size=batch_size))
+    return _engines[key][1]
+
+def generate_melody_compiled(model, start_sequence, num_notes=100):
+    """
+    Generate a melody with the compiled ring-buffer engine
+
+    Args:
+    - model: Trained melody generator model
+    - start_sequence: Initial sequence to start generation (at least 50 notes)
+    - num_notes: Number of notes to generate
+
+    Returns:
+    - Generated melody sequence (start_sequence followed by the new notes)
+    """
+    engine = get_inference_engine(model)
+    engine.load([start_sequence])
+    return start_sequence[:] + engine.generate(num_notes)[0].tolist()
+
+def generate_melody_batch(model, start_sequences, num_notes):
+    """
+    Generate several melodies together, one batched forward pass per step
+
+    All sequences are advanced for the longest requested length and then
+    cut to their own length.
+
+    Args:
+    - model: Trained melody generator model
+    - start_sequences: List of K initial sequences (at least 50 notes each)
+    - num_notes: Number of notes to generate, one int for all or a list of K
+
+    Returns:
+    - List of K generated sequences (each start sequence followed by its new notes)
+    """
+    if isinstance(num_notes, int):
+        num_notes = [num_notes] * len(start_sequences)
+    if not start_sequences:
+        return []
+
+    engine = get_inference_engine(model, batch_size=len(start_sequences))
+    engine.load(start_sequences)
+    new_notes = engine.generate(max(num_notes))
+
+    return [start[:] + new_notes[i, :count].tolist()
+            for i, (start, count) in enumerate(zip(start_sequences, num_notes))]
+
+def sample_notes(probabilities, uniforms, temperature=1.0, top_k=0):
+    """
+    Draw one note per row of next-note probabilities, like
+    MelodyInferenceEngine.sample() does inside its graph
+
+    Args:
+    - probabilities: Array of shape (B, 128)
+    - uniforms: B uniform [0, 1) draws
+    - temperature: Below 1 favours the likeliest notes, above 1 flattens the distribution
+    - top_k: Only sample from the k likeliest notes (0 for all of them)
+
+    Returns:
+    - int64 array of B notes
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    classes = probabilities.shape[-1]
+    k = min(top_k, classes) if top_k > 0 else classes
+
+    candidates = np.argsort(-probabilities, axis=-1, kind="stable")[:, :k]
+    logits = np.log(np.take_along_axis(probabilities, candidates, axis=-1) + 1e-12) / temperature
+    weights = np.exp(logits - logits[:, :1])
+    cumulative = np.cumsum(weights, axis=-1)
+    cumulative /= cumulative[:, -1:]
+
+    choice = (cumulative <= np.asarray(uniforms)[:, None]).sum(axis=-1)
+    return candidates[np.arange(len(candidates)), np.minimum(choice, k - 1)]
+
+def generate_melody_sampled(model, start_sequences, num_notes, uniforms, temperature=1.0, top_k=0):
+    """
+    Sample continuations of several sequences together, one batched forward
+    pass per step
+
+    Args:
+    - model: Trained melody generator model
+    - start_sequences: List of K initial sequences (at least 50 notes each)
+    - num_notes: List of K note counts
+    - uniforms: List of K arrays of uniform draws, at least num_notes each
+    - temperature: Sampling temperature (see MelodyInferenceEngine.sample())
+    - top_k: Only sample from the k likeliest notes (0 for all of them)
+
+    Returns:
+    - List of K generated sequences (each start sequence followed by its new notes)
+    """
+    if not start_sequences:
+        return []
+
+    draws = np.zeros((len(start_sequences), max(num_notes)), dtype=np.float32)
+    for i, (count, values) in enumerate(zip(num_notes, uniforms)):
+        draws[i, :count] = values[:count]
+
+    engine = get_inference_engine(model, batch_size=len(start_sequences))
+    engine.load(start_sequences)
+    new_notes = engine.sample(draws, temperature=temperature, top_k=top_k)
+
+    return [start[:] + new_notes[i, :count].tolist()
+            for i, (start, count) in enumerate(zip(start_sequences, num_notes))]
+
+def get_tflite_model(model):
+    """
+    Return the TFLite model to use in place of a melody model
+
+    Args:
+    - model: A TFLiteMelodyModel, returned as is, or the Keras model it was
+      converted from, in which case the converted model at
+      melody_tflite.TFLITE_MODEL_PATH is loaded
+
+    Returns:
+    - TFLiteMelodyModel
+
+    Raises:
+    - FileNotFoundError if no converted model exists
+    """
+    from melody_tflite import TFLiteMelodyModel, TFLITE_MODEL_PATH
+
+    if isinstance(model, TFLiteMelodyModel):
+        return model
+    tflite_model = get_melody_model(TFLITE_MODEL_PATH) if os.path.exists(TFLITE_MODEL_PATH) else None
+    if tflite_model is None:
+        raise FileNotFoundError(f"No TFLite model at {TFLITE_MODEL_PATH}, convert one with melody_tflite.py")
+    return tflite_model
+
+def generate_melody_tflite(model, start_sequence, num_notes=100):
+    """
+    Generate a melody with the converted TFLite model (see get_tflite_model())
+
+    Args:
+    - model: TFLiteMelodyModel, or the Keras model it was converted from
+    - start_sequence: Initial sequence to start generation (at least 50 notes)
+    - num_notes: Number of notes to generate
+
+    Returns:
+    - Generated melody sequence (start_sequence followed by the new notes)
+    """
+    return get_tflite_model(model).generate(start_sequence, num_notes)
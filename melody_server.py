@@ -0,0 +1,368 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import json
+import queue
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from melody_inference import WINDOW_SIZE, MELODY_MODEL_PATH, configure_threads, get_melody_model, \
+    generate_melody_batch
+from markov_melody import MarkovMelodyModel
+from melody_tflite import TFLiteMelodyModel
+import full_instrumental_melody as fim
+
+class MelodyRequest:
+    """
+    One sequence waiting to be advanced by the batcher
+    """
+
+    def __init__(self, start_sequence, num_notes):
+        self.start_sequence = start_sequence
+        self.num_notes = num_notes
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class MelodyBatcher:
+    """
+    Gather melody requests from many threads into batched forward passes
+
+    A worker thread takes the first waiting sequence, then keeps collecting
+    until max_batch_size sequences are waiting or max_wait_ms has passed, and
+    runs them together through generate_melody_batch(). Batches are padded to
+    a power of two so only a few batch sizes are ever compiled.
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.batches = 0
+        self.sequences = 0
+        self.padded = 0
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="melody-batcher", daemon=True)
+        self._thread.start()
+
+    def batch_sizes(self):
+        """
+        Batch sizes the worker runs (powers of two up to max_batch_size)
+        """
+        sizes = [1]
+        while sizes[-1] < self.max_batch_size:
+            sizes.append(min(sizes[-1] * 2, self.max_batch_size))
+        return sizes
+
+    def warm_up(self):
+        """
+        Compile every batch size up front so no request pays for tracing
+        """
+        start_sequence = [60] * WINDOW_SIZE
+        for size in self.batch_sizes():
+            generate_melody_batch(self.model, [start_sequence] * size, 1)
+
+    def generate(self, start_sequences, num_notes):
+        """
+        Generate melodies, batched with whatever other threads are requesting
+
+        Takes the same arguments and returns the same as generate_melody_batch()
+        without the model, so it can be passed as generate_batch to
+        generate_model_melodies().
+        """
+        if isinstance(num_notes, int):
+            num_notes = [num_notes] * len(start_sequences)
+
+        requests = [MelodyRequest(list(start), count) for start, count in zip(start_sequences, num_notes)]
+        for request in requests:
+            self._queue.put(request)
+
+        results = []
+        for request in requests:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+            results.append(request.result)
+        return results
+
+    def close(self):
+        """
+        Stop the worker thread once the waiting requests are done
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # Finish this batch, then stop
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        size = next(size for size in self.batch_sizes() if size >= len(batch))
+        padding = size - len(batch)
+        starts = [request.start_sequence for request in batch] + [batch[0].start_sequence] * padding
+        counts = [request.num_notes for request in batch] + [0] * padding
+
+        try:
+            generated = generate_melody_batch(self.model, starts, counts)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        self.batches += 1
+        self.sequences += len(batch)
+        self.padded += padding
+        for request, notes in zip(batch, generated):
+            request.result = notes
+            request.done.set()
+
+    def stats(self):
+        """
+        Return batching counters
+        """
+        return {
+            "batches": self.batches,
+            "sequences": self.sequences,
+            "padded_sequences": self.padded,
+            "mean_batch_size": round(self.sequences / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0
+        }
+
+def events_to_json(events):
+    """
+    Convert an event array into JSON-ready columns
+    """
+    return {name: events[name].tolist() for name in events.dtype.names}
+
+# The song builders draw from the process-wide random and np.random states,
+# so renders take turns: a seeded render then gets the same notes whatever
+# other requests are running
+_render_lock = threading.Lock()
+
+def request_seed(params):
+    """
+    Seed sequence of a request: from its "seed", or fresh OS entropy, so
+    unseeded requests don't draw from the shared random state either
+    """
+    seed = params.get("seed")
+    return np.random.SeedSequence(None if seed is None else int(seed))
+
+class MelodyRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the melody server
+
+    GET  /health   Model status and batching counters
+    POST /melody   {"num_notes", "start_sequence" or "seed", "complexity"}
+    POST /section  {"section", "length", "key", "scale", "seed"}, events as JSON
+    POST /song     {"bpm", "structure", "section_lengths", "key", "scale", "seed"}, a MIDI file
+    """
+
+    # Set by serve()
+    model = None
+    batcher = None
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._send_json({"error": f"Unknown path {self.path}"}, 404)
+        self._send_json({
+            "model": type(self.model).__name__ if self.model is not None else None,
+            "batching": self.batcher.stats() if self.batcher is not None else None
+        })
+
+    def do_POST(self):
+        routes = {"/melody": self._melody, "/section": self._section, "/song": self._song}
+        if self.path not in routes:
+            return self._send_json({"error": f"Unknown path {self.path}"}, 404)
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            routes[self.path](params)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json({"error": str(e)}, 400)
+        except Exception as e:
+            # e.g. a missing model file or a failed write; answer rather than drop the connection
+            self._send_json({"error": f"{type(e).__name__}: {e}"}, 500)
+
+    def _melody(self, params):
+        if self.model is None:
+            return self._send_json({"error": "No melody model loaded"}, 503)
+
+        num_notes = int(params.get("num_notes", 128))
+        seed = params["seed"] if params.get("seed") is not None else int(request_seed(params).generate_state(1)[0])
+        start_sequence = params.get("start_sequence")
+        if start_sequence is None:
+            start_sequence = np.random.RandomState(seed).randint(60, 72, size=WINDOW_SIZE).tolist()
+        elif len(start_sequence) < WINDOW_SIZE:
+            raise ValueError(f"start_sequence needs at least {WINDOW_SIZE} notes")
+
+        melody = fim.generate_model_melodies(
+            self.model, [num_notes], [float(params.get("complexity", 1.0))],
+            start_sequences=[start_sequence], seeds=[seed],
+            generate_batch=self._generate_batch())[0]
+        self._send_json({"melody": melody.tolist()})
+
+    def _section(self, params):
+        section = params.get("section", "verse")
+        if section not in fim.SECTION_PROGRESSIONS:
+            raise ValueError(f"Unknown section '{section}'")
+        length = int(params.get("length", fim.DEFAULT_SECTION_LENGTHS[section]))
+        song_key, song_scale = int(params.get("key", 60)), params.get("scale", "major")
+        # Seeded like a section of a song (see generate_multi_instrument_song())
+        seed = request_seed(params)
+
+        model_melody = None
+        if self.model is not None and section in ["verse", "chorus"]:
+            model_melody = fim.generate_model_melodies(
+                self.model, [length * 16], [fim.section_complexity(section)],
+                seeds=[fim.section_melody_seed(seed)],
+                generate_batch=self._generate_batch(), song_key=song_key, song_scale=song_scale)[0]
+
+        with _render_lock:
+            fim.seed_random_state(seed)
+            events = fim.render_section(section, length, song_key, song_scale, model_melody=model_melody)
+        self._send_json({"section": section, "length": length, "events": events_to_json(events)})
+
+    def _song(self, params):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "song.mid")
+            # Seeded, so the model melodies come from their own random states and
+            # only the section renders take turns on the shared ones
+            fim.generate_multi_instrument_song(
+                filename, bpm=int(params.get("bpm", 100)),
+                song_structure=params.get("structure"), section_lengths=params.get("section_lengths"),
+                song_key=int(params.get("key", 60)), song_scale=params.get("scale", "major"),
+                generate_batch=self._generate_batch(), seed=request_seed(params), render_lock=_render_lock)
+            with open(filename, "rb") as f:
+                data = f.read()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/midi")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _generate_batch(self):
+        # Keras models go through the shared batcher, Markov and TFLite models run directly
+        return self.batcher.generate if self.batcher is not None else None
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer listening on a Unix socket path
+    """
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+def serve(host="127.0.0.1", port=8765, unix_socket=None, model_path=MELODY_MODEL_PATH,
+          max_batch_size=16, max_wait_ms=5.0, intra_op_threads=None, inter_op_threads=None):
+    """
+    Load the melody model once and serve generation requests until interrupted
+
+    Args:
+    - host, port: TCP address to listen on
+    - unix_socket: Listen on this Unix socket path instead of TCP
+    - model_path: Path to the melody model
+    - max_batch_size: Most sequences run in one forward pass
+    - max_wait_ms: How long the first waiting sequence waits for others to join its batch
+    - intra_op_threads, inter_op_threads: TensorFlow thread pools (None keeps the defaults)
+    """
+    if intra_op_threads or inter_op_threads:
+        configure_threads(intra_op_threads, inter_op_threads)
+
+    model = get_melody_model(model_path)
+    # Songs built by the server use the warm model
+    fim.melody_model = model
+
+    batcher = None
+    if model is not None and not isinstance(model, (MarkovMelodyModel, TFLiteMelodyModel)):
+        batcher = MelodyBatcher(model, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        batcher.warm_up()
+    MelodyRequestHandler.model = model
+    MelodyRequestHandler.batcher = batcher
+
+    if unix_socket:
+        server = UnixHTTPServer(unix_socket, MelodyRequestHandler)
+        print(f"🎵 Melody server listening on {unix_socket}")
+    else:
+        server = ThreadingHTTPServer((host, port), MelodyRequestHandler)
+        print(f"🎵 Melody server listening on http://{host}:{port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if batcher is not None:
+            batcher.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve melody, section and song generation with a warm model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", help="Listen on a Unix socket path instead of TCP")
+    parser.add_argument("--model", default=MELODY_MODEL_PATH,
+                        help="Path to the melody model (.h5 Keras model, .npz Markov tables or .tflite)")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Most sequences per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="How long a request waits for others to share its batch")
+    parser.add_argument("--intra-op-threads", type=int, help="TensorFlow threads inside one operation")
+    parser.add_argument("--inter-op-threads", type=int, help="TensorFlow operations run in parallel")
+    args = parser.parse_args()
+
+    serve(host=args.host, port=args.port, unix_socket=args.unix_socket, model_path=args.model,
+          max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+          intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import threading
+import time
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from melody_inference import MELODY_MODEL_PATH, WINDOW_SIZE, STEPWISE_LAYERS, sample_notes
+
+# Default file the converted model is saved to
+TFLITE_MODEL_PATH = "models/melody_generator.tflite"
+
+# "float" keeps float32 weights, "dynamic" stores int8 weights and quantizes
+# activations on the fly, "int8" also runs activations in int8 using ranges
+# calibrated on generated sequences
+QUANTIZATION_MODES = ("float", "dynamic", "int8")
+
+def _interpreter_class():
+    # The standalone LiteRT / tflite_runtime packages load in a fraction of
+    # TensorFlow's import time; fall back to TensorFlow's copy
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+class TFLiteMelodyModel:
+    """
+    Converted (and usually quantized) melody model run by the TFLite interpreter
+
+    The model is converted for a fixed batch size (see convert_melody_model());
+    larger batches are run in chunks of that size, the last one padded.
+    An interpreter can't run two calls at once, so calls from several
+    threads (e.g. the melody server's) take turns.
+
+    Can be used as melody_model: generate_model_melodies() calls
+    generate_batch() instead of the Keras engine, and generate_melody()
+    selects it with mode="tflite".
+    """
+
+    def __init__(self, path=TFLITE_MODEL_PATH, num_threads=None):
+        self.path = path
+        with warnings.catch_warnings():
+            # tf.lite.Interpreter warns that it moved to the LiteRT package
+            warnings.simplefilter("ignore", UserWarning)
+            self._interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._lock = threading.Lock()
+
+        input_details = self._interpreter.get_input_details()[0]
+        self._input = input_details["index"]
+        self._output = self._interpreter.get_output_details()[0]["index"]
+        self.batch_size, self.window_size = int(input_details["shape"][0]), int(input_details["shape"][1])
+
+    def predict(self, windows):
+        """
+        Next-note probabilities for a batch of windows
+
+        Args:
+        - windows: Array of shape (N, window_size) or (N, window_size, 1)
+
+        Returns:
+        - float32 array of shape (N, 128)
+        """
+        windows = np.asarray(windows, dtype=np.float32).reshape(-1, self.window_size, 1)
+        outputs = []
+        batch = np.zeros((self.batch_size, self.window_size, 1), dtype=np.float32)
+        with self._lock:
+            for start in range(0, len(windows), self.batch_size):
+                chunk = windows[start:start + self.batch_size]
+                batch[:len(chunk)] = chunk
+                self._interpreter.set_tensor(self._input, batch)
+                self._interpreter.invoke()
+                outputs.append(self._interpreter.get_tensor(self._output)[:len(chunk)].reshape(len(chunk), -1))
+        if not outputs:
+            return np.zeros((0, 128), dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def generate_batch(self, start_sequences, num_notes, uniforms=None, temperature=1.0, top_k=0):
+        """
+        Generate several melodies together, like melody_inference.generate_melody_batch()
+
+        Args:
+        - start_sequences: List of K initial sequences (at least window_size notes each)
+        - num_notes: Number of notes to generate, one int for all or a list of K
+        - uniforms: Optional list of K arrays of uniform draws, at least num_notes
+          each; notes are then sampled (see melody_inference.sample_notes())
+          instead of taking the argmax
+        - temperature, top_k: Sampling settings, used with uniforms
+
+        Returns:
+        - List of K generated sequences (each start sequence followed by its new notes)
+        """
+        if isinstance(num_notes, int):
+            num_notes = [num_notes] * len(start_sequences)
+        if not start_sequences:
+            return []
+
+        steps = max(num_notes)
+        count = len(start_sequences)
+        # Every sequence's window followed by room for its new notes, so the
+        # input of each step is a slice rather than a new list
+        notes = np.zeros((count, self.window_size + steps), dtype=np.float32)
+        for i, sequence in enumerate(start_sequences):
+            notes[i, :self.window_size] = sequence[-self.window_size:]
+        if uniforms is not None:
+            draws = np.zeros((count, steps), dtype=np.float64)
+            for i, (n, values) in enumerate(zip(num_notes, uniforms)):
+                draws[i, :n] = values[:n]
+
+        batch = np.zeros((self.batch_size, self.window_size, 1), dtype=np.float32)
+        with self._lock:
+            for step in range(steps):
+                for start in range(0, count, self.batch_size):
+                    chunk = notes[start:start + self.batch_size, step:step + self.window_size]
+                    batch[:len(chunk), :, 0] = chunk
+                    self._interpreter.set_tensor(self._input, batch)
+                    self._interpreter.invoke()
+                    probabilities = self._interpreter.get_tensor(self._output)[:len(chunk)]
+                    if uniforms is None:
+                        next_notes = probabilities.argmax(axis=-1)
+                    else:
+                        next_notes = sample_notes(probabilities, draws[start:start + len(chunk), step],
+                                                  temperature=temperature, top_k=top_k)
+                    notes[start:start + len(chunk), self.window_size + step] = next_notes
+
+        new_notes = notes[:, self.window_size:].astype(np.int64)
+        return [list(start) + new_notes[i, :n].tolist()
+                for i, (start, n) in enumerate(zip(start_sequences, num_notes))]
+
+    def generate(self, start_sequence, num_notes=100):
+        """
+        Generate one melody (start_sequence followed by num_notes new notes)
+        """
+        return self.generate_batch([start_sequence], [num_notes])[0]
+
+    def size_bytes(self):
+        """
+        Size of the converted model file
+        """
+        return os.path.getsize(self.path)
+
+def calibration_windows(model, sequences=64, num_notes=100, max_windows=512, seed=0):
+    """
+    Model input windows taken from melodies the Keras model generates itself,
+    so quantization ranges match what the model sees when writing songs
+
+    Args:
+    - model: Trained Keras melody model
+    - sequences: Melodies generated from random C4-C5 starts, like the song builders use
+    - num_notes: Notes generated per melody
+    - max_windows: Windows kept (sampled at random from all of them)
+    - seed: Seed for the start notes and the sampling
+
+    Returns:
+    - float32 array of shape (N, 50, 1)
+    """
+    from melody_inference import generate_melody_batch
+
+    rng = np.random.RandomState(seed)
+    starts = [rng.randint(60, 72, size=WINDOW_SIZE).tolist() for _ in range(sequences)]
+    generated = np.array(generate_melody_batch(model, starts, num_notes), dtype=np.float32)
+
+    windows = sliding_window_view(generated, WINDOW_SIZE, axis=1).reshape(-1, WINDOW_SIZE)
+    if len(windows) > max_windows:
+        windows = windows[rng.choice(len(windows), max_windows, replace=False)]
+    return np.ascontiguousarray(windows)[:, :, np.newaxis]
+
+def convert_melody_model(model, quantization="dynamic", calibration=None, batch_size=1):
+    """
+    Convert a Keras melody model to a TFLite flatbuffer
+
+    Recurrent layers are unrolled over the 50-note window first: TFLite can
+    only calibrate int8 activations through a plain graph, not a while loop,
+    and the unrolled graph is as fast or faster for every mode.
+
+    Args:
+    - model: Trained Keras melody model (Sequential of recurrent and per-timestep layers)
+    - quantization: One of QUANTIZATION_MODES
+    - calibration: Windows from calibration_windows(), required for "int8"
+    - batch_size: Sequences per interpreter call, fixed in the converted model
+
+    Returns:
+    - Model bytes
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {', '.join(QUANTIZATION_MODES)}")
+    if quantization == "int8" and calibration is None:
+        raise ValueError("int8 quantization needs calibration windows")
+
+    fixed_model = keras.Sequential()
+    fixed_model.add(keras.Input(batch_shape=(batch_size, WINDOW_SIZE, model.input_shape[-1])))
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.InputLayer):
+            continue
+        config = layer.get_config()
+        for key in ("batch_input_shape", "batch_shape", "input_shape"):
+            config.pop(key, None)
+
+        if isinstance(layer, keras.layers.RNN):
+            config["unroll"] = True
+        elif layer.__class__.__name__ not in STEPWISE_LAYERS:
+            raise ValueError(f"Layer '{layer.name}' ({layer.__class__.__name__}) can't be converted")
+        fixed_model.add(layer.__class__.from_config(config))
+    fixed_model.set_weights(model.get_weights())
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(fixed_model)
+    if quantization != "float":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "int8":
+        batches = [calibration[start:start + batch_size]
+                   for start in range(0, len(calibration) - batch_size + 1, batch_size)]
+        converter.representative_dataset = lambda: ([batch] for batch in batches)
+    # Inputs and outputs stay float32 (quantized inside), so callers don't change
+    return converter.convert()
+
+def check_melody_model(model, tflite_model, windows, num_notes=128, runs=3, seed=1):
+    """
+    Compare a converted model with the Keras model it came from
+
+    Args:
+    - model: Trained Keras melody model
+    - tflite_model: TFLiteMelodyModel converted from it
+    - windows: Held-out input windows, e.g. from calibration_windows()
+    - num_notes: Notes generated for the latency and melody comparison
+    - runs: Timed runs per backend, best is reported
+    - seed: Seed for the start notes
+
+    Returns:
+    - Dict with "argmax_agreement" (share of windows where both pick the same
+      next note), "melody_agreement" (share of identical notes in a melody
+      generated by each) and "keras_ms_per_note" / "tflite_ms_per_note"
+    """
+    from melody_inference import generate_melody_compiled
+
+    keras_choice = np.argmax(model.predict(windows, batch_size=256, verbose=0), axis=-1)
+    tflite_choice = np.argmax(tflite_model.predict(windows), axis=-1)
+
+    start_sequence = np.random.RandomState(seed).randint(60, 72, size=WINDOW_SIZE).tolist()
+
+    def best_time(generate):
+        generate(start_sequence, 2)  # Warm-up: graph tracing, tensor allocation
+        best = float("inf")
+        for _ in range(runs):
+            begin = time.perf_counter()
+            notes = generate(start_sequence, num_notes)
+            best = min(best, time.perf_counter() - begin)
+        return best / num_notes, notes[WINDOW_SIZE:]
+
+    keras_time, keras_notes = best_time(lambda start, n: generate_melody_compiled(model, start, n))
+    tflite_time, tflite_notes = best_time(tflite_model.generate)
+
+    return {
+        "argmax_agreement": float(np.mean(keras_choice == tflite_choice)),
+        "melody_agreement": float(np.mean(np.array(keras_notes) == np.array(tflite_notes))),
+        "keras_ms_per_note": keras_time * 1000,
+        "tflite_ms_per_note": tflite_time * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the Keras melody model to a quantized TFLite model")
+    parser.add_argument("--model", default=MELODY_MODEL_PATH, help="Keras melody model")
+    parser.add_argument("--output", default=TFLITE_MODEL_PATH)
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES, default="dynamic")
+    parser.add_argument("--calibration-sequences", type=int, default=64,
+                        help="Melodies generated to calibrate and check the quantized model")
+    parser.add_argument("--batch-size", type=int, default=1, help="Sequences per interpreter call")
+    parser.add_argument("--threads", type=int, default=None, help="Interpreter threads")
+    parser.add_argument("--check-notes", type=int, default=128,
+                        help="Notes generated to compare latency (0 skips the check)")
+    args = parser.parse_args()
+
+    from melody_inference import load_melody_model
+
+    model = load_melody_model(args.model)
+    if model is None:
+        parser.error(f"Can't load a Keras model from {args.model}")
+
+    start = time.perf_counter()
+    calibration = calibration_windows(model, sequences=args.calibration_sequences, seed=0)
+    data = convert_melody_model(model, quantization=args.quantization, calibration=calibration,
+                                batch_size=args.batch_size)
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    print(f"✅ {args.quantization} TFLite model saved to {args.output} in {time.perf_counter() - start:.1f}s "
+          f"({len(data) / 1024:.0f} KB, Keras file {os.path.getsize(args.model) / 1024:.0f} KB)")
+
+    if args.check_notes <= 0:
+        return
+
+    # Held out: different start notes than the calibration melodies
+    held_out = calibration_windows(model, sequences=args.calibration_sequences, seed=1)
+    tflite_model = TFLiteMelodyModel(args.output, num_threads=args.threads)
+    report = check_melody_model(model, tflite_model, held_out, num_notes=args.check_notes)
+    print(f"   argmax agreement: {report['argmax_agreement']:.1%} of {len(held_out)} windows, "
+          f"{report['melody_agreement']:.1%} of a {args.check_notes}-note melody")
+    print(f"   per note: Keras {report['keras_ms_per_note']:.3f} ms, TFLite {report['tflite_ms_per_note']:.3f} ms "
+          f"({report['keras_ms_per_note'] / report['tflite_ms_per_note']:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import hashlib
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from melody_inference import WINDOW_SIZE, MELODY_MODEL_PATH
+from training_data import DEFAULT_SHARD_NOTES, WindowShardWriter
+
+# Default folder ingested corpora are kept in
+DEFAULT_CORPUS_DIR = os.path.join("output", "corpus")
+
+def corpus_files(directory):
+    """
+    Every .mid/.midi file under a directory, in a stable order
+    """
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith((".mid", ".midi")):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+def corpus_digest(files):
+    """
+    Digest of the names, sizes and modification times of the corpus files,
+    to tell whether an ingested corpus is still up to date
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def file_top_line(path):
+    """
+    Read one MIDI file and extract its top line (runs in a pool process)
+
+    Returns:
+    - (path, pitches, durations, None), or (path, None, None, error message)
+    """
+    from midi_reader import read_smf, top_line
+
+    try:
+        events, _ = read_smf(path)
+    except (ValueError, IndexError, OSError) as e:
+        return path, None, None, str(e)
+    pitches, durations = top_line(events)
+    return path, pitches, durations, None
+
+def ingest_corpus(corpus, output=DEFAULT_CORPUS_DIR, workers=None, shard_notes=DEFAULT_SHARD_NOTES,
+                  min_notes=WINDOW_SIZE + 1, force=False):
+    """
+    Parse a folder of MIDI files in parallel and save their top lines as training windows
+
+    Files are parsed in a process pool, and their top lines (see
+    midi_reader.top_line()) are written in file order as .npy shards with a
+    window index (see training_data.WindowShardWriter), so the result is
+    the same for any number of workers. The output is reused as long as the
+    corpus files are unchanged.
+
+    Args:
+    - corpus: Folder searched recursively for .mid/.midi files
+    - output: Folder the shards are written to
+    - workers: Pool processes (one per core by default)
+    - shard_notes: Notes per shard
+    - min_notes: Top lines shorter than this are left out (a window needs WINDOW_SIZE + 1)
+    - force: Ingest again even if the corpus is unchanged
+
+    Returns:
+    - Metadata dict saved as index.json (with "reused" True if nothing was parsed)
+    """
+    files = corpus_files(corpus)
+    digest = corpus_digest(files)
+
+    index_path = os.path.join(output, "index.json")
+    if not force and os.path.exists(index_path):
+        with open(index_path) as f:
+            metadata = json.load(f)
+        if metadata.get("corpus_digest") == digest:
+            return dict(metadata, reused=True)
+
+    workers = workers or os.cpu_count()
+    writer = WindowShardWriter(output, shard_notes=shard_notes)
+    skipped = []
+    short = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Results come back in file order
+        for path, pitches, durations, error in pool.map(file_top_line, files,
+                                                        chunksize=max(1, len(files) // (8 * workers))):
+            if error is not None:
+                skipped.append({"file": path, "error": error})
+            elif len(pitches) < min_notes:
+                short += 1
+            else:
+                writer.add([pitches], [durations])
+
+    metadata = writer.close(corpus=os.path.abspath(corpus), corpus_digest=digest, files=len(files),
+                            skipped=skipped, short=short)
+    return dict(metadata, reused=False)
+
+def _npy_data_offset(path):
+    # Bytes before the array data of a .npy file
+    with open(path, "rb") as f:
+        if np.lib.format.read_magic(f) == (1, 0):
+            np.lib.format.read_array_header_1_0(f)
+        else:
+            np.lib.format.read_array_header_2_0(f)
+        return f.tell()
+
+def melody_dataset(directory=DEFAULT_CORPUS_DIR, batch_size=64, shuffle=True, shuffle_buffer=16384, seed=None,
+                   cache=True, cycle_length=4, repeat=False):
+    """
+    tf.data pipeline of training windows from ingested (or exported) shards
+
+    Shards are read and decoded in parallel (tf.io.decode_raw() on the .npy
+    data, no Python in the loop), optionally cached after the first pass,
+    and interleaved so windows of several shards mix before the shuffle
+    buffer. Batches are shaped like the melody model's input. Windows with a
+    rest (negative pitch) in them or as their target are left out, so every
+    label is a note.
+
+    Without shuffling, the windows are those MelodyWindows reads, but only
+    cycle_length=1 reads them in the same order; otherwise cycle_length
+    shards are interleaved window by window.
+
+    Args:
+    - directory: Folder written by ingest_corpus() or training_data.export_training_data()
+    - batch_size: Windows per batch
+    - shuffle: Shuffle shards and windows (every epoch)
+    - shuffle_buffer: Windows in the shuffle buffer
+    - seed: Optional seed of the order; a seeded pipeline is also deterministic
+      in its interleaving (a little slower)
+    - cache: True caches decoded shards in memory, a filename caches them on
+      disk, False reads the files every epoch
+    - cycle_length: Shards read at once
+    - repeat: Repeat forever (for model.fit() with steps_per_epoch)
+
+    Returns:
+    - tf.data.Dataset of (float32 pitches (B, window, 1), int32 next pitches (B,))
+    """
+    import tensorflow as tf
+
+    with open(os.path.join(directory, "index.json")) as f:
+        metadata = json.load(f)
+    window = metadata["window"]
+    shards = range(len(metadata["shards"]))
+    pitch_paths = [os.path.join(directory, f"pitch-{i:05d}.npy") for i in shards]
+    length_paths = [os.path.join(directory, f"lengths-{i:05d}.npy") for i in shards]
+
+    def load_shard(pitch_path, pitch_offset, length_path, length_offset):
+        pitches = tf.io.decode_raw(tf.strings.substr(tf.io.read_file(pitch_path), pitch_offset, -1), tf.int16)
+        lengths = tf.io.decode_raw(tf.strings.substr(tf.io.read_file(length_path), length_offset, -1), tf.int64)
+        # Same window starts as training_data.window_starts()
+        counts = tf.maximum(lengths - window, 0)
+        first_window = tf.cumsum(counts, exclusive=True)
+        starts = tf.repeat(tf.cumsum(lengths, exclusive=True) - first_window, counts) + \
+            tf.range(tf.reduce_sum(counts))
+        # Leave out windows with a rest in them or as their target (older exports kept -1 pitches)
+        rests = tf.concat([[0], tf.cumsum(tf.cast(pitches < 0, tf.int64))], 0)
+        starts = tf.boolean_mask(starts, tf.gather(rests, starts + window + 1) == tf.gather(rests, starts))
+        return tf.cast(pitches, tf.int32), starts
+
+    offsets = tf.range(window + 1, dtype=tf.int64)
+
+    def shard_windows(pitches, starts):
+        # Gathered in blocks, then handed on one window at a time
+        return tf.data.Dataset.from_tensor_slices(starts).batch(1024).map(
+            lambda block: tf.gather(pitches, block[:, tf.newaxis] + offsets)).unbatch()
+
+    dataset = tf.data.Dataset.from_tensor_slices((pitch_paths, [_npy_data_offset(p) for p in pitch_paths],
+                                                  length_paths, [_npy_data_offset(p) for p in length_paths]))
+    dataset = dataset.map(load_shard, num_parallel_calls=tf.data.AUTOTUNE)
+    if cache:
+        dataset = dataset.cache(cache if isinstance(cache, str) else "")
+    if shuffle:
+        dataset = dataset.shuffle(len(pitch_paths), seed=seed)
+    dataset = dataset.interleave(shard_windows, cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=seed is not None)
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+    if repeat:
+        dataset = dataset.repeat()
+    dataset = dataset.batch(batch_size).map(
+        lambda windows: (tf.cast(windows[:, :window, tf.newaxis], tf.float32), windows[:, window]),
+        num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a folder of MIDI files as melody training windows")
+    parser.add_argument("corpus", help="Folder of MIDI files")
+    parser.add_argument("--output", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Pool processes")
+    parser.add_argument("--shard-notes", type=int, default=DEFAULT_SHARD_NOTES)
+    parser.add_argument("--force", action="store_true", help="Ingest again even if the corpus is unchanged")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--check-batches", type=int, default=200,
+                        help="Batches read to time the tf.data pipeline (0 skips it)")
+    parser.add_argument("--fit-steps", type=int, default=0,
+                        help="Also time this many training steps of the melody model on the pipeline")
+    parser.add_argument("--model", default=MELODY_MODEL_PATH, help="Keras melody model for --fit-steps")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    metadata = ingest_corpus(args.corpus, args.output, workers=args.workers, shard_notes=args.shard_notes,
+                             force=args.force)
+    elapsed = time.perf_counter() - start
+    notes = sum(shard["notes"] for shard in metadata["shards"])
+    if metadata["reused"]:
+        print(f"✅ Corpus unchanged, reusing {args.output} ({notes} notes, {metadata['windows']} windows)")
+    else:
+        print(f"✅ Ingested {metadata['files']} files in {elapsed:.2f}s on {args.workers} workers: "
+              f"{notes} notes, {metadata['windows']} windows in {len(metadata['shards'])} shards")
+        if metadata["skipped"] or metadata["short"]:
+            print(f"   {len(metadata['skipped'])} unreadable files skipped, "
+                  f"{metadata['short']} top lines shorter than a window left out")
+    if not metadata["windows"] or args.check_batches <= 0:
+        return
+
+    dataset = melody_dataset(args.output, batch_size=args.batch_size, repeat=True)
+    batches = iter(dataset)
+    next(batches)
+    begin = time.perf_counter()
+    for _ in range(args.check_batches):
+        next(batches)
+    per_batch = (time.perf_counter() - begin) / args.check_batches
+    print(f"   tf.data: {per_batch * 1000:.2f} ms per batch of {args.batch_size} "
+          f"({args.batch_size / per_batch:,.0f} windows/sec)")
+
+    if args.fit_steps > 0:
+        from melody_inference import load_melody_model
+
+        model = load_melody_model(args.model)
+        if model is None or not hasattr(model, "fit"):
+            parser.error(f"Can't load a Keras model from {args.model}")
+        model.compile(optimizer="adam", loss="sparse_categorical_crossentropy")
+        model.fit(dataset, steps_per_epoch=1, epochs=1, verbose=0)
+        begin = time.perf_counter()
+        model.fit(dataset, steps_per_epoch=args.fit_steps, epochs=1, verbose=0)
+        per_step = (time.perf_counter() - begin) / args.fit_steps
+        print(f"   training: {per_step * 1000:.2f} ms per step, input pipeline "
+              f"{per_batch / per_step:.0%} of that (and runs ahead of it in parallel)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import struct
+import numpy as np
+from note_events import EVENT_DTYPE, empty_events
+
+# General MIDI percussion channel (channel 10, 0-based 9)
+DRUM_CHANNEL = 9
+
+def read_vlq(data, pos):
+    """
+    Decode a MIDI variable-length quantity
+
+    Returns:
+    - (value, position after it)
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def smf_chunks(data):
+    """
+    Read the header of Standard MIDI File bytes and locate its chunks, without
+    decoding them
+
+    Returns:
+    - (format, ticks_per_quarter, list of (chunk type, start, end) with start
+      and end the byte range of each chunk's body)
+    """
+    if data[:4] != b"MThd":
+        raise ValueError("Not a Standard MIDI File")
+    header_length, smf_format, track_count, division = struct.unpack(">IHHH", data[4:14])
+    if division & 0x8000:
+        raise ValueError("SMPTE time division isn't supported")
+
+    chunks = []
+    pos = 8 + header_length
+    while len(chunks) < track_count and pos + 8 <= len(data):
+        chunk_type = bytes(data[pos:pos + 4])
+        chunk_length = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        chunks.append((chunk_type, pos + 8, pos + 8 + chunk_length))
+        pos += 8 + chunk_length
+    return smf_format, division, chunks
+
+def parse_track(data, pos, end):
+    """
+    Decode the body of one MTrk chunk
+
+    Notes are paired note-on to note-off per channel and pitch (first on,
+    first off); notes still sounding at the end of the track end there.
+
+    Args:
+    - data: MIDI file contents
+    - pos, end: Byte range of the chunk body (see smf_chunks())
+
+    Returns:
+    - Dict with "notes" (onset tick, offset tick, pitch, velocity, channel
+      tuples), "name", "program" (first program change or None), "tempos"
+      ([(tick, microseconds per quarter)]) and "markers" ([(tick, text)])
+    """
+    track = {"notes": [], "name": None, "program": None, "tempos": [], "markers": []}
+    notes = track["notes"]
+    tick = 0
+    status = 0
+    sounding = {}
+
+    while pos < end:
+        delta, pos = read_vlq(data, pos)
+        tick += delta
+
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        # Otherwise running status: reuse the last status byte
+
+        kind = status & 0xF0
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_vlq(data, pos + 1)
+            payload = bytes(data[pos:pos + length])
+            pos += length
+            if meta_type == 0x03 and track["name"] is None:
+                track["name"] = payload.decode("latin-1")
+            elif meta_type == 0x06:
+                track["markers"].append((tick, payload.decode("latin-1")))
+            elif meta_type == 0x51 and length == 3:
+                track["tempos"].append((tick, int.from_bytes(payload, "big")))
+            elif meta_type == 0x2F:
+                break
+        elif status in (0xF0, 0xF7):
+            length, pos = read_vlq(data, pos)
+            pos += length
+        elif kind in (0xC0, 0xD0):
+            if kind == 0xC0 and track["program"] is None:
+                track["program"] = data[pos]
+            pos += 1
+        elif kind in (0x80, 0x90):
+            pitch, velocity = data[pos], data[pos + 1]
+            pos += 2
+            key = (status & 0x0F, pitch)
+            if kind == 0x90 and velocity > 0:
+                sounding.setdefault(key, []).append((tick, velocity))
+            elif sounding.get(key):
+                start, start_velocity = sounding[key].pop(0)
+                notes.append((start, tick, pitch, start_velocity, status & 0x0F))
+        else:
+            # Aftertouch, control change, pitch bend
+            pos += 2
+
+    for (channel, pitch), starts in sounding.items():
+        for start, start_velocity in starts:
+            notes.append((start, tick, pitch, start_velocity, channel))
+    return track
+
+def track_events(notes, ticks_per_quarter, track_index=0):
+    """
+    Turn the notes of parse_track() into an event array (times in quarter notes)
+    """
+    events = empty_events(len(notes))
+    if notes:
+        onsets, offsets, pitches, velocities, channels = (np.array(column) for column in zip(*notes))
+        events["onset"] = onsets / ticks_per_quarter
+        events["duration"] = (offsets - onsets) / ticks_per_quarter
+        events["pitch"] = pitches
+        events["velocity"] = velocities
+        events["channel"] = channels
+    events["track"] = track_index
+    return events
+
+def parse_smf(data):
+    """
+    Parse Standard MIDI File bytes into note events
+
+    Args:
+    - data: MIDI file contents
+
+    Returns:
+    - (events, info): event array (see note_events.EVENT_DTYPE) with times in
+      quarter notes and track set to the track chunk index, and a dict with
+      "format", "ticks_per_quarter", "tempos" ([(tick, microseconds per quarter)]),
+      "markers" ([(tick, text)]), "track_names" and "programs" (first program
+      change of each track, or None)
+    """
+    smf_format, ticks_per_quarter, chunks = smf_chunks(data)
+    info = {"format": smf_format, "ticks_per_quarter": ticks_per_quarter, "tempos": [], "markers": [],
+            "track_names": [], "programs": []}
+
+    blocks = []
+    for track_index, (chunk_type, start, end) in enumerate(chunks):
+        if chunk_type != b"MTrk":
+            # Unknown chunks are skipped, as the format asks
+            continue
+        track = parse_track(data, start, end)
+        blocks.append(track_events(track["notes"], ticks_per_quarter, track_index))
+        info["tempos"].extend(track["tempos"])
+        info["markers"].extend(track["markers"])
+        info["track_names"].append(track["name"])
+        info["programs"].append(track["program"])
+
+    if not blocks:
+        return empty_events(), info
+    events = np.concatenate(blocks)
+    return events[np.lexsort((events["track"], events["onset"]))], info
+
+def read_smf(filename):
+    """
+    Read a Standard MIDI File into note events (see parse_smf())
+    """
+    with open(filename, "rb") as f:
+        return parse_smf(f.read())
+
+def melody_lines(events, min_notes=2):
+    """
+    Extract one monophonic pitch line per track, for training melody models
+
+    Drum channel notes are left out, and of notes starting together only the
+    highest is kept (the usual "skyline" melody).
+
+    Args:
+    - events: Event array from read_smf()
+    - min_notes: Lines shorter than this are dropped
+
+    Returns:
+    - List of int16 pitch arrays
+    """
+    events = events[events["channel"] != DRUM_CHANNEL]
+    lines = []
+    for track in np.unique(events["track"]):
+        track_events = events[events["track"] == track]
+        # Highest pitch first at every onset, then keep the first of each onset
+        track_events = track_events[np.lexsort((-track_events["pitch"].astype(np.int32), track_events["onset"]))]
+        first = np.ones(len(track_events), dtype=bool)
+        first[1:] = np.diff(track_events["onset"]) != 0
+        line = track_events["pitch"][first].astype(np.int16)
+        if len(line) >= min_notes:
+            lines.append(line)
+    return lines
+
+def top_line(events):
+    """
+    Extract the monophonic top line of a whole file, for training melody models
+
+    Like melody_lines(), but over all tracks together: drum channel notes are
+    left out and of notes starting together only the highest is kept. Each
+    kept note lasts until the next one starts at most.
+
+    Args:
+    - events: Event array from read_smf()
+
+    Returns:
+    - (int16 pitches, float32 durations in quarter notes)
+    """
+    events = events[events["channel"] != DRUM_CHANNEL]
+    events = events[np.lexsort((-events["pitch"].astype(np.int32), events["onset"]))]
+    first = np.ones(len(events), dtype=bool)
+    first[1:] = np.diff(events["onset"]) != 0
+    line = events[first]
+
+    durations = line["duration"].astype(np.float64)
+    durations[:-1] = np.minimum(durations[:-1], np.diff(line["onset"]))
+    return line["pitch"].astype(np.int16), durations.astype(np.float32)
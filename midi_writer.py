@@ -0,0 +1,491 @@
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+# MIDI time resolution (ticks per quarter note)
+TICKS_PER_QUARTER = 480
+
+# Sequencer-specific meta event (0x7D: the non-commercial manufacturer ID)
+# opening every section in the instrument tracks of a sectioned song, with
+# the section number and the tick its last note in the track ends at
+SECTION_EVENT_ID = b"\x7dsection"
+SECTION_EVENT = struct.Struct(">II")
+
+def encode_vlq(value):
+    """
+    Encode a number as a MIDI variable-length quantity
+    """
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+def meta_event(delta, meta_type, payload):
+    """
+    Encode a meta event (FF type length payload) with its delta time
+    """
+    return encode_vlq(delta) + bytes([0xFF, meta_type]) + encode_vlq(len(payload)) + payload
+
+def section_event(delta, index, end_tick):
+    """
+    Encode the event that opens a section in an instrument track (see SECTION_EVENT_ID)
+    """
+    return meta_event(delta, 0x7F, SECTION_EVENT_ID + SECTION_EVENT.pack(index, end_tick))
+
+def section_tag(index, overlap=0):
+    """
+    Note-off velocity (1-124) tagging a note of a sectioned song
+
+    It holds the note's section (modulo 31) and how many notes of the same
+    pitch that started after it are still sounding (up to 3), which tells
+    the note's note-on apart from theirs.
+    """
+    return 1 + index % 31 * 4 + np.minimum(overlap, 3)
+
+def tag_note_offs(status, data1, notes, sections, sounding, earlier=None):
+    """
+    Note-off velocities of time-ordered messages of a sectioned song (see section_tag())
+
+    Only stretches where a pitch has more than one note sounding are
+    followed message by message; elsewhere notes can't overlap and are
+    tagged in one pass.
+
+    Args:
+    - status, data1: Status and pitch of every message
+    - notes: Note every message belongs to (a note and its note-off share it)
+    - sections: Section of every message
+    - sounding: Dict of channel * 128 + pitch to the notes sounding, in the
+      order they started; carried from one call to the next
+    - earlier: Optional dict of note to the notes of its pitch that started
+      after it but before the messages in sounding, for notes that started
+      before them too
+
+    Returns:
+    - uint8 array, the tag of every note-off and 0 for note-ons
+    """
+    releases = np.zeros(len(status), dtype=np.uint8)
+    if not len(status):
+        return releases
+    keys = (status & 0x0F).astype(np.int64) * 128 + data1
+    is_on = (status & 0xF0) == 0x90
+
+    # Notes of each pitch sounding after every message, pitch by pitch
+    order = np.argsort(keys, kind="stable")
+    steps = np.where(is_on[order], 1, -1)
+    totals = np.cumsum(steps)
+    starts = np.concatenate(([True], keys[order][1:] != keys[order][:-1]))
+    firsts = np.flatnonzero(starts)
+    group = np.cumsum(starts) - 1
+    pitches = keys[order][firsts].tolist()
+    carried = np.array([len(sounding.get(key, ())) for key in pitches])
+    levels = totals - (totals[firsts] - steps[firsts])[group] + carried[group]
+
+    # Stretches between silences of a pitch, crowded if two of its notes sound at once
+    stretch_starts = starts | (levels - steps == 0)
+    stretch_firsts = np.flatnonzero(stretch_starts)
+    stretch = np.cumsum(stretch_starts) - 1
+    crowded = np.maximum.reduceat(np.maximum(levels, levels - steps), stretch_firsts) > 1
+    crowded |= np.minimum.reduceat(levels, stretch_firsts) < 0
+    if earlier is not None:
+        crowded[:] = True
+    simple = ~crowded[stretch]
+
+    offs = order[simple & ~is_on[order]]
+    releases[offs] = section_tag(sections[offs])
+
+    rows = np.sort(order[~simple])
+    if len(rows):
+        # A crowded stretch after a simple one starts from silence
+        for key in np.unique(keys[order][simple & (stretch == stretch[firsts][group])]).tolist():
+            if key in sounding and np.any(keys[rows] == key):
+                sounding[key] = []
+        overlaps = np.zeros(len(rows), dtype=np.int64)
+        earlier = earlier or {}
+        for row, on, key, note in zip(range(len(rows)), is_on[rows].tolist(), keys[rows].tolist(),
+                                      notes[rows].tolist()):
+            later = sounding.setdefault(key, [])
+            if on:
+                later.append(note)
+            elif note in later:
+                position = len(later) - 1 - later[::-1].index(note)
+                overlaps[row] = len(later) - 1 - position
+                del later[position]
+            else:
+                overlaps[row] = len(later) + earlier.get(note, 0)
+        offs = ~is_on[rows]
+        releases[rows[offs]] = section_tag(sections[rows[offs]], overlaps[offs])
+
+    # Notes left sounding where a pitch's last stretch is simple
+    lasts = np.concatenate((firsts[1:], [len(order)])) - 1
+    last_ons = np.maximum.reduceat(np.where(is_on[order], np.arange(len(order)), -1), firsts)
+    for key, level, last, last_on in zip(pitches, levels[lasts].tolist(), lasts.tolist(), last_ons.tolist()):
+        if crowded[stretch[last]]:
+            continue
+        if not level:
+            sounding.pop(key, None)
+        elif last_on >= stretch_firsts[stretch[last]]:
+            sounding[key] = [int(notes[order[last_on]])]
+    return releases
+
+def encode_channel_messages(deltas, status, data1, data2):
+    """
+    Encode three-byte channel messages with their delta times in one pass
+
+    Args:
+    - deltas: Delta time of each message in ticks
+    - status: Status byte of each message
+    - data1, data2: Data bytes of each message
+
+    Returns:
+    - Encoded bytes, ready to go into a track chunk
+    """
+    deltas = np.asarray(deltas, dtype=np.int64)
+    if len(deltas) == 0:
+        return b""
+
+    # Delta times take 1 to 4 bytes, 7 bits each
+    sizes = 1 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    lengths = sizes + 3
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(4):
+        has_byte = sizes > k
+        remaining = sizes[has_byte] - 1 - k
+        byte = (deltas[has_byte] >> (7 * remaining)) & 0x7F
+        # Every byte but the last one of a quantity has the top bit set
+        out[starts[has_byte] + k] = byte | ((remaining > 0) * 0x80)
+
+    out[starts + sizes] = status
+    out[starts + sizes + 1] = data1
+    out[starts + sizes + 2] = data2
+    return out.tobytes()
+
+def sort_messages(ticks, status, data1, data2, *columns):
+    """
+    Put channel messages in time order
+
+    At equal times note-offs come before note-ons so repeated notes retrigger.
+    Further columns (one value per message) are put in the same order.
+
+    Returns:
+    - (ticks, status, data1, data2, *columns) arrays
+    """
+    is_on = (status & 0xF0) == 0x90
+    order = np.lexsort((data1, is_on, ticks))
+    return tuple(column[order] for column in (ticks, status, data1, data2) + columns)
+
+def note_messages(events, ticks_per_quarter=TICKS_PER_QUARTER, offset=0.0, first_note=None):
+    """
+    Turn events into time-ordered note-on/note-off messages
+
+    Args:
+    - events: Event array (see note_events.EVENT_DTYPE)
+    - ticks_per_quarter: MIDI time resolution
+    - offset: Added to every onset, in quarter notes
+    - first_note: If given, the note every message belongs to is returned
+      too, the events numbered from first_note
+
+    Returns:
+    - (ticks, status, data1, data2) arrays, plus notes with first_note
+    """
+    on_ticks = np.rint((events["onset"] + offset) * ticks_per_quarter).astype(np.int64)
+    off_ticks = np.rint((events["onset"] + offset + events["duration"]) * ticks_per_quarter).astype(np.int64)
+    pitches = np.clip(events["pitch"], 0, 127).astype(np.uint8)
+    channels = events["channel"].astype(np.uint8) & 0x0F
+
+    ticks = np.concatenate((off_ticks, on_ticks))
+    status = np.concatenate((0x80 | channels, 0x90 | channels))
+    data1 = np.concatenate((pitches, pitches))
+    data2 = np.concatenate((np.zeros(len(events), dtype=np.uint8), events["velocity"]))
+    if first_note is None:
+        return sort_messages(ticks, status, data1, data2)
+    notes = np.tile(np.arange(first_note, first_note + len(events), dtype=np.int64), 2)
+    return sort_messages(ticks, status, data1, data2, notes)
+
+def track_chunk(body):
+    """
+    Wrap encoded track events in an MTrk chunk
+    """
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+def conductor_track(bpm, title=None, text=None, markers=None, ticks_per_quarter=TICKS_PER_QUARTER):
+    """
+    Encode the tempo/metadata track (track 0 of a format 1 file)
+
+    markers is an optional list of (time in quarter notes, text) pairs,
+    written as marker events in time order.
+    """
+    body = b""
+    if title:
+        body += meta_event(0, 0x03, title.encode("utf-8"))
+    if text:
+        body += meta_event(0, 0x01, text.encode("utf-8"))
+    # 4/4 time signature
+    body += meta_event(0, 0x58, bytes([4, 2, 24, 8]))
+    body += meta_event(0, 0x51, struct.pack(">I", int(round(60000000 / bpm)))[1:])
+    last_tick = 0
+    for time, marker in sorted(markers or [], key=lambda m: m[0]):
+        tick = int(round(time * ticks_per_quarter))
+        body += meta_event(tick - last_tick, 0x06, marker.encode("utf-8"))
+        last_tick = tick
+    body += meta_event(0, 0x2F, b"")
+    return track_chunk(body)
+
+def track_header(track):
+    """
+    Encode the name and program change that open an instrument track
+    """
+    header = meta_event(0, 0x03, track["name"].encode("utf-8"))
+    header += bytes([0x00, 0xC0 | (track["channel"] & 0x0F), track["program"] & 0x7F])
+    return header
+
+def smf_header(track_count, ticks_per_quarter=TICKS_PER_QUARTER):
+    """
+    Encode the MThd chunk of a format 1 file
+    """
+    return b"MThd" + struct.pack(">IHHH", 6, 1, track_count, ticks_per_quarter)
+
+def encode_track(events, track, ticks_per_quarter=TICKS_PER_QUARTER, sections=None, section_starts=None):
+    """
+    Encode one instrument track chunk from the events on it
+
+    With sections (the section of every event, events in section order) and
+    section_starts (in quarter notes), the track is sectioned the way
+    SMFStreamWriter(sections=True) writes it.
+    """
+    if sections is None:
+        ticks, status, data1, data2 = note_messages(events, ticks_per_quarter)
+        deltas = np.diff(ticks, prepend=0)
+        return track_chunk(track_header(track) +
+                           encode_channel_messages(deltas, status, data1, data2) +
+                           meta_event(0, 0x2F, b""))
+
+    ticks, status, data1, data2, notes = note_messages(events, ticks_per_quarter, first_note=0)
+    message_sections = np.asarray(sections, dtype=np.int64)[notes]
+    data2 = data2 | tag_note_offs(status, data1, notes, message_sections, {})
+    start_ticks = np.rint(np.asarray(section_starts, dtype=np.float64) * ticks_per_quarter).astype(np.int64)
+    end_ticks = start_ticks.copy()
+    np.maximum.at(end_ticks, message_sections, ticks)
+
+    # Every section event goes ahead of the messages from its start on
+    splits = np.searchsorted(ticks, start_ticks, side="left")
+    previous = np.concatenate(([0], ticks[:-1]))
+    previous[splits[splits < len(ticks)]] = start_ticks[splits < len(ticks)]
+    deltas = ticks - previous
+    sizes = 4 + (deltas >= 1 << 7) + (deltas >= 1 << 14) + (deltas >= 1 << 21)
+    offsets = np.concatenate(([0], np.cumsum(sizes))).tolist()
+    body = encode_channel_messages(deltas, status, data1, data2)
+
+    pieces = [track_header(track)]
+    last_tick, position = 0, 0
+    for index, (start_tick, end_tick, split) in enumerate(zip(start_ticks.tolist(), end_ticks.tolist(),
+                                                             splits.tolist())):
+        if split > position:
+            pieces.append(body[offsets[position]:offsets[split]])
+            last_tick, position = int(ticks[split - 1]), split
+        pieces.append(section_event(start_tick - last_tick, index, end_tick))
+        last_tick = start_tick
+    pieces.append(body[offsets[position]:])
+    pieces.append(meta_event(0, 0x2F, b""))
+    return track_chunk(b"".join(pieces))
+
+def encode_smf(events, tracks, bpm=100, title=None, text=None, ticks_per_quarter=TICKS_PER_QUARTER,
+               markers=None, sections=None):
+    """
+    Encode events as a format 1 Standard MIDI File without building music21 objects
+
+    Args:
+    - events: Event array (see note_events.EVENT_DTYPE)
+    - tracks: List of track specs (dicts with "name", "program" and "channel"),
+      indexed by the events' track field
+    - bpm: Song tempo in BPM
+    - title: Optional song title (track name of the conductor track)
+    - text: Optional text event for the conductor track
+    - ticks_per_quarter: MIDI time resolution
+    - markers: Optional (time in quarter notes, text) marker events for the conductor track
+    - sections: Optional (section of every event, start of every section in
+      quarter notes), events in section order, to write the song sectioned
+      like SMFStreamWriter(sections=True)
+
+    Returns:
+    - MIDI file contents as bytes
+    """
+    chunks = [smf_header(len(tracks) + 1, ticks_per_quarter),
+              conductor_track(bpm, title, text, markers, ticks_per_quarter)]
+
+    for track_index, track in enumerate(tracks):
+        on_track = events["track"] == track_index
+        if sections is None:
+            chunks.append(encode_track(events[on_track], track, ticks_per_quarter))
+        else:
+            chunks.append(encode_track(events[on_track], track, ticks_per_quarter,
+                                       np.asarray(sections[0])[on_track], sections[1]))
+
+    return b"".join(chunks)
+
+def write_smf(filename, events, tracks, bpm=100, title=None, text=None, markers=None, sections=None):
+    """
+    Encode events as a Standard MIDI File and save it
+
+    Returns:
+    - The filename
+    """
+    # Encoded first, so a failed encode leaves no empty file behind
+    data = encode_smf(events, tracks, bpm=bpm, title=title, text=text, markers=markers, sections=sections)
+    with open(filename, "wb") as f:
+        f.write(data)
+    return filename
+
+class SMFStreamWriter:
+    """
+    Write a format 1 Standard MIDI File one section at a time
+
+    Every section's messages are encoded as soon as write_section() is
+    called and appended to a temporary spool file per track, with delta
+    times carried over from the previous section. Messages at or after the
+    section's end (notes ringing into the next section) are held back and
+    merged with the next section. close() writes the header, the conductor
+    track and copies the spools into the output file, so memory depends on
+    the size of a section, not of the song.
+
+    With sections=True every write_section() call is a numbered section:
+    its notes are tagged with section_tag() as their note-off velocity
+    (which synthesizers ignore), and a section event (see SECTION_EVENT_ID)
+    opens it in every track, so song_editor.py can find and replace the
+    notes of one section without decoding the rest of the song.
+    """
+
+    def __init__(self, filename, tracks, bpm=100, title=None, text=None,
+                 ticks_per_quarter=TICKS_PER_QUARTER, markers=None, sections=False):
+        self.filename = filename
+        self.tracks = tracks
+        self.bpm = bpm
+        self.title = title
+        self.text = text
+        self.markers = markers
+        self.ticks_per_quarter = ticks_per_quarter
+        self.sections = sections
+        self._section_count = 0
+        self._note_count = 0
+        # Notes sounding in each track, to tag note-offs (see tag_note_offs())
+        self._sounding = [{} for _ in tracks]
+
+        self._spools = []
+        for track in tracks:
+            spool = tempfile.TemporaryFile()
+            spool.write(track_header(track))
+            self._spools.append(spool)
+
+        # Time of the last message written to each track
+        self._last_ticks = [0] * len(tracks)
+        # Messages waiting for a later section, per track
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8), \
+            np.zeros(0, dtype=np.uint8)
+        if sections:
+            # Plus the note and section of every message
+            empty += np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self._pending = [empty] * len(tracks)
+
+    def write_section(self, events, offset=0.0, end=None):
+        """
+        Encode one section's events and append them to the track spools
+
+        Args:
+        - events: Event array, onsets relative to offset
+        - offset: Start of the section in quarter notes
+        - end: End of the section in quarter notes. Later sections must not
+          have notes before this time. Everything is flushed if omitted.
+        """
+        end_tick = None if end is None else int(round(end * self.ticks_per_quarter))
+        index = self._section_count
+        self._section_count += 1
+
+        for track_index in range(len(self.tracks)):
+            track_events = events[events["track"] == track_index]
+            if self.sections:
+                messages = note_messages(track_events, self.ticks_per_quarter, offset, first_note=self._note_count)
+                messages += np.full(len(messages[0]), index, dtype=np.int64),
+                self._note_count += len(track_events)
+                self._open_section(track_index, index, int(round(offset * self.ticks_per_quarter)), messages[0])
+            else:
+                messages = note_messages(track_events, self.ticks_per_quarter, offset)
+            messages = sort_messages(*(np.concatenate(parts) for parts in zip(self._pending[track_index], messages)))
+
+            if end_tick is None:
+                ready = len(messages[0])
+            else:
+                ready = int(np.searchsorted(messages[0], end_tick, side="left"))
+
+            self._flush(track_index, *(part[:ready] for part in messages))
+            self._pending[track_index] = tuple(part[ready:] for part in messages)
+
+    def _open_section(self, track_index, index, start_tick, ticks):
+        # Section event at the section's start, ahead of every message from then on
+        end_tick = int(ticks.max()) if len(ticks) else start_tick
+        self._spools[track_index].write(section_event(start_tick - self._last_ticks[track_index], index, end_tick))
+        self._last_ticks[track_index] = start_tick
+
+    def _flush(self, track_index, ticks, status, data1, data2, notes=None, sections=None):
+        if len(ticks) == 0:
+            return
+        if self.sections:
+            data2 = data2 | tag_note_offs(status, data1, notes, sections, self._sounding[track_index])
+        deltas = np.diff(ticks, prepend=self._last_ticks[track_index])
+        self._spools[track_index].write(encode_channel_messages(deltas, status, data1, data2))
+        self._last_ticks[track_index] = int(ticks[-1])
+
+    def close(self):
+        """
+        Flush held-back messages and assemble the output file
+
+        If that fails, the partial output file is removed. Closing a closed
+        writer does nothing.
+        """
+        if self._spools is None:
+            return self.filename
+
+        opened = False
+        try:
+            with open(self.filename, "wb") as f:
+                opened = True
+                f.write(smf_header(len(self.tracks) + 1, self.ticks_per_quarter))
+                f.write(conductor_track(self.bpm, self.title, self.text, self.markers, self.ticks_per_quarter))
+
+                for track_index, spool in enumerate(self._spools):
+                    self._flush(track_index, *self._pending[track_index])
+                    spool.write(meta_event(0, 0x2F, b""))
+
+                    f.write(b"MTrk" + struct.pack(">I", spool.tell()))
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, f)
+        except BaseException:
+            if opened:
+                os.remove(self.filename)
+            raise
+        finally:
+            self._close_spools()
+
+        return self.filename
+
+    def _close_spools(self):
+        # Temporary files, deleted as they are closed
+        for spool in self._spools:
+            spool.close()
+        self._spools = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # On an error nothing is written, and the spools are dropped
+        if self._spools is None:
+            return
+        if exc_type is None:
+            self.close()
+        else:
+            self._close_spools()
@@ -0,0 +1,196 @@
+from functools import lru_cache
+import numpy as np
+
+# Melody scales (MIDI offsets from root, including the octave)
+SCALES = {
+    "major": [0, 2, 4, 5, 7, 9, 11, 12],  # Major scale
+    "minor": [0, 2, 3, 5, 7, 8, 10, 12],  # Natural minor scale
+    "pentatonic": [0, 2, 4, 7, 9, 12],    # Major pentatonic
+    "blues": [0, 3, 5, 6, 7, 10, 12],     # Blues scale
+    "dorian": [0, 2, 3, 5, 7, 9, 10, 12]  # Dorian mode
+}
+
+# Range melodies are kept in (G3 to C6)
+MELODY_RANGE = (55, 84)
+
+# Rhythm patterns (quarter note = 1.0), from simple to complex
+RHYTHM_PATTERNS = [
+    [1.0, 1.0, 1.0, 1.0],  # Simple quarter notes
+    [0.5, 0.5, 1.0, 0.5, 0.5, 1.0],  # Eighth-quarter mix
+    [0.25, 0.25, 0.25, 0.25, 0.5, 0.5, 1.0],  # More complex
+    [0.5, 0.25, 0.25, 1.0, 0.5, 0.5],  # Syncopated
+    [1.5, 0.5, 1.0, 1.0]  # Dotted quarter + eighth
+]
+
+# Scale steps a melody can move by, per complexity tier
+MELODY_INTERVALS = [
+    [-1, 0, 0, 1, 1],  # Simple - small steps
+    [-2, -1, -1, 0, 0, 1, 1, 2],  # Medium - larger steps
+    [-3, -2, -1, 0, 1, 2, 3, 4]  # Complex - larger jumps
+]
+
+# Common chord progressions by scale degrees (1-based)
+PROGRESSIONS = {
+    "basic": [1, 4, 5, 1],         # I-IV-V-I
+    "pop": [1, 5, 6, 4],           # I-V-vi-IV
+    "blues": [1, 4, 1, 5, 4, 1],   # I-IV-I-V-IV-I
+    "jazz": [2, 5, 1, 6],          # ii-V-I-vi
+    "epic": [1, 5, 6, 3, 4, 1, 4, 5]  # I-V-vi-iii-IV-I-IV-V
+}
+
+# Scale degrees to build chords (0-based), for the modes chords support
+SCALE_DEGREES = {
+    "major": [0, 2, 4, 5, 7, 9, 11],   # Major scale
+    "minor": [0, 2, 3, 5, 7, 8, 10]    # Natural minor
+}
+
+# Chord types by scale degree (major or minor triads)
+CHORD_TYPES = {
+    "major": ["M", "m", "m", "M", "M", "m", "dim"],  # Major scale chord types
+    "minor": ["m", "dim", "M", "m", "m", "M", "M"]   # Minor scale chord types
+}
+
+# Triad intervals and added seventh of each chord type
+CHORD_INTERVALS = {
+    "M": ([0, 4, 7], 11),    # Major triad, major seventh
+    "m": ([0, 3, 7], 10),    # Minor triad, minor seventh
+    "dim": ([0, 3, 6], 9)    # Diminished triad, diminished seventh
+}
+
+# Bass patterns per complexity tier: (offset from chord root, share of the chord's duration)
+BASS_PATTERNS = [
+    [(-12, 1.0)],  # Simple - just the root note
+    [(-12, 0.5), (-5, 0.5)],  # Medium - root and fifth pattern
+    [(-12, 0.25), (-5, 0.25), (-7, 0.25), (-10, 0.25)]  # Complex - walking bass pattern
+]
+
+def complexity_tier(complexity):
+    """
+    Map a complexity value (0.0-2.0) to 0 (simple), 1 (medium) or 2 (complex)
+    """
+    if complexity < 0.7:
+        return 0
+    elif complexity < 1.3:
+        return 1
+    return 2
+
+def rhythm_pattern_for(complexity):
+    """
+    Pick the rhythm pattern a melody of this complexity uses
+    """
+    return RHYTHM_PATTERNS[min(int(complexity * len(RHYTHM_PATTERNS)), len(RHYTHM_PATTERNS) - 1)]
+
+def _build_chord_voicings():
+    # Offsets from the key note (one octave down, as create_chord_progression()
+    # always voiced them) for every degree of every chord mode
+    voicings = {}
+    for scale_type, degrees in SCALE_DEGREES.items():
+        voicings[scale_type] = []
+        for degree, chord_type in zip(degrees, CHORD_TYPES[scale_type]):
+            triad, seventh = CHORD_INTERVALS[chord_type]
+            triad = [degree - 12 + interval for interval in triad]
+            voicings[scale_type].append((triad, triad + [degree - 12 + seventh]))
+    return voicings
+
+# Per mode, per degree: (triad, seventh chord) as offsets from the key note
+CHORD_VOICINGS = _build_chord_voicings()
+
+@lru_cache(maxsize=None)
+def chord_voicings(key, scale_type="major"):
+    """
+    Triad and seventh voicings of every scale degree in a key
+
+    Args:
+    - key: Root note of the key (60 = C)
+    - scale_type: "major" or "minor" (anything else uses major)
+
+    Returns:
+    - Tuple of 7 (triad notes, seventh chord notes) pairs of MIDI notes
+    """
+    voicings = CHORD_VOICINGS.get(scale_type, CHORD_VOICINGS["major"])
+    return tuple((tuple(key + n for n in triad), tuple(key + n for n in seventh))
+                 for triad, seventh in voicings)
+
+@lru_cache(maxsize=None)
+def melody_scale(start_note, scale_type="major"):
+    """
+    Scale notes and pitch lookup used by the scale-based melody generators
+
+    The scale spans one octave below to two octaves above the start note and
+    is cut to MELODY_RANGE.
+
+    Args:
+    - start_note: MIDI note the melody starts with (sets root and octave)
+    - scale_type: Scale name in SCALES (anything else uses major)
+
+    Returns:
+    - (full_scale, position_lookup, snap): the scale notes as a tuple; for
+      every MIDI pitch 0-127 the position of the closest scale note (first
+      one on ties); and for every scale position the position of the first
+      copy of its pitch (the octave note is listed twice)
+    """
+    current_scale = np.array(SCALES.get(scale_type, SCALES["major"]))
+    root_note = start_note % 12
+    octave = start_note // 12 - 1
+
+    full_scale = (root_note + current_scale[None, :] + (octave + np.arange(-1, 3))[:, None] * 12).ravel()
+    full_scale = full_scale[(full_scale >= MELODY_RANGE[0]) & (full_scale <= MELODY_RANGE[1])]
+
+    position_lookup = np.abs(np.arange(128)[:, None] - full_scale[None, :]).argmin(axis=1)
+    snap = position_lookup[full_scale]
+
+    for table in (position_lookup, snap):
+        table.setflags(write=False)
+    return tuple(int(n) for n in full_scale), position_lookup, snap
+
+def _warm_scale_tables():
+    # Build the tables for every root and mode up front, over the three octaves
+    # around middle C the song builders use; other keys fill in on first use
+    for start_note in range(48, 84):
+        for scale_type in SCALES:
+            melody_scale(start_note, scale_type)
+        for scale_type in SCALE_DEGREES:
+            chord_voicings(start_note, scale_type)
+
+_warm_scale_tables()
+
+def score_melody_candidates(candidates, song_key=60, scale_type="major"):
+    """
+    Cheap musical score of candidate note sequences, higher is better
+
+    Sums three shares, each between 0 and 1: notes inside MELODY_RANGE, notes
+    in the song's scale, and - subtracted - repetition (the mean of notes
+    repeating the previous one and of 4-note patterns already heard in the
+    candidate).
+
+    Args:
+    - candidates: Array of shape (N, notes) of MIDI notes
+    - song_key: Root note of the key
+    - scale_type: Scale name in SCALES (anything else uses major)
+
+    Returns:
+    - float array of N scores
+    """
+    candidates = np.asarray(candidates, dtype=np.int64)
+    count, length = candidates.shape
+    if length == 0:
+        return np.zeros(count)
+
+    in_range = ((candidates >= MELODY_RANGE[0]) & (candidates <= MELODY_RANGE[1])).mean(axis=1)
+
+    pitch_classes = (song_key + np.array(SCALES.get(scale_type, SCALES["major"]))) % 12
+    in_scale = np.isin(candidates % 12, pitch_classes).mean(axis=1)
+
+    repeated_notes = (candidates[:, 1:] == candidates[:, :-1]).mean(axis=1) if length > 1 else np.zeros(count)
+    if length > 4:
+        # Every 4-note pattern as one number, tagged with its row, then the
+        # share of patterns that aren't the first of their kind in the row
+        codes = candidates[:, :-3] * 128 ** 3 + candidates[:, 1:-2] * 128 ** 2 + \
+            candidates[:, 2:-1] * 128 + candidates[:, 3:]
+        rows = np.repeat(np.arange(count), codes.shape[1])
+        distinct = np.unique(np.stack([rows, codes.ravel()]), axis=1)[0]
+        repeated_patterns = 1 - np.bincount(distinct, minlength=count) / codes.shape[1]
+    else:
+        repeated_patterns = np.zeros(count)
+
+    return in_range + in_scale - (repeated_notes + repeated_patterns) / 2
@@ -0,0 +1,223 @@
+import numpy as np
+
+# One row per sounding note. Times are in quarter notes (1.0 = one beat).
+EVENT_DTYPE = np.dtype([
+    ("onset", np.float64),
+    ("duration", np.float64),
+    ("pitch", np.int16),
+    ("velocity", np.uint8),
+    ("track", np.uint8),
+    ("channel", np.uint8),
+])
+
+# A monophonic line as arrays: one row per (note, duration) pair, rests have pitch -1
+MELODY_DTYPE = np.dtype([
+    ("pitch", np.int16),
+    ("duration", np.float64),
+])
+
+def melody_array(melody):
+    """
+    Convert a (note or None, duration) list into a MELODY_DTYPE array
+
+    Args:
+    - melody: List of pairs, or a MELODY_DTYPE array (returned as is)
+
+    Returns:
+    - NumPy structured array with MELODY_DTYPE
+    """
+    if isinstance(melody, np.ndarray):
+        return melody
+    array = np.zeros(len(melody), dtype=MELODY_DTYPE)
+    if melody:
+        array["pitch"] = [-1 if n is None else n for n, _ in melody]
+        array["duration"] = [d for _, d in melody]
+    return array
+
+def empty_events(count=0):
+    """
+    Create a zero-filled event array
+
+    Args:
+    - count: Number of events
+
+    Returns:
+    - NumPy structured array with EVENT_DTYPE
+    """
+    return np.zeros(count, dtype=EVENT_DTYPE)
+
+def melody_events(melody, onset=0.0, track=0, channel=0, velocity_range=(90, 110)):
+    """
+    Convert a (note, duration) list into events, skipping rests
+
+    Args:
+    - melody: List of (MIDI note or None, duration) pairs played back to back,
+      or a MELODY_DTYPE array
+    - onset: Start time of the first pair in quarter notes
+    - track: Output track index
+    - channel: MIDI channel (0-15)
+    - velocity_range: Inclusive (low, high) range velocities are drawn from
+
+    Returns:
+    - Event array
+    """
+    melody = melody_array(melody)
+    if not len(melody):
+        return empty_events()
+
+    pitches = melody["pitch"]
+    durations = melody["duration"]
+
+    # Every pair starts where the previous one ended
+    onsets = onset + np.concatenate(([0.0], np.cumsum(durations[:-1])))
+    sounding = pitches >= 0
+
+    events = empty_events(int(sounding.sum()))
+    events["onset"] = onsets[sounding]
+    events["duration"] = durations[sounding]
+    events["pitch"] = pitches[sounding]
+    events["velocity"] = np.random.randint(velocity_range[0], velocity_range[1] + 1, size=len(events))
+    events["track"] = track
+    events["channel"] = channel
+    return events
+
+def chord_events(chords, onset=0.0, track=0, channel=0, velocity_range=(70, 85), rests=None):
+    """
+    Convert a (chord notes, duration) list into events, skipping rests
+
+    All notes of a chord share one onset, duration and velocity.
+
+    Args:
+    - chords: List of (list of MIDI notes or None, duration) pairs played back to back
+    - onset: Start time of the first pair in quarter notes
+    - track: Output track index
+    - channel: MIDI channel (0-15)
+    - velocity_range: Inclusive (low, high) range velocities are drawn from
+    - rests: Optional boolean mask of pairs to leave silent (they keep their time)
+
+    Returns:
+    - Event array
+    """
+    if not chords:
+        return empty_events()
+
+    durations = np.array([d for _, d in chords], dtype=np.float64)
+    onsets = onset + np.concatenate(([0.0], np.cumsum(durations[:-1])))
+    sizes = np.array([0 if notes is None else len(notes) for notes, _ in chords])
+    pitches = np.array([n for notes, _ in chords if notes is not None for n in notes], dtype=np.int16)
+    velocities = np.random.randint(velocity_range[0], velocity_range[1] + 1, size=len(chords))
+    if rests is not None:
+        pitches = pitches[~np.repeat(rests, sizes)]
+        sizes = np.where(rests, 0, sizes)
+
+    events = empty_events(int(sizes.sum()))
+    events["onset"] = np.repeat(onsets, sizes)
+    events["duration"] = np.repeat(durations, sizes)
+    events["pitch"] = pitches
+    events["velocity"] = np.repeat(velocities, sizes)
+    events["track"] = track
+    events["channel"] = channel
+    return events
+
+def grid_events(grid, pitches, onset=0.0, step=0.25, track=0, channel=0, velocity_range=(80, 100)):
+    """
+    Convert a boolean step grid (one row per instrument sound) into events
+
+    Only the set steps are visited, so empty steps cost nothing.
+
+    Args:
+    - grid: Boolean array of shape (rows, steps)
+    - pitches: MIDI note of each row
+    - onset: Start time of step 0 in quarter notes
+    - step: Length of one step in quarter notes (also the note duration)
+    - track: Output track index
+    - channel: MIDI channel (0-15)
+    - velocity_range: Inclusive (low, high) range velocities are drawn from
+
+    Returns:
+    - Event array
+    """
+    rows, steps = np.nonzero(grid)
+    events = empty_events(len(rows))
+    events["onset"] = onset + steps * step
+    events["duration"] = step
+    events["pitch"] = np.asarray(pitches)[rows]
+    events["velocity"] = np.random.randint(velocity_range[0], velocity_range[1] + 1, size=len(events))
+    events["track"] = track
+    events["channel"] = channel
+    return events
+
+def concat_events(blocks, offsets=None):
+    """
+    Join event arrays into one, sorted by onset then track
+
+    Args:
+    - blocks: Iterable of event arrays
+    - offsets: Optional time in quarter notes added to the onsets of each
+      block; the blocks themselves aren't changed, so shared (e.g. cached)
+      blocks can be placed at several times
+
+    Returns:
+    - Event array
+    """
+    blocks = list(blocks)
+    if not blocks:
+        return empty_events()
+    events = np.concatenate(blocks)
+    if offsets is not None:
+        events["onset"] += np.repeat(np.asarray(offsets, dtype=np.float64), [len(block) for block in blocks])
+    return events[np.lexsort((events["track"], events["onset"]))]
+
+def events_to_score(events, tracks, bpm=100, title=None, composer=None):
+    """
+    Build a music21 Score from an event array
+
+    Only needed when music21 output (MusicXML, notation, song.write) is wanted;
+    midi_writer.encode_smf() writes MIDI directly from the events.
+
+    Args:
+    - events: Event array
+    - tracks: List of track specs (dicts with "name", "instrument" and optionally
+      "chords"), indexed by the events' track field
+    - bpm: Song tempo in BPM
+    - title: Optional score title
+    - composer: Optional composer name
+
+    Returns:
+    - music21 stream.Score
+    """
+    from music21 import stream, note, instrument, chord, metadata, tempo as music21_tempo
+
+    song = stream.Score()
+    if title or composer:
+        song.insert(0, metadata.Metadata())
+        song.metadata.title = title
+        song.metadata.composer = composer
+    song.insert(0, music21_tempo.MetronomeMark(number=bpm))
+
+    for track_index, track in enumerate(tracks):
+        part = stream.Part()
+        part.append(getattr(instrument, track["instrument"])())
+
+        track_events = events[events["track"] == track_index]
+        if track.get("chords") and len(track_events):
+            # Notes sharing onset and duration were written as one chord
+            track_events = track_events[np.lexsort((track_events["duration"], track_events["onset"]))]
+            starts = np.ones(len(track_events), dtype=bool)
+            starts[1:] = ((np.diff(track_events["onset"]) != 0) |
+                          (np.diff(track_events["duration"]) != 0))
+            for group in np.split(track_events, np.flatnonzero(starts)[1:]):
+                new_chord = chord.Chord([int(p) for p in group["pitch"]])
+                new_chord.duration.quarterLength = float(group["duration"][0])
+                new_chord.volume.velocity = int(group["velocity"][0])
+                part.insert(float(group["onset"][0]), new_chord)
+        else:
+            for event in track_events:
+                new_note = note.Note(int(event["pitch"]))
+                new_note.duration.quarterLength = float(event["duration"])
+                new_note.volume.velocity = int(event["velocity"])
+                part.insert(float(event["onset"]), new_note)
+
+        song.insert(0, part)
+
+    return song
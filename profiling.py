@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Tracer the hooks record into; None when tracing is off
+_tracer = None
+
+class _NullSpan:
+    # Shared do-nothing span handed out while tracing is off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns() - self.start, self.args)
+        return False
+
+class Tracer:
+    """
+    Timing spans and counters of one profiled run
+
+    Spans are kept as (name, start ns, duration ns, thread id, args) tuples
+    and counters as running totals, with every update kept as a sample so
+    they can be drawn over time in a trace viewer.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.counter_samples = []
+
+    def record(self, name, start, duration, args=None):
+        self.spans.append((name, start, duration, threading.get_ident(), args))
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+        self.counter_samples.append((name, time.perf_counter_ns(), self.counters[name]))
+
+    def chrome_trace(self):
+        """
+        Spans and counters in the Chrome trace event format (chrome://tracing, Perfetto)
+
+        Returns:
+        - JSON-serializable dict
+        """
+        events = []
+        for name, start, duration, thread, args in self.spans:
+            event = {"name": name, "ph": "X", "pid": self.pid, "tid": thread,
+                     "ts": (start - self.origin) / 1000, "dur": duration / 1000}
+            if args:
+                event["args"] = args
+            events.append(event)
+        for name, at, value in self.counter_samples:
+            events.append({"name": name, "ph": "C", "pid": self.pid, "ts": (at - self.origin) / 1000,
+                           "args": {name: value}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, filename):
+        """
+        Save chrome_trace() as JSON
+
+        Returns:
+        - The filename
+        """
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        return filename
+
+    def summary(self):
+        """
+        Flat per-span-name totals, longest total first
+
+        Returns:
+        - List of dicts with "name", "calls", "total_ms", "mean_ms" and "max_ms"
+        """
+        totals = defaultdict(lambda: [0, 0, 0])
+        for name, _, duration, _, _ in self.spans:
+            entry = totals[name]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+        rows = [{"name": name, "calls": calls, "total_ms": total / 1e6, "mean_ms": total / calls / 1e6,
+                 "max_ms": longest / 1e6}
+                for name, (calls, total, longest) in totals.items()]
+        return sorted(rows, key=lambda row: -row["total_ms"])
+
+    def report(self):
+        """
+        Describe the summary and counters as a table
+        """
+        lines = [f"{'span':28s} {'calls':>7s} {'total ms':>10s} {'mean ms':>9s} {'max ms':>9s}"]
+        for row in self.summary():
+            lines.append(f"{row['name']:28s} {row['calls']:7d} {row['total_ms']:10.2f} "
+                         f"{row['mean_ms']:9.3f} {row['max_ms']:9.3f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:28s} {value:7d}")
+        return "\n".join(lines)
+
+def span(name, **args):
+    """
+    Context manager timing a block as a span while tracing is on
+
+    Costs one global lookup and a shared no-op context while tracing is off.
+
+    Args:
+    - name: Span name (what ran, e.g. "render_section")
+    - args: Optional JSON-serializable details shown with the span
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, args)
+
+def count(name, value=1):
+    """
+    Add to a counter while tracing is on
+    """
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+def enabled():
+    return _tracer is not None
+
+@contextmanager
+def tracing():
+    """
+    Record spans and counters of everything run inside the block
+
+    Only the calling process is traced: sections rendered in worker
+    processes show up as the span around the pool call.
+
+    Yields:
+    - Tracer
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = Tracer()
+    try:
+        yield _tracer
+    finally:
+        _tracer = previous
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile one song generation run stage by stage")
+    parser.add_argument("--output", default=os.path.join("output", "song_trace.json"), help="Chrome trace JSON")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeat the default song structure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--export", choices=["smf", "music21"], default="smf")
+    parser.add_argument("--melody-mode", default="compiled")
+    parser.add_argument("--no-model", action="store_true", help="Scale-based melodies only")
+    args = parser.parse_args()
+
+    import tempfile
+    import full_instrumental_melody as fim
+    # As a script this is __main__; the generator records into the imported module
+    import profiling
+
+    if args.no_model:
+        fim.melody_model = None
+    with tempfile.TemporaryDirectory() as tmp, profiling.tracing() as tracer:
+        with profiling.span("generate_multi_instrument_song"):
+            fim.generate_multi_instrument_song(os.path.join(tmp, "song.mid"), seed=args.seed, export=args.export,
+                                               melody_mode=args.melody_mode,
+                                               song_structure=fim.DEFAULT_SONG_STRUCTURE * args.repeat)
+    tracer.write_chrome_trace(args.output)
+    print(tracer.report())
+    print(f"✅ Chrome trace saved to {args.output} (open in chrome://tracing or ui.perfetto.dev)")
+
+if __name__ == "__main__":
+    main()
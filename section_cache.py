@@ -0,0 +1,69 @@
+# How a song treats a section it has already rendered:
+# - "exact": reuse the stored events as they are
+# - "vary": reuse them with small changes (see full_instrumental_melody.vary_section())
+# - "regenerate": render every section from scratch, as without a cache
+CACHE_POLICIES = ("exact", "vary", "regenerate")
+
+class SectionCache:
+    """
+    Rendered song sections, keyed by section type and render parameters
+
+    Stored event arrays are made read-only and shared by every section that
+    reuses them; their onsets stay relative to the section start and are
+    shifted only when the song is written, so reusing a section doesn't
+    copy its notes.
+
+    hits counts sections taken from the cache, misses counts sections that
+    had to be rendered.
+    """
+
+    def __init__(self, policy="exact"):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}', expected one of {', '.join(CACHE_POLICIES)}")
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self._sections = {}
+
+    def __contains__(self, key):
+        return self.policy != "regenerate" and key in self._sections
+
+    def __len__(self):
+        return len(self._sections)
+
+    def get(self, key):
+        """
+        Return the stored events of a section and count a hit
+
+        Raises:
+        - KeyError if the section isn't cached
+        """
+        if key not in self:
+            raise KeyError(key)
+        self.hits += 1
+        return self._sections[key]
+
+    def put(self, key, events):
+        """
+        Store a freshly rendered section and count a miss
+
+        Returns:
+        - The events, now read-only
+        """
+        self.misses += 1
+        events.setflags(write=False)
+        if self.policy != "regenerate":
+            self._sections[key] = events
+        return events
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self):
+        """
+        Describe how often sections were reused
+        """
+        return (f"Section cache ({self.policy}): {self.hits}/{self.hits + self.misses} sections reused "
+                f"({self.hit_rate:.0%} hit rate), {len(self)} stored")
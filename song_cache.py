@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from functools import lru_cache
+import numpy as np
+from melody_inference import MELODY_MODEL_PATH
+
+# Where rendered songs are kept, and how much disk they may use
+DEFAULT_SONG_CACHE_DIR = os.path.join("output", "cache", "songs")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Temporary files older than this are left over from crashed writers
+STALE_TEMP_SECONDS = 60 * 60
+
+# Modules whose code decides the notes of a song; editing any of them
+# changes every cache key
+GENERATOR_MODULES = ["full_instrumental_melody.py", "melody_inference.py", "music_theory.py",
+                     "note_events.py", "midi_writer.py", "section_cache.py", "markov_melody.py",
+                     "melody_tflite.py"]
+
+@lru_cache(maxsize=None)
+def generator_version():
+    """
+    Digest of the song generator's source code
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in GENERATOR_MODULES:
+        with open(os.path.join(directory, name), "rb") as f:
+            digest.update(name.encode("utf-8") + b"\0" + f.read())
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def _file_digest(path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def model_digest(path=MELODY_MODEL_PATH):
+    """
+    Digest of the melody model songs are built with, "none" without a model
+
+    Doesn't load the model: a cache hit shouldn't pay for TensorFlow.
+    """
+    import full_instrumental_melody as fim
+
+    # A model set (or found missing) in this process wins over the file
+    if "melody_model" in vars(fim) and fim.melody_model is None:
+        return "none"
+    if not os.path.exists(path):
+        return "none"
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+def melody_model_digest(path=MELODY_MODEL_PATH, melody_mode="compiled"):
+    """
+    Digest of the model file a melody mode actually runs
+
+    In "tflite" mode a Keras model is swapped for the converted model at
+    melody_tflite.TFLITE_MODEL_PATH (see get_tflite_model()), so that file
+    is hashed too; .tflite and .npz models run as they are.
+    """
+    digest = model_digest(path)
+    if melody_mode != "tflite" or digest == "none" or path.endswith((".tflite", ".npz")):
+        return digest
+    from melody_tflite import TFLITE_MODEL_PATH
+
+    return f"{digest}+{model_digest(TFLITE_MODEL_PATH)}"
+
+def seed_description(seed):
+    """
+    JSON-serializable form of an int or np.random.SeedSequence seed
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return {"entropy": str(seed.entropy), "spawn_key": list(seed.spawn_key)}
+    return seed
+
+def song_cache_key(seed, params, model_path=MELODY_MODEL_PATH):
+    """
+    Content address of a song: hash of its seed, parameters, generator code
+    and the melody model its melody_mode runs (see melody_model_digest())
+
+    Args:
+    - seed: int or np.random.SeedSequence the song is generated with
+    - params: JSON-serializable dict of the song's parameters
+    - model_path: Path to the melody model
+
+    Returns:
+    - Hex digest
+    """
+    description = json.dumps({
+        "seed": seed_description(seed),
+        "params": params,
+        "code": generator_version(),
+        "model": melody_model_digest(model_path, params.get("melody_mode"))
+    }, sort_keys=True)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+class SongCache:
+    """
+    Content-addressed directory of rendered MIDI files with LRU eviction
+
+    Files are written to a temporary name and renamed into place, so readers
+    never see a partial file and any number of processes can write at once
+    (two writers of the same key write the same bytes). A hit touches the
+    file's modification time, and eviction removes the least recently used
+    files until the directory is back under 90% of max_bytes. Temporary
+    files count towards the size, and eviction also removes those older than
+    STALE_TEMP_SECONDS, left behind by writers that crashed.
+
+    Each process tracks the directory size from its last scan plus its own
+    writes, and rescans every rescan_every writes to pick up other writers.
+    """
+
+    def __init__(self, directory=DEFAULT_SONG_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, rescan_every=64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rescan_every = rescan_every
+        self.hits = 0
+        self.misses = 0
+
+        self._size = None
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        """
+        File a key is stored in (spread over 256 subdirectories)
+        """
+        return os.path.join(self.directory, key[:2], key + ".mid")
+
+    def get(self, key):
+        """
+        Return the stored MIDI bytes of a key, or None
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            # Missing, or evicted by another process
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Store MIDI bytes under a key and evict old files if over the size cap
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            # e.g. another process holds the file open on Windows; its copy is identical
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self._writes += 1
+        if self._size is None or self._writes % self.rescan_every == 0:
+            self._size = self.size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        # (modification time, size, path) of every stored and temporary file
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith((".mid", ".tmp")):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """
+        Total bytes of the stored files (and of temporary ones being written)
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target_bytes=None):
+        """
+        Remove stale temporary files, then least recently used files until
+        the cache fits in target_bytes (90% of max_bytes by default)
+
+        Returns:
+        - Number of files removed
+        """
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * 0.9)
+
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        stale = time.time() - STALE_TEMP_SECONDS
+        songs = []
+        for modified, size, path in entries:
+            if not path.endswith(".tmp"):
+                songs.append((modified, size, path))
+            elif modified < stale:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    # Renamed into place or swept by another process
+                    pass
+                total -= size
+
+        for _, size, path in songs:
+            if total <= target_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Already evicted by another process
+                pass
+            total -= size
+
+        self._size = total
+        return removed
+
+    def report(self):
+        """
+        Describe how often this process found songs in the cache
+        """
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return f"Song cache: {self.hits}/{lookups} hits ({rate:.0%}), {self.directory}"
+
+def generate_song_cached(filename, cache, seed, bpm=100, song_structure=None, section_lengths=None,
+                         song_key=60, song_scale="major", melody_mode="compiled", export="smf",
+                         section_cache=None, model_path=MELODY_MODEL_PATH, **options):
+    """
+    Write a song to filename, from the cache if it was generated before
+
+    Takes the arguments of generate_multi_instrument_song(); seed is required
+    because only seeded songs are reproducible. Options that don't change
+    the output (streaming, section_workers, generate_batch) aren't part of
+    the key. model_path is the model file the song's melody_model was loaded
+    from, for the key.
+
+    Returns:
+    - (filename, True if it came from the cache)
+    """
+    from full_instrumental_melody import (generate_multi_instrument_song, DEFAULT_SONG_STRUCTURE,
+                                          DEFAULT_SECTION_LENGTHS)
+
+    if seed is None:
+        raise ValueError("Cached songs need a seed")
+    if section_cache is not None and not isinstance(section_cache, str):
+        raise ValueError("Cached songs take a section cache policy, not a shared SectionCache")
+
+    params = {
+        "bpm": bpm,
+        "song_structure": list(song_structure or DEFAULT_SONG_STRUCTURE),
+        "section_lengths": dict(section_lengths or DEFAULT_SECTION_LENGTHS),
+        "song_key": song_key,
+        "song_scale": song_scale,
+        "melody_mode": melody_mode,
+        "export": export,
+        "section_cache": section_cache
+    }
+    key = song_cache_key(seed, params, model_path)
+
+    data = cache.get(key)
+    if data is not None:
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(data)
+        return filename, True
+
+    generate_multi_instrument_song(filename, bpm=bpm, song_structure=song_structure,
+                                   section_lengths=section_lengths, song_key=song_key, song_scale=song_scale,
+                                   melody_mode=melody_mode, export=export, section_cache=section_cache,
+                                   seed=seed, **options)
+    with open(filename, "rb") as f:
+        cache.put(key, f.read())
+    return filename, False
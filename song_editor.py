@@ -0,0 +1,272 @@
+import argparse
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+import full_instrumental_melody as fim
+from midi_reader import read_vlq, smf_chunks, parse_track
+from midi_writer import SECTION_EVENT, SECTION_EVENT_ID, encode_vlq, note_messages, tag_note_offs, track_chunk
+
+def song_sections(data):
+    """
+    Read the sections of a generated song from its marker events
+
+    Only the conductor track is decoded.
+
+    Args:
+    - data: MIDI file contents written by generate_multi_instrument_song()
+
+    Returns:
+    - List of dicts with "name", "start" and "end" (ticks) and "measures"
+    """
+    _, ticks_per_quarter, chunks = smf_chunks(data)
+    if not chunks:
+        raise ValueError("Song has no tracks")
+    _, start, end = chunks[0]
+    markers = parse_track(data, start, end)["markers"]
+    if not markers or markers[-1][1] != fim.SONG_END_MARKER:
+        raise ValueError("Song has no section markers (songs get them from SMF export)")
+
+    return [{"name": name, "start": tick, "end": next_tick,
+             "measures": (next_tick - tick) // (4 * ticks_per_quarter)}
+            for (tick, name), (next_tick, _) in zip(markers[:-1], markers[1:])]
+
+def _chunk_name(data, start, end):
+    # Track name of a chunk from its first event, without decoding the rest
+    delta, pos = read_vlq(data, start)
+    if pos + 2 > end or data[pos] != 0xFF or data[pos + 1] != 0x03:
+        return None
+    length, pos = read_vlq(data, pos + 2)
+    return bytes(data[pos:pos + length]).decode("utf-8", errors="replace")
+
+def _section_event(data, start, end, index):
+    # Position of a section's event in a track chunk, found without decoding
+    # the track, and the position and value of its end tick field
+    fields = SECTION_EVENT_ID + struct.pack(">I", index)
+    pattern = b"\xff\x7f" + encode_vlq(len(SECTION_EVENT_ID) + SECTION_EVENT.size) + fields
+    pos = data.find(pattern, start, end)
+    if pos < 0:
+        raise ValueError("Song has no section events in its tracks (songs get them from SMF export)")
+    end_field = pos + len(pattern)
+    return end_field + 4, end_field, struct.unpack(">I", data[end_field:end_field + 4])[0]
+
+def _tag_fields(tag, index):
+    # Section (the one of the 31 nearest to index) and overlap held by a note-off tag
+    overlap = (tag - 1) % 4
+    return index + ((tag - 1) // 4 - index % 31 + 15) % 31 - 15, overlap
+
+def _decode_span(data, pos, end, tick, index, last_tick):
+    """
+    Decode the events of a track from a section's start on
+
+    Note-offs are paired with their note-on by their tag (see
+    midi_writer.section_tag()). Decoding goes on past last_tick until every
+    note started by then has ended, so the section of all of them is known.
+
+    Returns:
+    - (events, earlier, position of the first event left, its tick): events
+      are [tick, kind, pitch, section, note, encoded event without delta]
+      lists, kind 0 for other events, 1 for note-offs and 2 for note-ons;
+      earlier holds the overlap of notes that started before the span with
+      notes that did too (see midi_writer.tag_note_offs())
+    """
+    events = []
+    earlier = {}
+    sounding = {}
+    open_notes = 0
+    status = 0
+    while pos < end:
+        delta, event_start = read_vlq(data, pos)
+        if (tick + delta > last_tick and not open_notes) or data[event_start:event_start + 2] == b"\xff\x2f":
+            return events, earlier, pos, tick + delta
+        tick += delta
+
+        body = event_start
+        if data[body] & 0x80:
+            status = data[body]
+            body += 1
+        kind = status & 0xF0
+        if status == 0xFF:
+            length, body = read_vlq(data, body + 1)
+            body += length
+        elif status in (0xF0, 0xF7):
+            length, body = read_vlq(data, body)
+            body += length
+        else:
+            body += 1 if kind in (0xC0, 0xD0) else 2
+        encoded = bytes([status]) + data[event_start + (data[event_start] >> 7):body]
+        pos = body
+
+        if kind == 0x90 and encoded[2] > 0:
+            sounding.setdefault((status & 0x0F, encoded[1]), []).append(len(events))
+            open_notes += 1
+            events.append([tick, 2, encoded[1], None, len(events), encoded])
+        elif kind in (0x80, 0x90):
+            section, overlap = _tag_fields(encoded[2], index)
+            later = sounding.get((status & 0x0F, encoded[1]), [])
+            if len(later) > overlap:
+                note = later.pop(len(later) - 1 - overlap)
+                events[note][3] = section
+                open_notes -= 1
+            else:
+                # Started before the span
+                note = -1 - len(events)
+                earlier[note] = overlap - len(later)
+            events.append([tick, 1, encoded[1], section, note, encoded])
+        else:
+            section = index
+            if status == 0xFF and encoded[1] == 0x7F and encoded[3:3 + len(SECTION_EVENT_ID)] == SECTION_EVENT_ID:
+                section = SECTION_EVENT.unpack_from(encoded, 3 + len(SECTION_EVENT_ID))[0]
+            events.append([tick, 0, 0, section, None, encoded])
+    raise ValueError("Track ends without an end of track event")
+
+def regenerate_part(filename, section_index, part, output=None, seed=None, song_key=60, song_scale="major",
+                    melody_mode="compiled"):
+    """
+    Render one part of one section of a generated song again and splice it in
+
+    Only that section is rendered, and only its stretch of the part's track
+    is decoded and encoded again: the other tracks and the rest of the
+    part's track are copied byte for byte. Songs written with SMF export
+    tag every note with the section that produced it (see
+    midi_writer.SMFStreamWriter), so the section's notes are replaced
+    wherever they are, including a lead melody running on past the
+    section's end, and notes of other sections sounding in it are kept.
+
+    Regenerating with the section's own seed from the song (see
+    generate_multi_instrument_song()) gives back the same file.
+
+    Args:
+    - filename: MIDI file written by generate_multi_instrument_song() with SMF export
+    - section_index: Index of the section in the song structure
+    - part: Track name in SONG_TRACKS ("lead", "pad", "bass", "rhythm", "drums")
+    - output: File to write (filename itself if omitted; replaced atomically)
+    - seed: Optional int or np.random.SeedSequence for the new notes
+    - song_key, song_scale: Key and scale the song was generated in
+    - melody_mode: Inference mode for a model lead melody (see generate_model_melodies())
+
+    Returns:
+    - Path to the written file
+    """
+    if part not in fim.TRACK_INDEX:
+        raise ValueError(f"Unknown part '{part}', expected one of {', '.join(fim.TRACK_INDEX)}")
+
+    with open(filename, "rb") as f:
+        data = f.read()
+    _, ticks_per_quarter, chunks = smf_chunks(data)
+
+    sections = song_sections(data)
+    if not 0 <= section_index < len(sections):
+        raise IndexError(f"Section {section_index} out of range, the song has {len(sections)}")
+    section = sections[section_index]
+
+    track_index = fim.TRACK_INDEX[part]
+    chunk_index = next((i for i, (chunk_type, start, end) in enumerate(chunks)
+                        if i > 0 and chunk_type == b"MTrk" and _chunk_name(data, start, end) == part), None)
+    if chunk_index is None:
+        raise ValueError(f"Song has no '{part}' track")
+    _, start, end = chunks[chunk_index]
+    span_start, end_field, old_end_tick = _section_event(data, start, end, section_index)
+
+    # Render the section as the song builder would, and keep the part's notes.
+    # The model melody changes how many random draws the other parts get, so
+    # it's generated whatever the part.
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    model_melody = None
+    melody_model = fim.song_melody_model()
+    if melody_model is not None and section["name"] in ["verse", "chorus"]:
+        model_melody = fim.generate_model_melodies(
+            melody_model, [section["measures"] * 16], [fim.section_complexity(section["name"])],
+            seeds=[fim.section_melody_seed(seed)], mode=melody_mode, song_key=song_key, song_scale=song_scale)[0]
+    fim.seed_random_state(seed)
+    rendered = fim.render_section(section["name"], section["measures"], song_key, song_scale,
+                                  model_melody=model_melody)
+    new_ticks, new_status, new_data1, new_data2, new_notes = note_messages(
+        rendered[rendered["track"] == track_index], ticks_per_quarter, section["start"] / ticks_per_quarter,
+        first_note=len(data))
+    new_end_tick = int(new_ticks.max()) if len(new_ticks) else section["start"]
+
+    # Swap the section's notes in its stretch of the track
+    events, earlier, next_event, next_tick = _decode_span(data, span_start, end, section["start"], section_index,
+                                                          max(old_end_tick, new_end_tick))
+    kept = [event for event in events if event[1] == 0 or event[3] != section_index]
+    replaced = (len(events) - len(kept)) // 2
+    kept += [[tick, 2 if status & 0xF0 == 0x90 else 1, pitch, section_index, note, bytes([status, pitch, velocity])]
+             for tick, status, pitch, velocity, note in zip(new_ticks.tolist(), new_status.tolist(),
+                                                            new_data1.tolist(), new_data2.tolist(),
+                                                            new_notes.tolist())]
+    # In the writer's order: of messages alike, the earlier section's first
+    later = len(sections)
+    kept = [kept[i] for i in np.lexsort((np.arange(len(kept)),
+                                         [later if event[3] is None else event[3] for event in kept],
+                                         [event[2] for event in kept], [event[1] for event in kept],
+                                         [event[0] for event in kept]))]
+
+    # Tag the note-offs again: the new notes change which notes overlap
+    notes = [event for event in kept if event[1]]
+    releases = tag_note_offs(np.array([event[5][0] for event in notes]), np.array([event[2] for event in notes]),
+                             np.array([event[4] for event in notes]),
+                             np.array([0 if event[3] is None else event[3] for event in notes]), {}, earlier)
+    for event, release in zip(notes, releases.tolist()):
+        if event[1] == 1:
+            event[5] = event[5][:2] + bytes([release])
+
+    span = []
+    tick = section["start"]
+    for event in kept:
+        span.append(encode_vlq(event[0] - tick) + event[5])
+        tick = event[0]
+    _, pos = read_vlq(data, next_event)
+    body = b"".join([data[start:end_field], struct.pack(">I", new_end_tick), data[end_field + 4:span_start],
+                     *span, encode_vlq(max(next_tick - tick, 0)), data[pos:end]])
+
+    if output is None:
+        output = filename
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(data[:start - 8])
+            f.write(track_chunk(body))
+            f.write(data[end:])
+        os.replace(temp_path, output)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    print(f"✅ Regenerated {part} in section {section_index} ({section['name']}): "
+          f"{replaced} notes replaced by {len(new_ticks) // 2}, saved as {output}")
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(description="Regenerate one part of one section of a generated song")
+    parser.add_argument("song", help="MIDI file written by full_instrumental_melody.py")
+    parser.add_argument("section", type=int, nargs="?", help="Section index (lists the sections if omitted)")
+    parser.add_argument("part", nargs="?", choices=list(fim.TRACK_INDEX))
+    parser.add_argument("--output", default=None, help="Output file (edits the song in place if omitted)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--key", type=int, default=60, help="Key the song was generated in (MIDI root note)")
+    parser.add_argument("--scale", default="major", help="Scale the song was generated in")
+    parser.add_argument("--no-model", action="store_true", help="Scale-based lead melody only")
+    args = parser.parse_args()
+
+    if args.section is None or args.part is None:
+        with open(args.song, "rb") as f:
+            sections = song_sections(f.read())
+        for i, section in enumerate(sections):
+            print(f"{i:3d}  {section['name']:8s} {section['measures']:3d} measures")
+        return
+
+    if args.no_model:
+        fim.melody_model = None
+    start = time.perf_counter()
+    regenerate_part(args.song, args.section, args.part, output=args.output, seed=args.seed,
+                    song_key=args.key, song_scale=args.scale)
+    print(f"   in {time.perf_counter() - start:.3f}s")
+
+if __name__ == "__main__":
+    main()
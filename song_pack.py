@@ -0,0 +1,223 @@
+import argparse
+import json
+import mmap
+import os
+import time
+from song_cache import seed_description
+
+# Shards are closed and a new one started past this size
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+class PackWriter:
+    """
+    Append songs to large shard files instead of one file per song
+
+    Every writer owns its shards ("<writer>-<n>.pack") and an index file
+    ("<writer>.idx") with one JSON line per song: id, shard, offset, length,
+    seed and parameters. Parallel workers each open their own writer (named
+    after the process by default), so nothing is shared and nothing needs
+    locking. A song's bytes are flushed before its index line, so a reader
+    never finds an entry for data that isn't there; an interrupted write
+    leaves at most a partial last line, which readers skip.
+
+    Reopening a writer name appends to its last shard.
+    """
+
+    def __init__(self, directory, writer=None, shard_bytes=DEFAULT_SHARD_BYTES):
+        self.directory = directory
+        self.writer = str(os.getpid()) if writer is None else writer
+        self.shard_bytes = shard_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Continue after the last shard this writer left behind
+        numbers = [int(name[len(self.writer) + 1:-5]) for name in os.listdir(directory)
+                   if name.startswith(self.writer + "-") and name.endswith(".pack")
+                   and name[len(self.writer) + 1:-5].isdigit()]
+        self._number = max(numbers, default=0)
+        self._shard = None
+        index_path = os.path.join(directory, self.writer + ".idx")
+        self._index = open(index_path, "a", encoding="utf-8")
+        if self._index.tell():
+            with open(index_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # Close the partial line of an interrupted run, so it can't swallow the next one
+                    self._index.write("\n")
+
+    def _shard_name(self):
+        return f"{self.writer}-{self._number:05d}.pack"
+
+    def add(self, song_id, data, seed=None, params=None):
+        """
+        Append one song
+
+        Args:
+        - song_id: Unique name of the song (str)
+        - data: Encoded MIDI bytes
+        - seed: int or np.random.SeedSequence the song was generated with
+        - params: JSON-serializable dict of the song's parameters
+
+        Returns:
+        - Index entry of the song
+        """
+        if self._shard is None:
+            self._shard = open(os.path.join(self.directory, self._shard_name()), "ab")
+        offset = self._shard.tell()
+        if offset and offset + len(data) > self.shard_bytes:
+            self._shard.close()
+            self._number += 1
+            self._shard = open(os.path.join(self.directory, self._shard_name()), "ab")
+            offset = self._shard.tell()
+
+        self._shard.write(data)
+        self._shard.flush()
+
+        entry = {"id": song_id, "shard": self._shard_name(), "offset": offset, "length": len(data),
+                 "seed": seed_description(seed), "params": params}
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+        return entry
+
+    def close(self):
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class PackReader:
+    """
+    Look up songs of a pack directory by id and read them through mmap
+
+    The index files are read once when the reader opens (refresh() picks up
+    songs added since); a lookup is then a dict access and a slice of the
+    shard's memory map, whatever the number of songs. A song added twice
+    under the same id resolves to the last copy.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = {}
+        self._positions = {}
+        self._maps = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Read index lines written since the last refresh
+
+        Returns:
+        - Number of new entries
+        """
+        added = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".idx"):
+                continue
+            with open(os.path.join(self.directory, name), "rb") as f:
+                f.seek(self._positions.get(name, 0))
+                data = f.read()
+            # Only whole lines: a writer may be halfway through the last one
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Partial line of an interrupted writer
+                    continue
+                self.index[entry["id"]] = entry
+                added += 1
+            self._positions[name] = self._positions.get(name, 0) + len(complete)
+        return added
+
+    def _map(self, shard, end):
+        # Memory map of a shard covering at least `end` bytes
+        memory_map = self._maps.get(shard)
+        if memory_map is None or len(memory_map) < end:
+            # First read of the shard, or it grew since it was mapped
+            if memory_map is not None:
+                memory_map.close()
+            with open(os.path.join(self.directory, shard), "rb") as f:
+                memory_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = memory_map
+        return memory_map
+
+    def get(self, song_id):
+        """
+        Return the MIDI bytes of a song
+
+        Raises:
+        - KeyError: No song with that id
+        """
+        entry = self.index[song_id]
+        end = entry["offset"] + entry["length"]
+        return self._map(entry["shard"], end)[entry["offset"]:end]
+
+    def extract(self, song_id, filename):
+        """
+        Save one song as a .mid file
+
+        Returns:
+        - The filename
+        """
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(self.get(song_id))
+        return filename
+
+    def entry(self, song_id):
+        """
+        Index entry (shard, offset, length, seed, params) of a song
+        """
+        return self.index[song_id]
+
+    def ids(self):
+        return list(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, song_id):
+        return song_id in self.index
+
+    def close(self):
+        for memory_map in self._maps.values():
+            memory_map.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="List or extract the songs of a pack directory")
+    parser.add_argument("directory", help="Pack directory written by generate_batch.py --pack")
+    parser.add_argument("ids", nargs="*", help="Song ids to extract (lists the pack if omitted)")
+    parser.add_argument("--output-dir", default="output", help="Where extracted songs are saved")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with PackReader(args.directory) as reader:
+        opened = time.perf_counter() - start
+        if not args.ids:
+            shards = {entry["shard"] for entry in reader.index.values()}
+            total = sum(entry["length"] for entry in reader.index.values())
+            print(f"📦 {len(reader)} songs ({total / 1e6:.1f} MB) in {len(shards)} shards, "
+                  f"index read in {opened:.3f}s")
+            return
+        for song_id in args.ids:
+            if song_id not in reader:
+                parser.error(f"No song '{song_id}' in {args.directory}")
+            filename = reader.extract(song_id, os.path.join(args.output_dir, song_id + ".mid"))
+            print(f"✅ {song_id} saved as {filename}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import os
+# Disable GPU to avoid CUDA errors
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import argparse
+import contextlib
+import io
+import json
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from melody_inference import WINDOW_SIZE
+from music_theory import SCALES
+
+# Notes per shard before a new one is started (int16 pitches plus float32 durations: 6 bytes a note)
+DEFAULT_SHARD_NOTES = 1 << 22
+
+# Window index entries: shard number and offset of the window's first note in it
+WINDOW_DTYPE = np.dtype([("shard", np.uint32), ("start", np.uint32)])
+
+# Generators export_training_data() can draw melodies from
+GENERATORS = ["scale", "model"]
+
+# Complexities melodies are drawn with, like the song sections use
+COMPLEXITIES = [0.7, 1.0, 1.5]
+
+def window_starts(lengths, window=WINDOW_SIZE):
+    """
+    Offsets of every window (plus the note after it) inside sequences stored back to back
+
+    Args:
+    - lengths: Notes in every sequence
+    - window: Notes per window
+
+    Returns:
+    - int64 array of window start offsets
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    counts = np.maximum(lengths - window, 0)
+    sequence_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    first_window = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.repeat(sequence_starts - first_window, counts) + np.arange(counts.sum())
+
+def generate_training_melodies(generator, count, length, rng, model=None):
+    """
+    Generate one batch of melodies to export
+
+    Args:
+    - generator: "scale" for create_musical_melodies(), "model" for the melody model
+    - count: Number of melodies
+    - length: Notes per melody
+    - rng: np.random.RandomState choosing the batch's settings and seeds
+    - model: Melody model for "model" (Keras, MarkovMelodyModel or TFLiteMelodyModel)
+
+    Returns:
+    - (pitches, durations): arrays of shape (count, length), -1 pitches for rests
+    """
+    from full_instrumental_melody import create_musical_melodies, generate_model_melodies
+
+    complexity = COMPLEXITIES[rng.randint(len(COMPLEXITIES))]
+    if generator == "scale":
+        scale_type = list(SCALES)[rng.randint(len(SCALES))]
+        start_note = int(rng.randint(60, 72)) + 12
+        pitches, durations = create_musical_melodies(count, length=length, scale_type=scale_type,
+                                                     start_note=start_note, complexity=complexity, rng=rng)
+        return pitches, np.broadcast_to(durations, pitches.shape)
+
+    seeds = rng.randint(2 ** 31, size=count).tolist()
+    with contextlib.redirect_stdout(io.StringIO()):
+        melodies = generate_model_melodies(model, [length] * count, [complexity] * count, seeds=seeds)
+    melodies = np.stack(melodies)
+    return melodies["pitch"], melodies["duration"]
+
+class WindowShardWriter:
+    """
+    Write pitch/duration sequences to .npy shards with an index of their windows
+
+    Sequences are stored back to back, rests left out, in shards of
+    pitch-NNNNN.npy (int16), duration-NNNNN.npy (float32) and lengths-NNNNN.npy files
+    of about shard_notes notes each. close() writes windows.npy, every
+    window of `window` notes that has a next note to predict (WINDOW_DTYPE:
+    shard and start), and index.json. Every file is a plain .npy array, so
+    MelodyWindows opens them as memory maps.
+    """
+
+    def __init__(self, directory, shard_notes=DEFAULT_SHARD_NOTES, window=WINDOW_SIZE):
+        self.directory = directory
+        self.shard_notes = shard_notes
+        self.window = window
+        self.shards = []
+        self._windows = []
+        self._pitches, self._durations, self._lengths = [], [], []
+        self._notes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, pitches, durations):
+        """
+        Append sequences
+
+        Rests (negative pitches) are dropped first: the melody model has no
+        rest class, so only notes are stored and every window (and the note
+        it predicts) is made of notes.
+
+        Args:
+        - pitches: Iterable of pitch arrays
+        - durations: Iterable of duration arrays of the same lengths
+        """
+        for sequence_pitches, sequence_durations in zip(pitches, durations):
+            notes = np.asarray(sequence_pitches) >= 0
+            if not notes.all():
+                sequence_pitches = np.asarray(sequence_pitches)[notes]
+                sequence_durations = np.asarray(sequence_durations)[notes]
+            self._pitches.append(sequence_pitches)
+            self._durations.append(sequence_durations)
+            self._lengths.append(len(sequence_pitches))
+            self._notes += len(sequence_pitches)
+        if self._notes >= self.shard_notes:
+            self._flush()
+
+    def _flush(self):
+        # Write the pending sequences as one shard
+        if not self._lengths:
+            return
+        number = len(self.shards)
+        np.save(os.path.join(self.directory, f"pitch-{number:05d}.npy"),
+                np.concatenate(self._pitches).astype(np.int16))
+        np.save(os.path.join(self.directory, f"duration-{number:05d}.npy"),
+                np.concatenate(self._durations).astype(np.float32))
+        np.save(os.path.join(self.directory, f"lengths-{number:05d}.npy"), np.array(self._lengths, dtype=np.int64))
+
+        starts = window_starts(self._lengths, self.window)
+        entries = np.zeros(len(starts), dtype=WINDOW_DTYPE)
+        entries["shard"] = number
+        entries["start"] = starts
+        self._windows.append(entries)
+        self.shards.append({"notes": self._notes, "sequences": len(self._lengths), "windows": len(entries)})
+        self._pitches, self._durations, self._lengths = [], [], []
+        self._notes = 0
+
+    def close(self, **metadata):
+        """
+        Write the last shard, the window index and index.json
+
+        Args:
+        - metadata: Extra JSON-serializable entries for index.json
+
+        Returns:
+        - Metadata dict saved as index.json
+        """
+        self._flush()
+        windows = np.concatenate(self._windows) if self._windows else np.zeros(0, dtype=WINDOW_DTYPE)
+        np.save(os.path.join(self.directory, "windows.npy"), windows)
+
+        metadata = {"window": self.window, **metadata, "shards": self.shards, "windows": len(windows)}
+        with open(os.path.join(self.directory, "index.json"), "w") as f:
+            json.dump(metadata, f, indent=2)
+        return metadata
+
+def export_training_data(directory, count, generators=("scale",), model=None, length=256, seed=0,
+                         shard_notes=DEFAULT_SHARD_NOTES, batch_size=256, window=WINDOW_SIZE):
+    """
+    Generate melodies in bulk and save them as training windows (see WindowShardWriter)
+
+    Args:
+    - directory: Output folder
+    - count: Number of melodies
+    - generators: Generators to take turns with, batch by batch ("scale", "model")
+    - model: Melody model used by the "model" generator
+    - length: Notes per melody (more than window)
+    - seed: Seed of the whole export
+    - shard_notes: Notes per shard
+    - batch_size: Melodies generated together
+    - window: Notes per training window
+
+    Returns:
+    - Metadata dict, also saved as index.json
+    """
+    if length <= window:
+        raise ValueError(f"Melodies need more than {window} notes to hold a window")
+    if "model" in generators and model is None:
+        raise ValueError("The model generator needs a melody model")
+    batches = (count + batch_size - 1) // batch_size
+    batch_seeds = np.random.SeedSequence(seed).spawn(batches)
+
+    writer = WindowShardWriter(directory, shard_notes=shard_notes, window=window)
+    for number, batch_seed in enumerate(batch_seeds):
+        size = min(batch_size, count - number * batch_size)
+        generator = generators[number % len(generators)]
+        rng = np.random.RandomState(batch_seed.generate_state(1)[0])
+        writer.add(*generate_training_melodies(generator, size, length, rng, model))
+
+    return writer.close(length=length, count=count, generators=list(generators), seed=seed)
+
+class MelodyWindows:
+    """
+    Training windows of an export_training_data() folder, read through memory maps
+
+    Nothing is parsed or loaded up front: shards and the window index are
+    np.load(mmap_mode="r") arrays, window_at() returns views into them, and
+    batch() gathers windows straight from the maps into one array per batch
+    (through sliding_window_view(), itself a view).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            self.metadata = json.load(f)
+        self.window = self.metadata["window"]
+        self.pitches = [np.load(os.path.join(directory, f"pitch-{i:05d}.npy"), mmap_mode="r")
+                        for i in range(len(self.metadata["shards"]))]
+        self.durations = [np.load(os.path.join(directory, f"duration-{i:05d}.npy"), mmap_mode="r")
+                          for i in range(len(self.metadata["shards"]))]
+        self.windows = np.load(os.path.join(directory, "windows.npy"), mmap_mode="r")
+
+        # Every window plus its next note, as views over the shards
+        self._pitch_views = [sliding_window_view(shard, self.window + 1) for shard in self.pitches]
+        self._duration_views = [sliding_window_view(shard, self.window) for shard in self.durations]
+
+    def __len__(self):
+        return len(self.windows)
+
+    def window_at(self, index):
+        """
+        One training example as views into the shards
+
+        Returns:
+        - (pitches, durations, next pitch)
+        """
+        shard, start = int(self.windows[index]["shard"]), int(self.windows[index]["start"])
+        pitches = self.pitches[shard]
+        return (pitches[start:start + self.window], self.durations[shard][start:start + self.window],
+                pitches[start + self.window])
+
+    def batch(self, indices):
+        """
+        Gather windows into model inputs
+
+        Args:
+        - indices: Window numbers
+
+        Returns:
+        - (inputs, durations, targets): float32 pitches of shape (B, window, 1)
+          like the melody model takes, float32 durations (B, window) and
+          int16 next pitches (B,)
+        """
+        entries = self.windows[np.asarray(indices)]
+        pitches = np.empty((len(entries), self.window + 1), dtype=np.int16)
+        durations = np.empty((len(entries), self.window), dtype=np.float32)
+        for shard in np.unique(entries["shard"]):
+            rows = np.flatnonzero(entries["shard"] == shard)
+            starts = entries["start"][rows]
+            pitches[rows] = self._pitch_views[shard][starts]
+            durations[rows] = self._duration_views[shard][starts]
+        return pitches[:, :-1, np.newaxis].astype(np.float32), durations, pitches[:, -1]
+
+    def batches(self, batch_size=64, shuffle=True, seed=0, epochs=1):
+        """
+        Yield batch() results over every window
+
+        Args:
+        - batch_size: Windows per batch
+        - shuffle: Visit the windows in a random order each epoch
+        - seed: Seed of the order
+        - epochs: Passes over the data
+        """
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(self)) if shuffle else np.arange(len(self))
+            for position in range(0, len(order), batch_size):
+                # Sorted within the batch, so each shard is read front to back
+                yield self.batch(np.sort(order[position:position + batch_size]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Export generated melodies as memory-mapped training windows")
+    parser.add_argument("output", help="Output folder")
+    parser.add_argument("--count", type=int, default=10000, help="Melodies to generate")
+    parser.add_argument("--length", type=int, default=256, help="Notes per melody")
+    parser.add_argument("--generator", nargs="+", choices=GENERATORS, default=["scale"],
+                        help="Generators to take turns with, batch by batch")
+    parser.add_argument("--model", default=None, help="Melody model for the model generator (.h5, .npz, .tflite)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard-notes", type=int, default=DEFAULT_SHARD_NOTES)
+    parser.add_argument("--batch-size", type=int, default=256, help="Melodies generated together")
+    args = parser.parse_args()
+
+    model = None
+    if "model" in args.generator:
+        from melody_inference import MELODY_MODEL_PATH, load_melody_model
+        model = load_melody_model(args.model or MELODY_MODEL_PATH)
+        if model is None:
+            parser.error("The model generator needs a melody model")
+
+    start = time.perf_counter()
+    metadata = export_training_data(args.output, args.count, generators=args.generator, model=model,
+                                    length=args.length, seed=args.seed, shard_notes=args.shard_notes,
+                                    batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    notes = sum(shard["notes"] for shard in metadata["shards"])
+    print(f"✅ {args.count} melodies ({notes} notes, {metadata['windows']} windows) in "
+          f"{len(metadata['shards'])} shards, saved to {args.output} in {elapsed:.2f}s")
+
+    # Reading speed of shuffled batches
+    data = MelodyWindows(args.output)
+    begin = time.perf_counter()
+    batches = 0
+    for batches, _ in enumerate(data.batches(batch_size=256), 1):
+        if batches == 200:
+            break
+    elapsed = time.perf_counter() - begin
+    print(f"   shuffled reads: {batches * 256 / elapsed:,.0f} windows/sec in batches of 256")
+
+if __name__ == "__main__":
+    main()